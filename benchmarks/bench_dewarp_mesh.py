@@ -0,0 +1,49 @@
+"""
+Benchmark the dewarp mesh builders
+
+Compare the vectorized builder with the serial and multiprocessing loop builders.
+
+    python benchmarks/bench_dewarp_mesh.py --size 720
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from fisheyewarping import FisheyeWarping
+
+ENGINES = {
+    'vectorized': dict(use_vectorization=True),
+    'serial': dict(use_vectorization=False, use_multiprocessing=False),
+    'multiprocessing': dict(use_vectorization=False, use_multiprocessing=True),
+}
+
+def time_engine(img, engine):
+    frd = FisheyeWarping(img, mesh_cache=False, **ENGINES[engine])
+    st = time.perf_counter()
+    # the loop builders print and draw progress bars
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        _, mapx, mapy = frd.build_dewarp_mesh()
+    return time.perf_counter() - st, mapx, mapy
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=720, help='Width and height of the synthetic fisheye image. Default is `720`.')
+    parser.add_argument('--engines', type=str, nargs='+', default=list(ENGINES), choices=list(ENGINES), help='Engines to benchmark.')
+    args = parser.parse_args()
+
+    img = np.zeros((args.size, args.size, 3), dtype=np.uint8)
+    results = {engine: time_engine(img, engine) for engine in args.engines}
+
+    base = results.get('vectorized')
+    for engine, (seconds, mapx, mapy) in results.items():
+        line = f'{engine:>16}: {seconds:9.3f} s'
+        if base and engine != 'vectorized':
+            same = np.array_equal(mapx, base[1]) and np.array_equal(mapy, base[2])
+            line += f'  ({seconds / base[0]:8.1f}x slower than vectorized, identical maps: {same})'
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark fixed-point remapping
+
+Measure the speed and the error of `map_type='fixed'` against the float maps.
+
+    python benchmarks/bench_fixed_point.py --size 1440
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping
+
+def best_of(func, repeat):
+    times = list()
+    for _ in range(repeat):
+        st = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - st)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1440, help='Width and height of the synthetic fisheye image. Default is `1440`.')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per method. Default is `10`.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    frds = dict()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for map_type in FisheyeWarping.MAP_TYPES:
+            frd = FisheyeWarping(img, mesh_cache=False, map_type=map_type)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            frds[map_type] = frd
+
+    panorama = frds['float'].dewarp(img)
+    inputs = {
+        'noise': rng.integers(0, 256, panorama.shape, dtype=np.uint8),
+        'smooth': cv2.GaussianBlur(rng.integers(0, 256, panorama.shape, dtype=np.uint8), (0, 0), 3),
+    }
+    for method in ('dewarp', 'rewarp'):
+        seconds = dict()
+        for map_type, frd in frds.items():
+            func = (lambda: frd.dewarp(img, flip=True)) if method == 'dewarp' else (lambda: frd.rewarp(inputs['noise']))
+            seconds[map_type] = best_of(func, args.repeat)
+        print(f'{method}: float {seconds["float"] * 1000:.2f} ms, fixed {seconds["fixed"] * 1000:.2f} ms ({seconds["float"] / seconds["fixed"]:.2f}x)')
+        sources = {'fisheye': img} if method == 'dewarp' else inputs
+        for name, source in sources.items():
+            results = [getattr(frd, method)(source) for frd in frds.values()]
+            diff = np.abs(results[0].astype(int) - results[1])
+            print(f'    {name:>8} input: max error {diff.max()}, mean error {diff.mean():.4f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark the streaming dewarp pipeline
+
+Compare a naive decode -> remap -> encode loop with `WarpStream` on a synthetic
+fisheye video.
+
+    python benchmarks/bench_stream.py --size 1440 --frames 120
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, WarpStream
+
+def make_video(path, size, frames, fourcc):
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), 30, (size, size))
+    for i in range(frames):
+        writer.write(np.roll(base, i, axis=1))
+    writer.release()
+    return base
+
+def naive(frd, source, output, fourcc):
+    st = time.perf_counter()
+    capture = cv2.VideoCapture(str(source))
+    writer = None
+    frames = 0
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        result = frd.dewarp(frame, flip=True)
+        if writer is None:
+            h, w = result.shape[:2]
+            writer = cv2.VideoWriter(str(output), cv2.VideoWriter_fourcc(*fourcc), 30, (w, h))
+        writer.write(result)
+        frames += 1
+    capture.release()
+    writer.release()
+    return frames / (time.perf_counter() - st)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1440, help='Width and height of the synthetic fisheye video. Default is `1440`.')
+    parser.add_argument('--frames', type=int, default=120, help='Number of frames. Default is `120`.')
+    parser.add_argument('--fourcc', type=str, default='MJPG', help='Codec of the input and output videos. Default is `MJPG`.')
+    parser.add_argument('--queue_size', type=int, default=8, help='Queue size of `WarpStream`. Default is `8`.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp, 'fisheye.avi')
+        first_frame = make_video(source, args.size, args.frames, args.fourcc)
+        frd = FisheyeWarping(first_frame, mesh_cache=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            frd.build_dewarp_mesh()
+
+        naive_fps = naive(frd, source, Path(tmp, 'naive.avi'), args.fourcc)
+        stats = WarpStream(frd, queue_size=args.queue_size).write(source, Path(tmp, 'stream.avi'), fourcc=args.fourcc)
+
+    print(f'      naive loop: {naive_fps:8.2f} FPS')
+    print(f'      WarpStream: {stats.fps:8.2f} FPS  ({stats.fps / naive_fps:.2f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark suite
+
+Time mesh building, per-frame remapping, mesh save/load and the whole command
+line run on synthetic fisheye images from 720p to 8K, with 1 and 3 channels,
+and check the outputs against golden digests so that optimizations cannot
+silently change pixels.
+
+    python benchmarks/bench_suite.py --sizes 720p 1080p --channels 1 3 --output results.json
+    python benchmarks/bench_suite.py --sizes 720p --update_golden
+
+Each size and channel count runs in a fresh process, so `peak_rss_mb` is the
+peak of that case alone. The loop builders (`serial`, `multiprocessing`) are
+slow and only run up to `--loop_max_size`. The exit code is 1 if any golden
+check fails.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping
+
+# Width and height of the square fisheye image of each frame size.
+SIZES = {
+    '720p': 720,
+    '1080p': 1080,
+    '1440p': 1440,
+    '4k': 2160,
+    '8k': 4320,
+}
+
+LOOP_ENGINES = {
+    'serial': dict(use_vectorization=False, use_multiprocessing=False),
+    'multiprocessing': dict(use_vectorization=False, use_multiprocessing=True),
+}
+
+GOLDEN_PATH = Path(__file__).with_name('golden.json')
+
+# `fisheyewarping` of the console scripts, with the interpreter running the suite.
+CLI = [sys.executable, '-c', 'from fisheyewarping.cli import main; main()']
+
+def synthetic_fisheye(size, channels):
+    """ A deterministic, smooth image inside the fisheye circle. """
+    rng = np.random.default_rng(size * 10 + channels)
+    small = rng.integers(0, 256, (32, 32, channels), dtype=np.uint8)
+    img = cv2.resize(small, (size, size), interpolation=cv2.INTER_CUBIC).reshape(size, size, channels)
+    yy, xx = np.ogrid[:size, :size]
+    outside = (xx - size / 2) ** 2 + (yy - size / 2) ** 2 > (size / 2) ** 2
+    img[outside] = 0
+    return img[:, :, 0] if channels == 1 else img
+
+def digest(*arrays):
+    sha = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update(repr((array.dtype.str, array.shape)).encode('utf-8'))
+        sha.update(array.tobytes())
+    return sha.hexdigest()
+
+def quietly(func, *args, **kwargs):
+    # the library prints and draws progress bars
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return func(*args, **kwargs)
+
+def same_arrays(arrays, others):
+    # the rewarp maps hold NaN at the center
+    return all(np.array_equal(a, b, equal_nan=a.dtype.kind == 'f') for a, b in zip(arrays, others))
+
+def measure(func, repeat, pixels):
+    """ Runs `func` `repeat` times and returns its latency statistics and last result. """
+    seconds = list()
+    for _ in range(repeat):
+        st = time.perf_counter()
+        result = quietly(func)
+        seconds.append(time.perf_counter() - st)
+    return statistics(seconds, pixels), result
+
+def measure_cli(args, repeat, pixels):
+    """ Runs the command line `repeat` times and returns its wall time statistics. """
+    seconds = list()
+    for _ in range(repeat):
+        st = time.perf_counter()
+        subprocess.run(CLI + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        seconds.append(time.perf_counter() - st)
+    return statistics(seconds, pixels)
+
+def statistics(seconds, pixels):
+    seconds = np.asarray(seconds)
+    mean = float(seconds.mean())
+    return dict(
+        runs=len(seconds),
+        mean_ms=mean * 1000,
+        p50_ms=float(np.percentile(seconds, 50)) * 1000,
+        p95_ms=float(np.percentile(seconds, 95)) * 1000,
+        p99_ms=float(np.percentile(seconds, 99)) * 1000,
+        per_second=1 / mean if mean > 0 else 0.0,
+        megapixels_per_second=pixels / mean / 1e6 if mean > 0 else 0.0,
+    )
+
+def run_case(size_name, channels, repeat, loop_max_size):
+    size = SIZES[size_name]
+    img = synthetic_fisheye(size, channels)
+    results = dict()
+    digests = dict()
+
+    frd = FisheyeWarping(img, mesh_cache=False, verbose=False)
+    (panorama_w, panorama_h), _, _ = quietly(frd.build_dewarp_mesh)
+    panorama_pixels = panorama_w * panorama_h
+    results['build_dewarp_mesh'], (_, *dewarp_maps) = measure(frd.build_dewarp_mesh, max(1, repeat // 5), panorama_pixels)
+    results['build_rewarp_mesh'], rewarp_maps = measure(frd.build_rewarp_mesh, max(1, repeat // 5), size * size)
+    digests['dewarp_mesh'] = digest(*dewarp_maps)
+    digests['rewarp_mesh'] = digest(*rewarp_maps)
+
+    if size <= loop_max_size:
+        for engine, options in LOOP_ENGINES.items():
+            loop_frd = FisheyeWarping(img, mesh_cache=False, verbose=False, **options)
+            stats, (_, *maps) = measure(loop_frd.build_dewarp_mesh, 1, panorama_pixels)
+            results[f'build_dewarp_mesh_{engine}'] = dict(stats, identical_to_vectorized=same_arrays(maps, dewarp_maps))
+            stats, maps = measure(loop_frd.build_rewarp_mesh, 1, size * size)
+            results[f'build_rewarp_mesh_{engine}'] = dict(stats, identical_to_vectorized=same_arrays(maps, rewarp_maps))
+
+    results['dewarp'], panorama = measure(lambda: frd.dewarp(img, flip=True), repeat, panorama_pixels)
+    results['rewarp'], rewarped = measure(lambda: frd.rewarp(panorama, flip=True), repeat, size * size)
+    results['run_rewarp_with_mesh'], rewarped_with_mesh = measure(lambda: frd.run_rewarp_with_mesh(panorama), repeat, size * size)
+    digests['dewarp'] = digest(panorama)
+    digests['rewarp'] = digest(rewarped)
+    digests['run_rewarp_with_mesh'] = digest(rewarped_with_mesh)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dewarp_path = os.path.join(tmp, 'dewarp.fwm')
+        rewarp_path = os.path.join(tmp, 'rewarp.fwm')
+        results['save_mesh'], _ = measure(lambda: (frd.build_dewarp_mesh(dewarp_path), frd.build_rewarp_mesh(rewarp_path)), max(1, repeat // 5), panorama_pixels + size * size)
+        loaded = FisheyeWarping(None, mesh_cache=False, verbose=False)
+
+        def load():
+            loaded.load_dewarp_mesh(dewarp_path)
+            loaded.load_rewarp_mesh(rewarp_path)
+        results['load_mesh'], _ = measure(load, repeat, panorama_pixels + size * size)
+        digests['loaded_dewarp'] = digest(loaded.dewarp(img, flip=True))
+
+        # end to end, with the process start, the decode, the mesh build and the encode
+        paths = {name: os.path.join(tmp, f'{name}.png') for name in ('fisheye', 'panorama', 'cli_dewarp', 'cli_rewarp')}
+        cv2.imwrite(paths['fisheye'], img)
+        cv2.imwrite(paths['panorama'], panorama)
+        results['cli'] = measure_cli([
+            '--fisheye_img_path', paths['fisheye'],
+            '--panorama_img_path', paths['panorama'],
+            '--save_dewarp_mesh_path', os.path.join(tmp, 'cli-dewarp.fwm'),
+            '--save_rewarp_mesh_path', os.path.join(tmp, 'cli-rewarp.fwm'),
+            '--panorama_output', paths['cli_dewarp'],
+            '--fisheye_output', paths['cli_rewarp'],
+            '--no_mesh_cache',
+            '--quiet',
+        ], max(1, repeat // 5), panorama_pixels + size * size)
+        for name in ('cli_dewarp', 'cli_rewarp'):
+            digests[name] = digest(cv2.imread(paths[name], cv2.IMREAD_UNCHANGED))
+
+    return dict(
+        size=size_name,
+        side=size,
+        channels=channels,
+        panorama_shape=[panorama_w, panorama_h],
+        results=results,
+        digests=digests,
+        # kilobytes on Linux, bytes on macOS
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10),
+    )
+
+def _run_case_in_child(conn, *args):
+    try:
+        conn.send(('ok', run_case(*args)))
+    except Exception as e:
+        conn.send(('error', repr(e)))
+    finally:
+        conn.close()
+
+def run_isolated(*args):
+    """ Runs `run_case` in a fresh process, so its peak RSS is its own. """
+    ctx = mp.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case_in_child, args=(child, *args))
+    process.start()
+    child.close()
+    status, value = parent.recv()
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(value)
+    return value
+
+def check_golden(cases, golden, update):
+    """ Compares the digests of every case with `golden`, in place if `update`. """
+    failed = False
+    for case in cases:
+        key = f'{case["size"]}-{case["channels"]}'
+        expected = golden.get(key, dict())
+        checks = dict()
+        for name, value in case['digests'].items():
+            if update or name not in expected:
+                checks[name] = 'new'
+                expected[name] = value
+            elif expected[name] == value:
+                checks[name] = 'pass'
+            else:
+                checks[name] = 'fail'
+                failed = True
+        # the loaded mesh and the command line must render the same pixels as the built mesh
+        for name, built in (('loaded_dewarp', 'dewarp'), ('cli_dewarp', 'dewarp'), ('cli_rewarp', 'run_rewarp_with_mesh')):
+            if case['digests'][name] != case['digests'][built]:
+                checks[name] = 'fail'
+                failed = True
+        golden[key] = expected
+        case['golden'] = checks
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, nargs='+', default=['720p', '1080p'], choices=list(SIZES), help='Frame sizes to benchmark. Default is `720p 1080p`.')
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 3], choices=[1, 3], help='Channel counts to benchmark. Default is `1 3`.')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per remap. Default is `20`.')
+    parser.add_argument('--loop_max_size', type=int, default=720, help='Largest size the serial and multiprocessing builders run at. Default is `720`.')
+    parser.add_argument('--output', type=str, default=None, help='JSON report path. Default prints it.')
+    parser.add_argument('--golden', type=str, default=str(GOLDEN_PATH), help=f'Golden digests. Default is `{GOLDEN_PATH.name}` next to this script.')
+    parser.add_argument('--update_golden', action='store_true', help='Record the digests of this run as golden.')
+    args = parser.parse_args()
+
+    cases = list()
+    for size_name in args.sizes:
+        for channels in args.channels:
+            print(f'Running {size_name} with {channels} channel(s)...', file=sys.stderr)
+            cases.append(run_isolated(size_name, channels, args.repeat, args.loop_max_size))
+
+    golden_path = Path(args.golden)
+    golden = json.loads(golden_path.read_text()) if golden_path.is_file() else dict()
+    failed = check_golden(cases, golden.setdefault('digests', dict()), args.update_golden)
+    if args.update_golden:
+        golden['opencv'] = cv2.__version__
+        golden_path.write_text(json.dumps(golden, indent=2, sort_keys=True) + '\n')
+    elif golden.get('opencv') not in (None, cv2.__version__):
+        print(f'Golden digests were recorded with OpenCV {golden["opencv"]}, this is {cv2.__version__}.', file=sys.stderr)
+
+    report = dict(
+        meta=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            opencv=cv2.__version__,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            repeat=args.repeat,
+        ),
+        cases=cases,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
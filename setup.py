@@ -45,7 +45,9 @@ setuptools.setup(
     },
     entry_points={
         'console_scripts': [
-            'fisheyewarping=fisheyewarping.cli:main'
+            'fisheyewarping=fisheyewarping.cli:main',
+            'fisheyewarping-server=fisheyewarping.server:main',
+            'fisheyewarping-client=fisheyewarping.client:main'
         ]
     }
 )
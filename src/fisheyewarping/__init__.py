@@ -1,8 +1,51 @@
 """
 Fisheye Warping Init
 """
+import importlib
+import sys
 
 __version__ = "1.0.1"
 
-from .fisheyewarping import FisheyeWarping
-from .cli import main
+# Exported names and their modules. They are imported on first use, so that
+# light entry points like `fisheyewarping.client` do not load OpenCV and NumPy.
+_EXPORTS = {
+    'FisheyeWarping': '.fisheyewarping',
+    'OutputSpec': '.geometry',
+    'CameraGeometry': '.geometry',
+    'PanoramaView': '.views',
+    'PerspectiveView': '.views',
+    'MeshCache': '.cache',
+    'default_mesh_cache': '.cache',
+    'set_default_mesh_cache': '.cache',
+    'SharedMeshRegistry': '.shared',
+    'RemapEngine': '.engine',
+    'LiveCalibration': '.calibration',
+    'IncrementalRemap': '.incremental',
+    'WarpStream': '.stream',
+    'StreamStats': '.stream',
+    'run_batch': '.batch',
+    'BatchStats': '.batch',
+    'AsyncWarping': '.aio',
+    'AsyncWarpStream': '.aio',
+    'AsyncStreamStats': '.aio',
+    'Timings': '.timing',
+    'WarpServer': '.server',
+    'main': '.cli',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+if sys.version_info < (3, 7):
+    # modules have no `__getattr__` before Python 3.7, so everything is imported now
+    for _name in _EXPORTS:
+        __getattr__(_name)
@@ -0,0 +1,147 @@
+"""
+Asyncio Dewarp And Rewarp
+"""
+import asyncio
+import functools
+
+# Marks the end of an `AsyncWarpStream`.
+_END = object()
+
+def _running_loop():
+    if hasattr(asyncio, 'get_running_loop'):
+        return asyncio.get_running_loop()
+    # before Python 3.7, the same loop inside a coroutine
+    return asyncio.get_event_loop()
+
+class AsyncWarping:
+    """ Awaitable mesh building, loading and remapping of a `FisheyeWarping`.
+
+        Every call runs on `executor`, the loop's default executor by default,
+        so the event loop keeps serving other streams meanwhile. `cv2.remap`
+        releases the GIL, so a thread pool remaps frames of many cameras in
+        parallel. The executor must run threads, the calls update `frd`.
+
+            >>> warping = AsyncWarping(FisheyeWarping(img, verbose=False))
+            >>> await warping.build_dewarp_mesh()
+            >>> panorama = await warping.dewarp(frame, flip=True)
+    """
+
+    def __init__(self, frd, executor=None):
+        self.frd = frd
+        self.executor = executor
+
+    async def run(self, func, *args, **kwargs):
+        """ Runs any blocking call on the executor. """
+        loop = _running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def build_dewarp_mesh(self, save_path=None):
+        return await self.run(self.frd.build_dewarp_mesh, save_path=save_path)
+
+    async def load_dewarp_mesh(self, mesh_path):
+        return await self.run(self.frd.load_dewarp_mesh, mesh_path)
+
+    async def build_rewarp_mesh(self, save_path=None):
+        return await self.run(self.frd.build_rewarp_mesh, save_path=save_path)
+
+    async def load_rewarp_mesh(self, mesh_path):
+        return await self.run(self.frd.load_rewarp_mesh, mesh_path)
+
+    async def dewarp(self, img, flip=False):
+        return await self.run(self.frd.dewarp, img, flip=flip)
+
+    async def rewarp(self, panorama_img, flip=False):
+        return await self.run(self.frd.rewarp, panorama_img, flip=flip)
+
+    async def rewarp_with_mesh(self, panorama_img):
+        return await self.run(self.frd.rewarp_with_mesh, panorama_img)
+
+class AsyncStreamStats:
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+
+    def __repr__(self):
+        return f'AsyncStreamStats(received={self.received}, dropped={self.dropped}, processed={self.processed})'
+
+class AsyncWarpStream:
+    """ Warps a live stream of frames with backpressure.
+
+        Frames go in with `put` and warped frames come out of `async for`.
+        At most `maxsize` frames wait in between. When it is full, `put`
+        waits with the `block` policy, or discards the oldest waiting frame
+        with `drop_oldest`, so a slow consumer always gets the latest frames.
+
+            >>> stream = AsyncWarpStream(warping, mode='dewarp', policy='drop_oldest')
+            >>> async for panorama in stream:
+            ...     await publish(panorama)
+    """
+
+    MODES = ('dewarp', 'rewarp')
+    POLICIES = ('block', 'drop_oldest')
+
+    def __init__(self, warping, mode='dewarp', maxsize=2, policy='block'):
+        assert mode in self.MODES, f'`mode` must be one of {self.MODES}.'
+        assert policy in self.POLICIES, f'`policy` must be one of {self.POLICIES}.'
+        self.warping = warping
+        self.mode = mode
+        self.policy = policy
+        self.stats = AsyncStreamStats()
+        self.maxsize = maxsize
+        self.__queue = None
+        self.__closed = False
+
+    @property
+    def __frames(self):
+        # made on first use, in the running loop: up to Python 3.9 a queue binds
+        # to the current loop when it is made, not the one the stream runs on
+        if self.__queue is None:
+            self.__queue = asyncio.Queue(maxsize=self.maxsize)
+        return self.__queue
+
+    async def put(self, frame):
+        assert not self.__closed, 'The stream is closed.'
+        self.stats.received += 1
+        if self.policy == 'drop_oldest':
+            if self.__frames.full():
+                self.__frames.get_nowait()
+                self.stats.dropped += 1
+            self.__frames.put_nowait(frame)
+        else:
+            await self.__frames.put(frame)
+
+    async def close(self):
+        """ Ends the stream after the frames already waiting. """
+        self.__closed = True
+        # a full queue is never waited on, the consumer ends once it drains it
+        if not self.__frames.full():
+            self.__frames.put_nowait(_END)
+
+    async def feed(self, frames):
+        """ Puts every frame of an (async) iterable, then closes the stream. """
+        if hasattr(frames, '__aiter__'):
+            async for frame in frames:
+                await self.put(frame)
+        else:
+            for frame in frames:
+                await self.put(frame)
+        await self.close()
+
+    async def warp(self, frame):
+        if self.mode == 'dewarp':
+            return await self.warping.dewarp(frame, flip=True)
+        return await self.warping.rewarp_with_mesh(frame)
+
+    def __aiter__(self):
+        return self.__results()
+
+    async def __results(self):
+        while not (self.__closed and self.__frames.empty()):
+            frame = await self.__frames.get()
+            if frame is _END:
+                return
+            result = await self.warp(frame)
+            self.stats.processed += 1
+            yield result
@@ -0,0 +1,137 @@
+"""
+Batch Dewarp And Rewarp
+"""
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .decode import IMAGE_SUFFIXES, IMREAD_FLAGS
+from .timing import timed
+
+# The instance used by the workers of a process pool, sent once per worker.
+_worker_frd = None
+
+def collect_inputs(pattern):
+    """ Returns the sorted image paths of a directory or a glob pattern. """
+    path = Path(pattern)
+    if path.is_dir():
+        paths = path.iterdir()
+    else:
+        paths = (Path(p) for p in glob.glob(pattern, recursive=True))
+    return sorted(p for p in paths if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+def output_paths(inputs, output_dir):
+    """ Returns the output path of every input path, the tree below their
+        common directory mirrored in `output_dir`, so inputs of the same name
+        in different directories do not overwrite each other.
+    """
+    inputs = [Path(p).resolve() for p in inputs]
+    if not inputs:
+        return []
+    root = Path(os.path.commonpath([str(p.parent) for p in inputs]))
+    return [Path(output_dir) / p.relative_to(root) for p in inputs]
+
+def is_up_to_date(input_path, output_path):
+    output_path = Path(output_path)
+    return output_path.is_file() and output_path.stat().st_mtime >= Path(input_path).stat().st_mtime
+
+def warp_file(frd, mode, input_path, output_path):
+    """ Warps one image file and returns the seconds it took. """
+    st = time.perf_counter()
+    timings = frd.timings
+    if mode == 'dewarp':
+        # JPEG files are decoded only as large as the output needs
+        result = frd.dewarp_file(input_path)
+    else:
+        with timed(timings, 'decode'):
+            img = cv2.imread(str(input_path), IMREAD_FLAGS)
+        if img is None:
+            raise IOError(f'Cannot read image `{input_path}`.')
+        result = frd.rewarp_with_mesh(img)
+    with timed(timings, 'encode'):
+        written = cv2.imwrite(str(output_path), result)
+    if not written:
+        raise IOError(f'Cannot write image `{output_path}`.')
+    return time.perf_counter() - st
+
+def _init_worker(frd):
+    global _worker_frd
+    _worker_frd = frd
+
+def _warp_file_in_worker(mode, input_path, output_path):
+    return warp_file(_worker_frd, mode, input_path, output_path)
+
+class BatchStats:
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.latencies = []
+        self.skipped = 0
+        self.failed = []
+
+    @property
+    def processed(self):
+        return len(self.latencies)
+
+    @property
+    def images_per_second(self):
+        return self.processed / self.seconds if self.seconds > 0 else 0.0
+
+    def percentile(self, q):
+        return float(np.percentile(self.latencies, q)) if self.latencies else 0.0
+
+    def summary(self):
+        return (
+            f'{self.processed} images in {self.seconds:.3f} s ({self.images_per_second:.2f} images/s), '
+            f'latency p50 {self.percentile(50) * 1000:.1f} ms, p95 {self.percentile(95) * 1000:.1f} ms, '
+            f'{self.skipped} skipped, {len(self.failed)} failed'
+        )
+
+def run_batch(frd, inputs, output_dir, mode='dewarp', workers=None, pool='thread', skip_up_to_date=True):
+    """ Warps every image path of `inputs` into `output_dir` with one shared
+        mesh, at the same path relative to their common directory.
+
+        `pool` is `thread` or `process`. A process pool receives `frd` once per
+        worker instead of once per image, from Python 3.7 on.
+    """
+    assert mode in ('dewarp', 'rewarp'), '`mode` must be `dewarp` or `rewarp`.'
+    assert pool in ('thread', 'process'), '`pool` must be `thread` or `process`.'
+    workers = workers or os.cpu_count() or 1
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    stats = BatchStats()
+    jobs = list()
+    for input_path, output_path in zip(inputs, output_paths(inputs, output_dir)):
+        if skip_up_to_date and is_up_to_date(input_path, output_path):
+            stats.skipped += 1
+            continue
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((input_path, output_path))
+
+    st = time.perf_counter()
+    if pool == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers)
+        submit = lambda input_path, output_path: executor.submit(warp_file, frd, mode, input_path, output_path)
+    elif sys.version_info >= (3, 7):
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(frd,))
+        submit = lambda input_path, output_path: executor.submit(_warp_file_in_worker, mode, input_path, output_path)
+    else:
+        # no `initializer` before Python 3.7
+        executor = ProcessPoolExecutor(max_workers=workers)
+        submit = lambda input_path, output_path: executor.submit(warp_file, frd, mode, input_path, output_path)
+    with executor:
+        futures = [(input_path, submit(input_path, output_path)) for input_path, output_path in jobs]
+        for input_path, future in futures:
+            try:
+                stats.latencies.append(future.result())
+            except Exception as e:
+                stats.failed.append((input_path, e))
+    stats.seconds = time.perf_counter() - st
+    return stats
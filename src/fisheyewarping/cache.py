@@ -0,0 +1,202 @@
+"""
+Mesh Cache
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .meshio import load_mesh, save_mesh
+
+# Bump when the mesh builders change their output, so stale disk entries are ignored.
+CACHE_VERSION = 3
+
+# Default size of the disk tier. Each geometry or output size of a high
+# resolution camera adds hundreds of MB.
+MAX_DISK_BYTES = 2 << 30
+
+def mesh_key(kind, img_shape, img_details, panorama_shape=None, extra=None):
+    """ Returns the cache key of a mesh from what determines its maps.
+
+        `img_details` are the values of `CameraGeometry.details()`,
+        `panorama_shape` is only needed by the rewarp mesh and `extra` holds any
+        other parameters, like the `key()` of a view.
+    """
+    parts = (
+        CACHE_VERSION,
+        kind,
+        tuple(int(v) for v in img_shape[:2]),
+        tuple(int(v) for v in img_details),
+        tuple(int(v) for v in panorama_shape) if panorama_shape is not None else None,
+    )
+    if extra is not None:
+        parts += (extra,)
+    return f'{kind}-' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def mesh_file_key(kind, path):
+    """ Returns a key for a mesh file that does not record its geometry. """
+    path = Path(path).resolve()
+    stat = path.stat()
+    parts = (CACHE_VERSION, kind, str(path), stat.st_size, stat.st_mtime_ns)
+    return f'{kind}-' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def default_cache_dir():
+    if os.environ.get('FISHEYEWARPING_CACHE_DIR'):
+        return Path(os.environ['FISHEYEWARPING_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'fisheyewarping'
+
+class MeshCache:
+    """ Two-tier cache of mesh arrays.
+
+        The memory tier keeps the most recently used meshes up to `max_bytes`.
+        The disk tier keeps meshes in `cache_dir` as memory-mapped mesh files,
+        set it to `None` to keep meshes in memory only. Once the files exceed
+        `max_disk_bytes`, the least recently used ones, by modification time,
+        are deleted. `None` keeps every mesh.
+    """
+
+    def __init__(self, max_bytes=1 << 30, cache_dir=None, max_disk_bytes=MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__nbytes = 0
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # the memory tier stays in this process
+        return dict(max_bytes=self.max_bytes, cache_dir=self.cache_dir, max_disk_bytes=self.max_disk_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def nbytes(self):
+        return self.__nbytes
+
+    def __contains__(self, key):
+        with self.__lock:
+            if key in self.__entries:
+                return True
+        path = self.__disk_path(key)
+        return path is not None and path.is_file()
+
+    def get(self, key):
+        """ Returns the cached arrays of `key`, or `None` on a miss. """
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+        arrays = self.__load(key)
+        if arrays is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self.__remember(key, arrays)
+        return arrays
+
+    def put(self, key, arrays, disk=True):
+        """ Caches `arrays` under `key`, in the memory tier only without `disk`. """
+        arrays = tuple(arrays)
+        for array in arrays:
+            array.setflags(write=False)
+        self.__remember(key, arrays)
+        if disk:
+            self.__store(key, arrays)
+        return arrays
+
+    def clear(self, disk=False):
+        with self.__lock:
+            self.__entries.clear()
+            self.__nbytes = 0
+        if disk and self.cache_dir is not None and self.cache_dir.is_dir():
+            for path in self.cache_dir.glob('*.fwm'):
+                path.unlink()
+
+    def __remember(self, key, arrays):
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self.__nbytes -= sum(array.nbytes for array in self.__entries.pop(key))
+            self.__entries[key] = arrays
+            self.__nbytes += nbytes
+            while self.__nbytes > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__nbytes -= sum(array.nbytes for array in evicted)
+
+    def __disk_path(self, key):
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f'{key}.fwm'
+
+    def __load(self, key):
+        path = self.__disk_path(key)
+        if path is None or not path.is_file():
+            return None
+        try:
+            mesh = load_mesh(path)
+            # a use, for the eviction of the disk tier
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return tuple(mesh.arrays[f'array{i}'] for i in range(len(mesh.arrays)))
+
+    def __store(self, key, arrays):
+        path = self.__disk_path(key)
+        if path is None:
+            return
+        if self.max_disk_bytes is not None and sum(array.nbytes for array in arrays) > self.max_disk_bytes:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save_mesh(path, key.split('-')[0], {f'array{i}': array for i, array in enumerate(arrays)})
+        self.__evict(keep=path)
+
+    def __evict(self, keep):
+        """ Deletes the least recently used files until the disk tier fits `max_disk_bytes`. """
+        if self.max_disk_bytes is None:
+            return
+        files = list()
+        for path in self.cache_dir.glob('*.fwm'):
+            try:
+                stat = path.stat()
+            except OSError:
+                # deleted by another process meanwhile
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # gone already, or still mapped on Windows
+                continue
+            total -= size
+
+_default_mesh_cache = None
+
+def default_mesh_cache():
+    """ Returns the process-wide cache used by `FisheyeWarping` by default.
+
+        Meshes are kept on disk in `$FISHEYEWARPING_CACHE_DIR`, or in
+        `fisheyewarping` under the user cache directory.
+    """
+    global _default_mesh_cache
+    if _default_mesh_cache is None:
+        _default_mesh_cache = MeshCache(cache_dir=default_cache_dir())
+    return _default_mesh_cache
+
+def set_default_mesh_cache(mesh_cache):
+    """ Replaces the default cache, `False` disables caching by default. """
+    global _default_mesh_cache
+    _default_mesh_cache = mesh_cache
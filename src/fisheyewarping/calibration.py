@@ -0,0 +1,120 @@
+"""
+Live Calibration
+"""
+import copy
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+
+from .fisheyewarping import FisheyeWarping
+
+class LiveCalibration:
+    """ Retunes the `CameraGeometry` of a `FisheyeWarping` while frames keep
+        coming, for installers who watch the output as they tune it.
+
+        `update` returns at once. A new circle center moves the maps with
+        `FisheyeWarping.set_geometry` right away, other changes build a coarse
+        preview mesh, `preview_scale` times smaller each way, and the full
+        meshes on `executor` in the background. Until they are ready, `dewarp`
+        renders the preview resized to the size of the full output.
+
+            >>> calibration = LiveCalibration(frd)
+            >>> calibration.update(CameraGeometry((1920, 1080), center=(980, 530), outer_radius=600))
+            >>> panorama = calibration.dewarp(frame)
+    """
+
+    def __init__(self, frd, preview_scale=4, executor=None):
+        self.frd = frd
+        self.preview_scale = preview_scale
+        self.__own_executor = executor is None
+        self.__executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.__lock = threading.Lock()
+        # every `update` bumps it, so builds of older updates are discarded
+        self.__generation = 0
+        # `(FisheyeWarping, output_size)` shown until the full meshes are ready
+        self.__preview = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def ready(self):
+        """ Whether `dewarp` renders with the full meshes. """
+        return self.__preview is None
+
+    def update(self, geometry):
+        """ Switches to `geometry` and returns a future of the `FisheyeWarping`
+            with the full meshes, which is also `frd` once it is done. Its
+            result is `None` when a later update came before the rebuild
+            started, which is then skipped.
+        """
+        with self.__lock:
+            self.__generation += 1
+            generation = self.__generation
+            frd = copy.copy(self.frd)
+        previous = frd.geometry
+        if previous is not None and previous.frame_size is not None and geometry.for_shape(previous.img_shape).is_center_shift_of(previous):
+            frd.set_geometry(geometry)
+            self.__swap(generation, frd)
+            future = Future()
+            future.set_result(frd)
+            return future
+
+        preview = self.__build_preview(frd, geometry)
+        with self.__lock:
+            if generation == self.__generation:
+                self.__preview = preview
+
+        def rebuild():
+            with self.__lock:
+                if generation != self.__generation:
+                    # a later update is queued, building this one would only delay it
+                    return None
+            frd.set_geometry(geometry)
+            self.__swap(generation, frd)
+            return frd
+        return self.__executor.submit(rebuild)
+
+    def dewarp(self, img):
+        """ Same as `frd.dewarp(img, flip=True)`, or the preview until the full meshes are ready. """
+        with self.__lock:
+            frd, preview = self.frd, self.__preview
+        if preview is None:
+            return frd.dewarp(img, flip=True)
+        preview_frd, output_size = preview
+        h, w = preview_frd.geometry.img_shape
+        small = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        return cv2.resize(preview_frd.dewarp(small, flip=True), output_size, interpolation=cv2.INTER_LINEAR)
+
+    def close(self):
+        if self.__own_executor:
+            self.__executor.shutdown(wait=True)
+
+    def __swap(self, generation, frd):
+        with self.__lock:
+            if generation == self.__generation:
+                self.frd = frd
+                self.__preview = None
+
+    def __build_preview(self, frd, geometry):
+        if frd.geometry is not None and frd.geometry.frame_size is not None:
+            geometry = geometry.for_shape(frd.geometry.img_shape)
+        elif frd.img is not None:
+            geometry = geometry.for_shape(frd.img.shape)
+        output_spec = frd.output_spec.with_size(geometry.output_size)
+        factor = 1 / self.preview_scale
+        preview = FisheyeWarping(
+            None,
+            mesh_cache=False,
+            map_type=frd.map_type,
+            output_spec=output_spec.scaled(factor),
+            verbose=False,
+            geometry=geometry.scaled(factor)
+        )
+        preview.build_dewarp_mesh()
+        w_d, h_d = geometry.details()[:2]
+        return preview, output_spec.output_size(w_d, h_d)
@@ -3,8 +3,212 @@ import argparse
 from pathlib import Path
 
 import cv2
+import numpy as np
+
+from fisheyewarping import CameraGeometry, FisheyeWarping, MeshCache, RemapEngine, SharedMeshRegistry, set_default_mesh_cache
+from fisheyewarping.stream import WarpStream
+from fisheyewarping.batch import collect_inputs, run_batch
+from fisheyewarping.decode import IMAGE_SUFFIXES, IMREAD_FLAGS, jpeg_size
+from fisheyewarping.timing import Timings, timed
+from fisheyewarping.yuv import LAYOUTS, yuv_frame_shape
+
+# set by `--quiet`
+_quiet = False
+
+# `.jpg`, `.jpeg`, ... for the messages
+SUFFIX_NAMES = ', '.join(f'`{suffix}`' for suffix in IMAGE_SUFFIXES)
+
+def log(msg):
+    if not _quiet:
+        print(msg)
+
+def read_image(args, path):
+    with timed(args.timings, 'decode'):
+        return cv2.imread(Path(path).as_posix(), IMREAD_FLAGS)
+
+def warping_options(args):
+    """ Options shared by every `FisheyeWarping` of the command. """
+    return dict(map_type=args.map_type, verbose=not args.quiet, timings=args.timings, mesh_registry=args.mesh_registry, geometry=args.geometry, engine=args.engine, pyramid=args.pyramid)
+
+def parse_pair(value):
+    """ Parses `A,B` into a pair of ints. """
+    try:
+        a, b = (int(v) for v in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'`{value}` is not a pair of integers `A,B`.')
+    return a, b
+
+def pyramid_path(path, size):
+    """ Returns the path of the pyramid level of `size` `(w, h)` next to `path`. """
+    path = Path(path)
+    return path.with_name(f'{path.stem}-{size[0]}x{size[1]}{path.suffix}').as_posix()
+
+def save_pyramid(args, frd, fisheye_img, panorama_output_path):
+    """ Saves every level of `--pyramid`, remapped from `fisheye_img`, next to the panorama. """
+    levels = frd.dewarp_pyramid(fisheye_img)
+    for size, level in zip(frd.pyramid, levels):
+        path = pyramid_path(panorama_output_path, size)
+        with timed(args.timings, 'encode'):
+            cv2.imwrite(path, level)
+        log(f'----- Saved the {size[0]}x{size[1]} level to `{path}`.')
+
+def camera_geometry(args):
+    """ Returns the `CameraGeometry` of the geometry options, or `None` when none is given. """
+    if args.frame_size is None and args.center is None and not args.inner_radius and args.outer_radius is None and args.output_size is None:
+        return None
+    return CameraGeometry(
+        args.frame_size,
+        center=args.center,
+        inner_radius=args.inner_radius,
+        outer_radius=args.outer_radius,
+        output_size=args.output_size
+    )
+
+def run_build_meshes(args, use_multiprocessing):
+    """ Builds and saves meshes from `--frame_size` and the other geometry options, without any image. """
+    if not args.save_dewarp_mesh_path and not args.save_rewarp_mesh_path:
+        log('----- You must specify a path to `save_dewarp_mesh_path` or `save_rewarp_mesh_path`!')
+        return
+    st = time.perf_counter()
+    log(f'----- Build meshes for `{args.geometry}`.')
+    frd = FisheyeWarping(None, use_multiprocessing=use_multiprocessing, **warping_options(args))
+    if args.save_dewarp_mesh_path:
+        frd.build_dewarp_mesh(save_path=args.save_dewarp_mesh_path, downsample=args.mesh_downsample)
+        log(f'----- Saved the dewarp mesh to `{args.save_dewarp_mesh_path}`.')
+    if args.save_rewarp_mesh_path:
+        frd.build_rewarp_mesh(save_path=args.save_rewarp_mesh_path, downsample=args.mesh_downsample)
+        log(f'----- Saved the rewarp mesh to `{args.save_rewarp_mesh_path}`.')
+    log(f'-------All Tasks Completed------- ({time.perf_counter()-st:.3f} s)')
+    log('========End of this process========')
+
+def run_yuv(args, use_multiprocessing):
+    """ Dewarps a raw `--yuv_layout` frame of `--frame_size` into a raw frame of the same layout. """
+    if not args.fisheye_img_path or args.frame_size is None:
+        log('----- `yuv_layout` needs `fisheye_img_path` and `frame_size`!')
+        return
+    st = time.perf_counter()
+    shape = yuv_frame_shape(*args.frame_size)
+    with timed(args.timings, 'decode'):
+        frame = np.fromfile(args.fisheye_img_path, dtype=np.uint8)
+    if frame.size != shape[0] * shape[1]:
+        log(f'----- `{args.fisheye_img_path}` is not a {args.yuv_layout} frame of size {args.frame_size}!')
+        return
+    frd = prepare_warping(args, 'dewarp', None, use_multiprocessing)
+    if frd is None:
+        return
+    result = frd.dewarp_yuv(frame.reshape(shape), args.yuv_layout, flip=True)
+    with timed(args.timings, 'encode'):
+        result.tofile(args.panorama_output)
+    log(f'----- Saved the {args.yuv_layout} panorama of size {result.shape[1]}x{result.shape[0] * 2 // 3} to `{args.panorama_output}`.')
+    log(f'-------All Tasks Completed------- ({time.perf_counter()-st:.3f} s)')
+    log('========End of this process========')
+
+def load_mesh(load_mesh_path, load):
+    log(f'----- Load mesh from `{load_mesh_path}`!')
+    if not Path(load_mesh_path).exists():
+        log('----- Your input path of the mesh does not exists!')
+        return False
+    if not Path(load_mesh_path).is_file():
+        log('----- Your input path of the mesh is not a file!')
+        return False
+    load(mesh_path=load_mesh_path)
+    return True
+
+def prepare_warping(args, mode, fisheye_img, use_multiprocessing):
+    """ Returns a `FisheyeWarping` with the meshes `mode` needs, or `None`. """
+    if mode == 'dewarp':
+        frd = FisheyeWarping(fisheye_img, use_multiprocessing=use_multiprocessing, **warping_options(args))
+        if args.load_dewarp_mesh_path:
+            if not load_mesh(args.load_dewarp_mesh_path, frd.load_dewarp_mesh):
+                return None
+        elif args.save_dewarp_mesh_path:
+            if Path(args.save_dewarp_mesh_path).is_dir():
+                log('----- `save_dewarp_mesh_path` is a directory!')
+                return None
+            log(f'----- We will save the mesh to `{args.save_dewarp_mesh_path}`!')
+            frd.build_dewarp_mesh(save_path=args.save_dewarp_mesh_path, downsample=args.mesh_downsample)
+        else:
+            log('----- You must specify a path to `load_dewarp_mesh_path` or `save_dewarp_mesh_path`!')
+            return None
+    else:
+        if not args.load_dewarp_mesh_path or not args.load_rewarp_mesh_path:
+            log('----- You must specify paths to `load_dewarp_mesh_path` and `load_rewarp_mesh_path`!')
+            return None
+        frd = FisheyeWarping(None, use_multiprocessing=use_multiprocessing, **warping_options(args))
+        if not load_mesh(args.load_dewarp_mesh_path, frd.load_dewarp_mesh):
+            return None
+        if not load_mesh(args.load_rewarp_mesh_path, frd.load_rewarp_mesh):
+            return None
+    return frd
+
+def run_batch_mode(args, use_multiprocessing):
+    inputs = collect_inputs(args.batch_input)
+    if not inputs:
+        log(f'----- No images ({SUFFIX_NAMES}) found in `{args.batch_input}`!')
+        return
+    mode = args.batch_mode
+    log(f'----- Found {len(inputs)} images for `{mode}`, output directory is `{args.batch_output_dir}`.')
+
+    st = time.perf_counter()
+    fisheye_img = read_image(args, inputs[0]) if mode == 'dewarp' else None
+    frd = prepare_warping(args, mode, fisheye_img, use_multiprocessing)
+    if frd is None:
+        return
+    log(f'----- Mesh is ready. ({time.perf_counter()-st:.3f} s)')
+
+    stats = run_batch(
+        frd,
+        inputs,
+        args.batch_output_dir,
+        mode=mode,
+        workers=args.workers,
+        pool=args.pool,
+        skip_up_to_date=not args.overwrite
+    )
+    for input_path, error in stats.failed:
+        log(f'----- Failed on `{input_path}`: {error}')
+    log(f'----- {stats.summary()}')
+    log(f'-------All Tasks Completed------- ({time.perf_counter()-st:.3f} s)')
+    log('========End of this process========')
+
+def run_video(args, use_multiprocessing):
+    video_output_path = args.video_output
+    log(f'----- Video output path will be `{video_output_path}`.')
+
+    if args.fisheye_video_path:
+        mode, video_path = 'dewarp', Path(args.fisheye_video_path)
+    else:
+        mode, video_path = 'rewarp', Path(args.panorama_video_path)
+    if not video_path.is_file():
+        log(f'----- Your video path `{video_path}` is not a file!')
+        return
+
+    st = time.perf_counter()
+
+    if mode == 'dewarp':
+        log('----- Use `Dewarp` method to dewarp a fisheye video to a panorama video.')
+        capture = cv2.VideoCapture(video_path.as_posix())
+        ok, first_frame = capture.read()
+        capture.release()
+        if not ok:
+            log(f'----- Cannot read any frame from `{video_path}`!')
+            return
+    else:
+        log('----- Use `Rewarp` method to rewarp a panorama video to a fisheye video.')
+        first_frame = None
+
+    frd = prepare_warping(args, mode, first_frame, use_multiprocessing)
+    if frd is None:
+        return
+
+    log(f'----- Mesh is ready. ({time.perf_counter()-st:.3f} s)')
+
+    stream = WarpStream(frd, mode=mode, queue_size=args.queue_size, change_threshold=args.change_threshold)
+    stats = stream.write(video_path, video_output_path)
 
-from fisheyewarping import FisheyeWarping
+    log(f'----- Processed {stats.frames} frames in {stats.seconds:.3f} s ({stats.fps:.2f} FPS)')
+    log(f'-------All Tasks Completed------- ({time.perf_counter()-st:.3f} s)')
+    log('========End of this process========')
 
 def main():
 
@@ -16,6 +220,8 @@ def main():
     parser.add_argument('--save_dewarp_mesh_path', type=str, default=None, help='Specific path for saving mesh data for `dewarping`. Default is `None`.')
     parser.add_argument('--save_rewarp_mesh_path', type=str, default=None, help='Specific path for saving mesh data for `rewarping`. Default is `None`.')
 
+    parser.add_argument('--mesh_downsample', type=int, default=1, choices=[1, 2, 4, 8], help='Save compact meshes sampled every this many pixels, within one pixel of the full maps once loaded. Default is `1`.')
+
     parser.add_argument('--load_dewarp_mesh_path', type=str, default=None, help='Specific path for loading mesh data for `dewarping`. Default is `None`.')
     parser.add_argument('--load_rewarp_mesh_path', type=str, default=None, help='Specific path for loading mesh data for `rewarping`. Default is `None`.')
 
@@ -24,66 +230,129 @@ def main():
 
     parser.add_argument('--use_multiprocessing', type=bool, default=True, help='Use multiprocessing to get mesh. Default is `True`.')
 
+    parser.add_argument('--map_type', type=str, default='float', choices=['float', 'fixed'], help='Remap with float maps or fixed-point `CV_16SC2` maps. Default is `float`.')
+
+    parser.add_argument('--mesh_cache_dir', type=str, default=None, help='Directory of the mesh cache. Default is `$FISHEYEWARPING_CACHE_DIR` or `~/.cache/fisheyewarping`.')
+    parser.add_argument('--no_mesh_cache', action='store_true', help='Always build meshes instead of using the mesh cache.')
+    parser.add_argument('--shared_meshes', action='store_true', help='Keep meshes once in shared memory for every process, like the `process` pool workers.')
+
+    parser.add_argument('--frame_size', type=parse_pair, default=None, help='`W,H` of the fisheye frames, to build meshes without an image. Default is the size of the image.')
+    parser.add_argument('--center', type=parse_pair, default=None, help='`X,Y` of the fisheye circle center. Default is the frame center.')
+    parser.add_argument('--inner_radius', type=int, default=0, help='Radius of the fisheye circle left out of the panorama. Default is `0`.')
+    parser.add_argument('--outer_radius', type=int, default=None, help='Radius of the fisheye circle. Default is half the frame width.')
+    parser.add_argument('--output_size', type=parse_pair, default=None, help='`W,H` the panorama is resized to. JPEG inputs are then decoded only as large as it needs. Default is the panorama size.')
+
+    parser.add_argument('--pyramid', type=parse_pair, nargs='+', default=None, help='`W,H` sizes of more panoramas of a fisheye image, each remapped at its size and saved next to `panorama_output` with the size in its name.')
+
+    parser.add_argument('--yuv_layout', type=str, default=None, choices=list(LAYOUTS), help='Read `fisheye_img_path` as a raw frame of this layout and `frame_size`, and write the panorama in the same layout.')
+
+    parser.add_argument('--fisheye_video_path', type=str, default=None, help='Specific path of your fisheye video for dewarping to a panorama video.')
+    parser.add_argument('--panorama_video_path', type=str, default=None, help='Specific path of your panorama video for rewarping to a fisheye video.')
+    parser.add_argument('--video_output', type=str, default='./warp-output.mp4', help='Specific path for the output video. Default is `./warp-output.mp4`.')
+    parser.add_argument('--queue_size', type=int, default=8, help='Frames buffered between the decode, remap and encode stages. Default is `8`.')
+    parser.add_argument('--change_threshold', type=int, default=None, help='Remap only the tiles of a still camera whose input changed by more than this many gray levels. Default is `None`, remap every pixel.')
+
+    parser.add_argument('--batch_input', type=str, default=None, help='Directory or glob pattern of images to process in batch mode.')
+    parser.add_argument('--batch_output_dir', type=str, default='./warp-output', help='Output directory of batch mode. Default is `./warp-output`.')
+    parser.add_argument('--batch_mode', type=str, default='dewarp', choices=['dewarp', 'rewarp'], help='Method used in batch mode. Default is `dewarp`.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of batch workers. Default is the number of CPUs.')
+    parser.add_argument('--pool', type=str, default='thread', choices=['thread', 'process'], help='Pool type of batch workers. Default is `thread`.')
+    parser.add_argument('--overwrite', action='store_true', help='Process images whose output is already up to date.')
+
+    parser.add_argument('--remap_workers', type=int, default=None, help='Threads that remap the bands of each frame, and processes of `use_multiprocessing`. Default is `None`, leave it to OpenCV.')
+    parser.add_argument('--opencv_threads', type=int, default=None, help='Threads of OpenCV, for the whole process. Default is 1 with `remap_workers` above 1, else unchanged.')
+
+    parser.add_argument('--quiet', action='store_true', help='Print nothing and draw no progress bars.')
+    parser.add_argument('--timings', action='store_true', help='Print the time spent in each stage at the end.')
+
     # ---------------------------------------------------------------
 
     args = parser.parse_args()
 
-    print('========Start to process========')
+    global _quiet
+    _quiet = args.quiet
+    args.timings = Timings() if args.timings else None
+    args.mesh_registry = SharedMeshRegistry() if args.shared_meshes else None
+    args.geometry = camera_geometry(args)
+    args.engine = RemapEngine(args.remap_workers, args.opencv_threads) if args.remap_workers or args.opencv_threads else None
+    run(args)
+    if args.timings is not None:
+        print(f'----- Timings: {args.timings.summary()}')
+
+def run(args):
+
+    log('========Start to process========')
+
+    if args.no_mesh_cache:
+        set_default_mesh_cache(False)
+    elif args.mesh_cache_dir:
+        set_default_mesh_cache(MeshCache(cache_dir=args.mesh_cache_dir))
+
+    if args.fisheye_video_path or args.panorama_video_path:
+        return run_video(args, use_multiprocessing=args.use_multiprocessing)
+
+    if args.batch_input:
+        return run_batch_mode(args, use_multiprocessing=args.use_multiprocessing)
+
+    if args.yuv_layout:
+        return run_yuv(args, use_multiprocessing=args.use_multiprocessing)
 
     panorama_output_path = args.panorama_output
-    print(f'----- Panorama output image path will be `{panorama_output_path}`.')
+    log(f'----- Panorama output image path will be `{panorama_output_path}`.')
     fisheye_output_path = args.fisheye_output
-    print(f'----- Fisheye output image path will be `{fisheye_output_path}`.')
+    log(f'----- Fisheye output image path will be `{fisheye_output_path}`.')
 
     # check path
     if args.fisheye_img_path:
         fisheye_img_path = Path(args.fisheye_img_path)
-        print(f'----- Detect `fisheye_img_path` is `{fisheye_img_path}`.')
+        log(f'----- Detect `fisheye_img_path` is `{fisheye_img_path}`.')
         if not fisheye_img_path.is_file():
-            print('----- Your `fisheye_img_path` is not a file!')
+            log('----- Your `fisheye_img_path` is not a file!')
             return
-        print(f'----- Your image path of the input path is `{fisheye_img_path}`')
+        log(f'----- Your image path of the input path is `{fisheye_img_path}`')
         # check extension
         suffix = fisheye_img_path.suffix
-        if suffix not in ['.jpg', '.jpeg', '.png']:
-            print('----- Only support common types of image `.jpg` and `.png`.')
-            print(f'----- Your suffix of the input is `{suffix}`.')
+        if suffix.lower() not in IMAGE_SUFFIXES:
+            log(f'----- Only support common types of image {SUFFIX_NAMES}.')
+            log(f'----- Your suffix of the input is `{suffix}`.')
             return
 
     if args.panorama_img_path:
         panorama_img_path = Path(args.panorama_img_path)
-        print(f'----- Detect `panorama_img_path` is {panorama_img_path}.')
+        log(f'----- Detect `panorama_img_path` is {panorama_img_path}.')
         if not panorama_img_path.is_file():
-            print('----- Your `panorama_img_path` is not a file!')
+            log('----- Your `panorama_img_path` is not a file!')
             return
-        print(f'----- Your image path of the input path is `{panorama_img_path}`')
+        log(f'----- Your image path of the input path is `{panorama_img_path}`')
         # check extension
         suffix = panorama_img_path.suffix
-        if suffix not in ['.jpg', '.jpeg', '.png']:
-            print('----- Only support common types of image `.jpg` and `.png`.')
-            print(f'----- Your suffix of the input is `{suffix}`.')
+        if suffix.lower() not in IMAGE_SUFFIXES:
+            log(f'----- Only support common types of image {SUFFIX_NAMES}.')
+            log(f'----- Your suffix of the input is `{suffix}`.')
             return
 
     if not args.fisheye_img_path and not args.panorama_img_path:
-        print('----- Please specific a path for `fisheye_img_path` or `panorama_img_path`!')
+        if args.frame_size is not None:
+            return run_build_meshes(args, use_multiprocessing=args.use_multiprocessing)
+        log('----- Please specific a path for `fisheye_img_path` or `panorama_img_path`!')
         return
 
-    print('===================')
+    log('===================')
 
     # check multiprocessing
     if not isinstance(args.use_multiprocessing, bool):
-        print('----- `use_multiprocessing` is only use `True` or `False`')
+        log('----- `use_multiprocessing` is only use `True` or `False`')
         return
     else:
         use_multiprocessing = args.use_multiprocessing
-        print(f'----- Multiprocessing generate mesh flag is `{use_multiprocessing}`')
+        log(f'----- Multiprocessing generate mesh flag is `{use_multiprocessing}`')
 
-    print('===================')
+    log('===================')
 
     # run fisheye -> panorama -> fisheye
     if args.fisheye_img_path and args.panorama_img_path:
-        print('----- Use `Dewarp` method to dewarp image from a fisheye image to a panorama image.')
-        print('----- And use `Rewarp` method to rewarp the follow output from a panorama image to fisheye image.')
+        log('----- Use `Dewarp` method to dewarp image from a fisheye image to a panorama image.')
+        log('----- And use `Rewarp` method to rewarp the follow output from a panorama image to fisheye image.')
 
         load_dewarp_mesh_path = args.load_dewarp_mesh_path
         save_dewarp_mesh_path = args.save_dewarp_mesh_path
@@ -91,27 +360,27 @@ def main():
         save_rewarp_mesh_path = args.save_rewarp_mesh_path
 
         # =====================================
-        st = time.time()
+        st = time.perf_counter()
         st_dewarp = st
-        fisheye_img = cv2.imread(fisheye_img_path.as_posix())
-        panorama_img = cv2.imread(panorama_img_path.as_posix())
-        frd = FisheyeWarping(fisheye_img, use_multiprocessing=use_multiprocessing)
+        fisheye_img = read_image(args, fisheye_img_path)
+        panorama_img = read_image(args, panorama_img_path)
+        frd = FisheyeWarping(fisheye_img, use_multiprocessing=use_multiprocessing, **warping_options(args))
         # =====================================
 
         if load_dewarp_mesh_path:
-            print(f'----- Detect `load_dewarp_mesh_path` is {load_dewarp_mesh_path}')
-            print(f'----- Load mesh from `{load_dewarp_mesh_path}`!')
+            log(f'----- Detect `load_dewarp_mesh_path` is {load_dewarp_mesh_path}')
+            log(f'----- Load mesh from `{load_dewarp_mesh_path}`!')
 
             # use already built mesh 
 
             # ===================================
             if not Path(load_dewarp_mesh_path).exists():
-                print('----- Your input path of the mesh does not exists!')
+                log('----- Your input path of the mesh does not exists!')
                 return
             if Path(load_dewarp_mesh_path).is_file():
                 frd.load_dewarp_mesh(mesh_path=load_dewarp_mesh_path)
             else:
-                print('----- Your input path of the mesh is not a file!')
+                log('----- Your input path of the mesh is not a file!')
                 return
             # ===================================
             frd.run_dewarp(save_path=panorama_output_path)
@@ -121,36 +390,36 @@ def main():
             # build mesh
 
             if Path(save_dewarp_mesh_path).is_dir():
-                print('----- `save_dewarp_mesh_path` is a directory!')
+                log('----- `save_dewarp_mesh_path` is a directory!')
                 return
-            print(f'----- Detect `save_dewarp_mesh_path` is {save_dewarp_mesh_path}')
-            print(f'----- We will save the mesh to `{save_dewarp_mesh_path}` when this process has been finished!')
-            frd.build_dewarp_mesh(save_path=save_dewarp_mesh_path)
+            log(f'----- Detect `save_dewarp_mesh_path` is {save_dewarp_mesh_path}')
+            log(f'----- We will save the mesh to `{save_dewarp_mesh_path}` when this process has been finished!')
+            frd.build_dewarp_mesh(save_path=save_dewarp_mesh_path, downsample=args.mesh_downsample)
             frd.run_dewarp(save_path=panorama_output_path)
 
         else:
-            print('----- You must specify a path to `load_dewarp_mesh_path` or `save_dewarp_mesh_path`!')
+            log('----- You must specify a path to `load_dewarp_mesh_path` or `save_dewarp_mesh_path`!')
             return
 
-        et = time.time()
-        print(f'-------Dewarping Task Completed------- ({et-st_dewarp:.3f} s)')
+        et = time.perf_counter()
+        log(f'-------Dewarping Task Completed------- ({et-st_dewarp:.3f} s)')
 
-        st_rewarp = time.time()
+        st_rewarp = time.perf_counter()
 
         if load_rewarp_mesh_path:
-            print(f'----- Detect `load_rewarp_mesh_path` is {load_rewarp_mesh_path}')
-            print(f'----- Load mesh from `{load_rewarp_mesh_path}`!')
+            log(f'----- Detect `load_rewarp_mesh_path` is {load_rewarp_mesh_path}')
+            log(f'----- Load mesh from `{load_rewarp_mesh_path}`!')
 
             # use already built mesh 
 
             # ===================================
             if not Path(load_rewarp_mesh_path).exists():
-                print('----- Your input path of the mesh does not exists!')
+                log('----- Your input path of the mesh does not exists!')
                 return
             if Path(load_rewarp_mesh_path).is_file():
                 frd.load_rewarp_mesh(mesh_path=load_rewarp_mesh_path)
             else:
-                print('----- Your input path of the mesh is not a file!')
+                log('----- Your input path of the mesh is not a file!')
                 return
             # ===================================
             frd.run_rewarp_with_mesh(panorama_img, save_path=fisheye_output_path)
@@ -160,107 +429,120 @@ def main():
             # build mesh
 
             if Path(save_rewarp_mesh_path).is_dir():
-                print('----- `save_rewarp_mesh_path` is a directory!')
+                log('----- `save_rewarp_mesh_path` is a directory!')
                 return
-            print(f'----- Detect `save_rewarp_mesh_path` is {save_rewarp_mesh_path}')
-            print(f'----- We will save the mesh to `{save_rewarp_mesh_path}` when this process has been finished!')
-            frd.build_rewarp_mesh(save_path=save_rewarp_mesh_path)
+            log(f'----- Detect `save_rewarp_mesh_path` is {save_rewarp_mesh_path}')
+            log(f'----- We will save the mesh to `{save_rewarp_mesh_path}` when this process has been finished!')
+            frd.build_rewarp_mesh(save_path=save_rewarp_mesh_path, downsample=args.mesh_downsample)
             frd.run_rewarp_with_mesh(panorama_img, save_path=fisheye_output_path)
 
-        et = time.time()
-        print(f'-------Rewarping Task Completed------- ({et-st_rewarp:.3f} s)')
+        et = time.perf_counter()
+        log(f'-------Rewarping Task Completed------- ({et-st_rewarp:.3f} s)')
 
-        print(f'-------All Task Completed------- ({et-st:.3f} s)')
+        log(f'-------All Task Completed------- ({et-st:.3f} s)')
 
     # run fisheye -> panorama method
     elif args.fisheye_img_path:
-        print('----- Use `Dewarp` method to dewarp image from a fisheye image to a panorama image.')
+        log('----- Use `Dewarp` method to dewarp image from a fisheye image to a panorama image.')
 
         # =====================================
-        st = time.time()
-        fisheye_img = cv2.imread(fisheye_img_path.as_posix())
-        frd = FisheyeWarping(fisheye_img, use_multiprocessing=use_multiprocessing)
+        st = time.perf_counter()
+        options = warping_options(args)
+        size = jpeg_size(fisheye_img_path)
+        if size is not None and args.output_size is not None and not args.pyramid:
+            # `run_dewarp` decodes it only as large as the output needs
+            fisheye_img = None
+            options['geometry'] = (args.geometry or CameraGeometry()).for_shape(size[::-1])
+            dewarp_img_path = fisheye_img_path
+        else:
+            fisheye_img = read_image(args, fisheye_img_path)
+            dewarp_img_path = None
+        frd = FisheyeWarping(fisheye_img, use_multiprocessing=use_multiprocessing, **options)
         # =====================================
 
         load_dewarp_mesh_path = args.load_dewarp_mesh_path
         save_dewarp_mesh_path = args.save_dewarp_mesh_path
         if load_dewarp_mesh_path:
-            print(f'----- Detect `load_dewarp_mesh_path` is {load_dewarp_mesh_path}')
-            print(f'----- Load mesh from `{load_dewarp_mesh_path}`!')
+            log(f'----- Detect `load_dewarp_mesh_path` is {load_dewarp_mesh_path}')
+            log(f'----- Load mesh from `{load_dewarp_mesh_path}`!')
 
             # use already built mesh 
 
             # ===================================
             if not Path(load_dewarp_mesh_path).exists():
-                print('----- Your input path of the mesh does not exists!')
+                log('----- Your input path of the mesh does not exists!')
                 return
             if Path(load_dewarp_mesh_path).is_file():
                 frd.load_dewarp_mesh(mesh_path=load_dewarp_mesh_path)
             else:
-                print('----- Your input path of the mesh is not a file!')
+                log('----- Your input path of the mesh is not a file!')
                 return
             # ===================================
-            frd.run_dewarp(save_path=panorama_output_path)
+            frd.run_dewarp(save_path=panorama_output_path, img_path=dewarp_img_path)
+            if args.pyramid:
+                save_pyramid(args, frd, fisheye_img, panorama_output_path)
 
         elif save_dewarp_mesh_path:
 
             # build mesh
 
             if Path(save_dewarp_mesh_path).is_dir():
-                print('----- `save_dewarp_mesh_path` is a directory!')
+                log('----- `save_dewarp_mesh_path` is a directory!')
                 return
-            print(f'----- Detect `save_dewarp_mesh_path` is {save_dewarp_mesh_path}')
-            print(f'----- We will save the mesh to `{save_dewarp_mesh_path}` when this process has been finished!')
-            frd.build_dewarp_mesh(save_path=save_dewarp_mesh_path)
-            frd.run_dewarp(save_path=panorama_output_path)
+            log(f'----- Detect `save_dewarp_mesh_path` is {save_dewarp_mesh_path}')
+            log(f'----- We will save the mesh to `{save_dewarp_mesh_path}` when this process has been finished!')
+            frd.build_dewarp_mesh(save_path=save_dewarp_mesh_path, downsample=args.mesh_downsample)
+            frd.run_dewarp(save_path=panorama_output_path, img_path=dewarp_img_path)
+            if args.pyramid:
+                save_pyramid(args, frd, fisheye_img, panorama_output_path)
 
         else:
-            print('----- You must specify a path to `load_dewarp_mesh_path` or `save_dewarp_mesh_path`!')
+            log('----- You must specify a path to `load_dewarp_mesh_path` or `save_dewarp_mesh_path`!')
             return
 
-        et = time.time()
-        print(f'-------Task Completed------- ({et-st:.3f} s)')
+        et = time.perf_counter()
+        log(f'-------Task Completed------- ({et-st:.3f} s)')
 
     # run panorama -> fisheye method
     elif args.panorama_img_path:
-        print('----- Use `Rewarp` method to rewarp an image from a panorama image to fisheye image.')
+        log('----- Use `Rewarp` method to rewarp an image from a panorama image to fisheye image.')
 
         load_rewarp_mesh_path = args.load_rewarp_mesh_path
         save_rewarp_mesh_path = args.save_rewarp_mesh_path
 
         # =====================================
-        st = time.time()
-        frd = FisheyeWarping(None, use_multiprocessing=use_multiprocessing)
-        panorama_img = cv2.imread(panorama_img_path.as_posix())
+        st = time.perf_counter()
+        frd = FisheyeWarping(None, use_multiprocessing=use_multiprocessing, **warping_options(args))
+        panorama_img = read_image(args, panorama_img_path)
         # =====================================
 
         if load_rewarp_mesh_path:
-            print(f'----- Detect `load_rewarp_mesh_path` is {load_rewarp_mesh_path}')
-            print(f'----- Load mesh from `{load_rewarp_mesh_path}`!')
+            log(f'----- Detect `load_rewarp_mesh_path` is {load_rewarp_mesh_path}')
+            log(f'----- Load mesh from `{load_rewarp_mesh_path}`!')
 
             # use already built mesh 
 
             # ===================================
             if not Path(load_rewarp_mesh_path).exists():
-                print('----- Your input path of the mesh does not exists!')
+                log('----- Your input path of the mesh does not exists!')
                 return
             if Path(load_rewarp_mesh_path).is_file():
                 frd.load_rewarp_mesh(mesh_path=load_rewarp_mesh_path)
             else:
-                print('----- Your input path of the mesh is not a file!')
+                log('----- Your input path of the mesh is not a file!')
                 return
             # ===================================
 
             frd.run_rewarp_with_mesh(panorama_img, save_path=fisheye_output_path)
 
         else:
-            print('----- You must specify a path to `load_rewarp_mesh_path`!')
+            log('----- You must specify a path to `load_rewarp_mesh_path`!')
             return
         
-        et = time.time()
-        print(f'-------All Tasks Completed------- ({et-st:.3f} s)')
+        et = time.perf_counter()
+        log(f'-------All Tasks Completed------- ({et-st:.3f} s)')
 
-    print('========End of this process========')
+    log('========End of this process========')
 
     return
 
@@ -0,0 +1,111 @@
+"""
+Warping Client
+
+A thin client of `fisheyewarping.server`. It only uses the standard library,
+so a call costs a Python start-up and one request, not loading OpenCV.
+
+    fisheyewarping-client dewarp fisheye.jpg -o panorama.png --socket /tmp/fw.sock
+    cat fisheye.jpg | fisheyewarping-client dewarp - > panorama.png
+    fisheyewarping-client dewarp /data/fisheye.jpg -o /data/panorama.png --server_side
+"""
+import argparse
+import http.client
+import json
+import socket
+import sys
+from pathlib import Path
+from urllib.parse import urlencode
+
+DEFAULT_PORT = 8765
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class ServerError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+def connect(socket_path=None, host='127.0.0.1', port=DEFAULT_PORT, timeout=None):
+    if socket_path:
+        return UnixHTTPConnection(socket_path, timeout=timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+def request(connection, method, route, params=None, body=None):
+    """ Sends one request and returns `(headers, payload)`, raising `ServerError` on failure. """
+    url = route + ('?' + urlencode(params) if params else '')
+    connection.request(method, url, body=body, headers={'Content-Length': str(len(body or b''))})
+    response = connection.getresponse()
+    payload = response.read()
+    if response.status != 200:
+        try:
+            message = json.loads(payload.decode('utf-8'))['error']
+        except (ValueError, KeyError):
+            message = payload.decode('utf-8', 'replace')
+        raise ServerError(response.status, message)
+    return dict(response.getheaders()), payload
+
+def warp(connection, mode, data=None, camera='default', fmt='png', path=None, output_path=None):
+    """ Warps encoded image bytes `data`, or lets the server read `path` and
+        write `output_path` itself. Returns the encoded result, or the JSON
+        reply when the server writes the file.
+    """
+    params = dict(camera=camera, format=fmt)
+    if path is not None:
+        params['path'] = path
+    if output_path is not None:
+        params['output_path'] = output_path
+    headers, payload = request(connection, 'POST', f'/{mode}', params, data)
+    if output_path is not None:
+        return json.loads(payload.decode('utf-8'))
+    return payload
+
+def main():
+    parser = argparse.ArgumentParser(description='Send dewarp and rewarp requests to `fisheyewarping-server`.')
+    parser.add_argument('mode', choices=['dewarp', 'rewarp', 'health', 'stats'], help='Request to send.')
+    parser.add_argument('input', nargs='?', default='-', help='Input image, `-` reads it from stdin. Default is `-`.')
+    parser.add_argument('-o', '--output', type=str, default='-', help='Output image, `-` writes it to stdout. Default is `-`.')
+    parser.add_argument('--camera', type=str, default='default', help='Camera name on the server. Default is `default`.')
+    parser.add_argument('--format', type=str, default=None, choices=['png', 'jpg'], help='Encoding of the result. Default follows the suffix of `--output`, else `png`.')
+    parser.add_argument('--server_side', action='store_true', help='Let the server read `input` and write `--output` itself, both under the `--root` of the server, relative to it or absolute.')
+    parser.add_argument('--socket', type=str, default=None, help='Unix socket of the server. Default is localhost HTTP.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host of the server. Default is `127.0.0.1`.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port of the server. Default is `{DEFAULT_PORT}`.')
+    args = parser.parse_args()
+
+    connection = connect(args.socket, args.host, args.port)
+    try:
+        if args.mode in ('health', 'stats'):
+            _, payload = request(connection, 'GET', f'/{args.mode}')
+            print(json.dumps(json.loads(payload.decode('utf-8')), indent=2))
+            return
+        fmt = args.format or ('jpg' if Path(args.output).suffix.lower() in ('.jpg', '.jpeg') else 'png')
+        if args.server_side:
+            reply = warp(connection, args.mode, camera=args.camera, path=args.input, output_path=args.output)
+            print(json.dumps(reply))
+            return
+        data = sys.stdin.buffer.read() if args.input == '-' else Path(args.input).read_bytes()
+        payload = warp(connection, args.mode, data, camera=args.camera, fmt=fmt)
+        if args.output == '-':
+            sys.stdout.buffer.write(payload)
+        else:
+            Path(args.output).write_bytes(payload)
+    except ServerError as e:
+        print(f'----- Server error {e}', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    main()
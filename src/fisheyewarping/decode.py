@@ -0,0 +1,73 @@
+"""
+Scale-Aware Decoding
+
+JPEG files can be decoded at 1/2, 1/4 or 1/8 of their size for little more
+than the cost of reading them, by skipping the high frequencies of each block.
+When the output is that much smaller than the panorama, `FisheyeWarping.dewarp_file`
+decodes them so and remaps them with its output maps scaled to the reduced frames.
+"""
+import struct
+from pathlib import Path
+
+import cv2
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+JPEG_SUFFIXES = ('.jpg', '.jpeg')
+
+# Keep grayscale and 16-bit images as they are instead of converting them to 8-bit BGR.
+IMREAD_FLAGS = cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR
+
+# Reductions of the JPEG decoder and the bit of `cv2.imread` flags selecting them.
+DECODE_SCALES = {1: 0, 2: 16, 4: 32, 8: 64}
+
+# Start of frame markers, which hold the image size, among the JPEG markers.
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def is_jpeg(path):
+    return Path(path).suffix.lower() in JPEG_SUFFIXES
+
+def jpeg_size(path):
+    """ Returns `(w, h)` of a JPEG file from its header, without decoding it,
+        or `None` if it is not a JPEG file.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            if f.read(1) != b'\xff':
+                return None
+            code = f.read(1)
+            # any number of 0xFF fill bytes may come before the marker code
+            while code == b'\xff':
+                code = f.read(1)
+            if not code:
+                return None
+            code = code[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD7:
+                # markers without a length
+                continue
+            segment = f.read(2)
+            if len(segment) < 2:
+                return None
+            length, = struct.unpack('>H', segment)
+            if code in _SOF_MARKERS:
+                h, w = struct.unpack('>xHH', f.read(5))
+                return w, h
+            f.seek(length - 2, 1)
+
+def decoded_size(size, scale):
+    """ Returns the size of an image of `size`, `(w, h)` or `(h, w)`, decoded at `1 / scale`. """
+    return tuple(-(-v // scale) for v in size)
+
+def decode_scale(panorama_size, output_size):
+    """ Returns the largest of `DECODE_SCALES` that keeps the panorama of the
+        reduced frames at least as large as `output_size` `(w, h)`, resized
+        from the panorama of `panorama_size`.
+    """
+    w_d, h_d = panorama_size
+    ratio = max(output_size[0] / w_d, output_size[1] / h_d)
+    return max(scale for scale in DECODE_SCALES if ratio * scale <= 1) if ratio <= 1 else 1
+
+def read_image(path, scale=1, flags=IMREAD_FLAGS):
+    """ `cv2.imread` of `path` decoded at `1 / scale`, `None` if it cannot be read. """
+    return cv2.imread(str(path), flags | DECODE_SCALES[scale])
@@ -0,0 +1,110 @@
+"""
+Remap Engine
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Bands of fewer output rows are not worth a task of their own.
+MIN_BAND_ROWS = 16
+
+class RemapEngine:
+    """ Remaps each frame of `FisheyeWarping` in horizontal bands of the output
+        on `workers` threads, every band reading the same maps.
+
+        OpenCV runs `cv2.remap` on a thread pool of its own, which on top of
+        the workers, of other streams or of `use_multiprocessing` oversubscribes
+        the cores. `opencv_threads` sets that pool with `cv2.setNumThreads`,
+        for the whole process, and is 1 by default when the engine has more
+        than one worker. `use_multiprocessing` builds meshes on `workers`
+        processes instead of one per core.
+
+            >>> # one stream with the lowest latency
+            >>> frd = FisheyeWarping(img, engine=RemapEngine(workers=8))
+            >>> # many streams, one thread each
+            >>> engine = RemapEngine(workers=1, opencv_threads=1)
+    """
+
+    def __init__(self, workers=None, opencv_threads=None, bands_per_worker=2):
+        self.workers = workers or os.cpu_count() or 1
+        if opencv_threads is None and self.workers > 1:
+            opencv_threads = 1
+        self.opencv_threads = opencv_threads
+        if opencv_threads is not None:
+            cv2.setNumThreads(opencv_threads)
+        # more bands than workers even out bands of uneven cost
+        self.bands_per_worker = bands_per_worker
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # processes start their own threads, and their own OpenCV pool set the same way
+        return dict(workers=self.workers, opencv_threads=self.opencv_threads, bands_per_worker=self.bands_per_worker)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def bands(self, rows):
+        """ Returns the `(start, stop)` rows of the bands of an output of `rows` rows. """
+        n = max(1, min(self.workers * self.bands_per_worker, rows // MIN_BAND_ROWS))
+        edges = [rows * i // n for i in range(n + 1)]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def remap(self, img, map1, map2, interpolation, out=None, **kwargs):
+        """ Same as `cv2.remap(img, map1, map2, interpolation, dst=out, **kwargs)`. """
+        bands = self.bands(map1.shape[0]) if self.workers > 1 else [(0, map1.shape[0])]
+        if len(bands) == 1:
+            return cv2.remap(img, map1, map2, interpolation, dst=out, **kwargs)
+        if out is None:
+            out = np.empty(map1.shape[:2] + img.shape[2:], dtype=img.dtype)
+
+        def remap_band(band):
+            start, stop = band
+            cv2.remap(img, map1[start:stop], map2[start:stop] if map2 is not None else None, interpolation, dst=out[start:stop], **kwargs)
+        self.__run(remap_band, bands)
+        return out
+
+    def warp_affine(self, img, matrix, size, out=None):
+        """ Same as `cv2.warpAffine(img, matrix, size, dst=out)`. """
+        w, h = size
+        bands = self.bands(h) if self.workers > 1 else [(0, h)]
+        if len(bands) == 1:
+            return cv2.warpAffine(img, matrix, size, dst=out)
+        if out is None:
+            out = np.empty((h, w) + img.shape[2:], dtype=img.dtype)
+        inverse = cv2.invertAffineTransform(matrix)
+
+        def warp_band(band):
+            start, stop = band
+            # the inverse map of the band starts at its first row
+            shifted = inverse.copy()
+            shifted[:, 2] += inverse[:, 1] * start
+            cv2.warpAffine(img, shifted, (w, stop - start), dst=out[start:stop], flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+        self.__run(warp_band, bands)
+        return out
+
+    def close(self):
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __run(self, task, bands):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='remap')
+            executor = self.__executor
+        # the calling thread takes the first band instead of waiting idle
+        futures = [executor.submit(task, band) for band in bands[1:]]
+        task(bands[0])
+        for future in futures:
+            future.result()
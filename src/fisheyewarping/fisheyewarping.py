@@ -1,13 +1,44 @@
 """
 Fisheye Rewarp And Dewarp
 """
-import pickle
 import cv2
 import numpy as np
 from tqdm import tqdm
 import multiprocessing as mp
+import threading
 import time
 
+from .cache import default_mesh_cache, mesh_file_key, mesh_key
+from .decode import decode_scale, decoded_size, is_jpeg, read_image
+from .geometry import OUT_OF_FRAME, CameraGeometry, OutputSpec, output_maps, panorama_input_maps, sample_maps, scaled_maps
+from .incremental import CHANGE_THRESHOLD, INCREMENTAL_TILE, REFRESH_INTERVAL, IncrementalRemap
+from .meshio import read_mesh, save_mesh
+from .shared import attach_arrays, detach_arrays
+from .tiles import DEFAULT_TILE, output_array, remap_window, tile_windows
+from .timing import timed
+from .yuv import NEUTRAL_CHROMA, chroma_maps, yuv_frame_shape, yuv_frame_size, yuv_planes
+
+# Rows computed per block by the vectorized mesh builders. Bounds the size of the
+# float64 temporaries to `MESH_BLOCK_ROWS * width` elements.
+MESH_BLOCK_ROWS = 256
+
+# Subpixel steps of OpenCV's fixed-point remap, its `INTER_TAB_SIZE`.
+REMAP_TAB_SIZE = 32
+
+_remap_is_fixed_point = None
+
+def remap_is_fixed_point():
+    """ Whether `cv2.remap` rounds float maps to `1 / REMAP_TAB_SIZE` pixel, as
+        OpenCV 4 does, rather than sampling them at float precision.
+    """
+    global _remap_is_fixed_point
+    if _remap_is_fixed_point is None:
+        # a quarter step right of a black pixel stays black once rounded
+        img = np.array([[0, 255]], dtype=np.uint8)
+        map_x = np.full((1, 1), 0.25 / REMAP_TAB_SIZE, np.float32)
+        _remap_is_fixed_point = int(cv2.remap(img, map_x, np.zeros_like(map_x), cv2.INTER_LINEAR)[0, 0]) == 0
+    return _remap_is_fixed_point
+
 def unit_vector(vector):
     """ Returns the unit vector of the vector.  """
     np.seterr(invalid='ignore')
@@ -37,99 +68,721 @@ def angle_map(points):
         length_percentage = angle / (2 * np.pi)
     return point, length_percentage, distance
 
+def dewarp_map_block(img_details, row_start, row_stop, col_start=0, col_stop=None):
+    """ Returns the dewarp maps for panorama rows `[row_start, row_stop)` and
+        columns `[col_start, col_stop)`, all columns by default.
+
+        Vectorized equivalent of `FisheyeWarping._dewarp_map_job` over a block
+        of rows. The last row and column are left at zero like the loop builders.
+    """
+    w_d, h_d, r1, r2, c_x, c_y = img_details
+    col_stop = w_d if col_stop is None else col_stop
+    mapx = np.zeros((row_stop - row_start, col_stop - col_start), np.float32)
+    mapy = np.zeros((row_stop - row_start, col_stop - col_start), np.float32)
+    rows = np.arange(row_start, min(row_stop, h_d - 1), dtype=np.float64)
+    cols = np.arange(col_start, min(col_stop, w_d - 1), dtype=np.float64)
+    if rows.size == 0 or cols.size == 0:
+        return mapx, mapy
+    r = (rows / float(h_d)) * (r2 - r1) + r1
+    theta = (cols / float(w_d)) * 2.0 * np.pi
+    r = r[:, np.newaxis]
+    mapx[:rows.size, :cols.size] = np.trunc(c_x + r * np.sin(theta))
+    mapy[:rows.size, :cols.size] = np.trunc(c_y + r * np.cos(theta))
+    return mapx, mapy
+
+def rewarp_center(img_shape, img_details):
+    """ Returns the circle center in the rewarp maps. They are rotated by 180
+        degrees afterwards, which moves it onto `(c_x, c_y)` of `img_details`.
+    """
+    rows, cols = img_shape[:2]
+    _, _, _, _, c_x, c_y = img_details
+    return cols - c_x, rows - c_y
+
+def rewarp_split(img_shape, img_details):
+    """ Returns the first column of the right half of the rewarp maps, which
+        samples the horizontally flipped panorama.
+    """
+    return rewarp_center(img_shape, img_details)[0] + 1
+
+def rewarp_polar_block(img_shape, img_details, row_start, row_stop, col_start=0, col_stop=None):
+    """ Returns `(fraction, distance)` of fisheye rows `[row_start, row_stop)`
+        and columns `[col_start, col_stop)`: the angle from the top of the
+        circle as a fraction of a turn, and the distance to its center.
+
+        Both only depend on the center, so `polar_rewarp_maps` derives the maps
+        of any radii from them.
+    """
+    cols = img_shape[1]
+    col_stop = cols if col_stop is None else col_stop
+    center = np.asarray(rewarp_center(img_shape, img_details))
+    top_point = np.asarray([center[0], 0])
+    top_u = unit_vector(top_point - center)
+
+    dx = np.arange(col_start, col_stop, dtype=np.float64) - center[0]
+    dy = np.arange(row_start, row_stop, dtype=np.float64)[:, np.newaxis] - center[1]
+    distance = np.sqrt(dx * dx + dy * dy)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cos_angle = top_u[0] * (dx / distance) + top_u[1] * (dy / distance)
+    np.clip(cos_angle, -1.0, 1.0, out=cos_angle)
+    fraction = np.arccos(cos_angle, out=cos_angle)
+    fraction /= (2 * np.pi)
+    return fraction, distance
+
+def polar_rewarp_maps(fraction, distance, img_details):
+    """ Returns the rewarp maps and mask of the radii of `img_details` from
+        the `fraction` and `distance` of `rewarp_polar_block`.
+    """
+    panorama_width, _, r1, r2, _, _ = img_details
+    inside = (distance >= r1) & (distance <= r2)
+    xmap = np.where(inside, fraction * panorama_width, 0).astype(np.float32)
+    ymap = np.where(inside, distance - r1, 0).astype(np.float32)
+    mask = inside.astype(np.uint8) * np.uint8(255)
+    return xmap, ymap, mask
+
+def rewarp_map_block(img_shape, img_details, row_start, row_stop, col_start=0, col_stop=None):
+    """ Returns the rewarp maps and mask for fisheye rows `[row_start, row_stop)`
+        and columns `[col_start, col_stop)`, all columns by default.
+
+        Vectorized equivalent of `angle_map` over a block of rows, scaled to
+        the panorama width `w_d` the same way as the loop builders.
+    """
+    polar = rewarp_polar_block(img_shape, img_details, row_start, row_stop, col_start, col_stop)
+    return polar_rewarp_maps(*polar, img_details)
+
+def shift_rewarp_maps(map_x, map_y, mask, img_shape, img_details, center):
+    """ Returns the rewarp maps of `img_details` with the circle moved to `center`.
+
+        The maps only depend on the offset from the circle center, so they are
+        translated, and only the bands moved in from outside the frame are
+        computed with `rewarp_map_block`.
+    """
+    rows, cols = img_shape[:2]
+    new_details = tuple(img_details[:4]) + tuple(center)
+    old_x, old_y = rewarp_center(img_shape, img_details)
+    new_x, new_y = rewarp_center(img_shape, new_details)
+    dx, dy = new_x - old_x, new_y - old_y
+    shifted = [np.zeros(m.shape, m.dtype) for m in (map_x, map_y, mask)]
+    y0, y1 = min(rows, max(0, dy)), max(0, min(rows, rows + dy))
+    x0, x1 = min(cols, max(0, dx)), max(0, min(cols, cols + dx))
+    if y0 < y1 and x0 < x1:
+        for new, old in zip(shifted, (map_x, map_y, mask)):
+            new[y0:y1, x0:x1] = old[y0 - dy:y1 - dy, x0 - dx:x1 - dx]
+    for row_start, row_stop, col_start, col_stop in ((0, y0, 0, cols), (y1, rows, 0, cols), (y0, y1, 0, x0), (y0, y1, x1, cols)):
+        if row_start < row_stop and col_start < col_stop:
+            block = rewarp_map_block(img_shape, new_details, row_start, row_stop, col_start, col_stop)
+            for new, values in zip(shifted, block):
+                new[row_start:row_stop, col_start:col_stop] = values
+    return tuple(shifted)
+
+def fixed_point_maps(map_x, map_y):
+    """ Converts float maps to OpenCV's fixed-point `CV_16SC2` representation.
+
+        Returns `(map1, map2, interpolation)` for `cv2.remap`. Integer-valued
+        maps, like the dewarp mesh, need no interpolation table, so they are
+        stored as `map1` alone and remapped with nearest lookup, which gives the
+        same pixels as the float maps at half their size.
+    """
+    if np.array_equal(map_x, np.trunc(map_x)) and np.array_equal(map_y, np.trunc(map_y)):
+        map1, _ = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=True)
+        return map1, None, cv2.INTER_NEAREST
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return map1, map2, cv2.INTER_LINEAR
+
+def _fuse_halves(map_x, map_y, mask, panorama_width, right):
+    # `right` selects the columns that sample the horizontally flipped panorama
+    fused_x = map_x.astype(np.float32, copy=True)
+    fused_y = map_y.astype(np.float32, copy=True)
+    if remap_is_fixed_point():
+        # mirror the rounded sample of the flipped panorama, so the weights match it exactly
+        steps = np.rint(map_x[:, right].astype(np.float32) * REMAP_TAB_SIZE)
+        fused_x[:, right] = ((panorama_width - 1) * REMAP_TAB_SIZE - steps) / REMAP_TAB_SIZE
+    else:
+        fused_x[:, right] = (panorama_width - 1) - map_x[:, right].astype(np.float64)
+    outside = (mask == 0) | np.isnan(fused_x) | np.isnan(fused_y)
+    fused_x[outside] = OUT_OF_FRAME
+    fused_y[outside] = OUT_OF_FRAME
+    return fused_x, fused_y
+
+def fused_rewarp_maps(map_x, map_y, mask, panorama_width, rotate=True, split=None):
+    """ Folds the whole of `FisheyeWarping.rewarp` into one pair of maps.
+
+        The right half, from column `split` (`rewarp_split`), samples the
+        horizontally flipped panorama, pixels outside the mask are sent out of
+        frame, and `rotate` applies the 180 degree rotation of `__wrap`, which
+        moves pixel `(x, y)` to `(w - x, h - y)`.
+    """
+    h, w = map_x.shape
+    # meshes that do not record their geometry have a centered circle
+    vertical_center = int(h / 2) + 1 if split is None else split
+    fused_x, fused_y = _fuse_halves(map_x, map_y, mask, panorama_width, slice(vertical_center, None))
+    if rotate:
+        rotated_x = np.full_like(fused_x, OUT_OF_FRAME)
+        rotated_y = np.full_like(fused_y, OUT_OF_FRAME)
+        rotated_x[1:, 1:] = fused_x[:0:-1, :0:-1]
+        rotated_y[1:, 1:] = fused_y[:0:-1, :0:-1]
+        fused_x, fused_y = rotated_x, rotated_y
+    return fused_x, fused_y
+
+def dewarp_tile_maps(img_details, window, output_spec=None):
+    """ Returns the dewarp maps of the output `window` `(x, y, w, h)`, built
+        from only the mesh block the window needs.
+
+        Without `output_spec` these are the maps of `dewarp(..., flip=False)`,
+        otherwise the window of `output_maps` with `output_spec` baked in.
+    """
+    x, y, w, h = window
+    if output_spec is None:
+        return dewarp_map_block(img_details, y, y + h, x, x + w)
+    w_d, h_d = img_details[:2]
+    src_x, src_y = output_spec.source_coordinates(w_d, h_d, window)
+    valid = (src_x >= 0) & (src_x <= w_d - 1) & (src_y >= 0) & (src_y <= h_d - 1)
+    if not valid.any():
+        return np.full((h, w), OUT_OF_FRAME, np.float32), np.full((h, w), OUT_OF_FRAME, np.float32)
+    # bilinear sampling reads the next row and column as well
+    col_start = int(np.floor(src_x[valid].min()))
+    col_stop = min(w_d, int(np.floor(src_x[valid].max())) + 2)
+    row_start = int(np.floor(src_y[valid].min()))
+    row_stop = min(h_d, int(np.floor(src_y[valid].max())) + 2)
+    block_x, block_y = dewarp_map_block(img_details, row_start, row_stop, col_start, col_stop)
+    return sample_maps(block_x, block_y, src_x, src_y, origin=(col_start, row_start), shape=(h_d, w_d))
+
+def fused_rewarp_tile_maps(img_shape, img_details, window):
+    """ Returns the window `(x, y, w, h)` of `fused_rewarp_maps(..., rotate=True)`,
+        built from only the rewarp mesh block the window needs.
+    """
+    rows, cols = img_shape[:2]
+    x, y, w, h = window
+    tile_x = np.full((h, w), OUT_OF_FRAME, np.float32)
+    tile_y = np.full((h, w), OUT_OF_FRAME, np.float32)
+    # output (x, y) comes from (cols - x, rows - y), row and column 0 stay out of frame
+    x0, y0 = max(x, 1), max(y, 1)
+    if x0 >= x + w or y0 >= y + h:
+        return tile_x, tile_y
+    row_start, row_stop = rows - (y + h - 1), rows - y0 + 1
+    col_start, col_stop = cols - (x + w - 1), cols - x0 + 1
+    map_x, map_y, mask = rewarp_map_block(img_shape, img_details, row_start, row_stop, col_start, col_stop)
+    right = np.arange(col_start, col_stop) >= rewarp_split(img_shape, img_details)
+    fused_x, fused_y = _fuse_halves(map_x, map_y, mask, img_details[0], right)
+    tile_x[y0 - y:, x0 - x:] = fused_x[::-1, ::-1]
+    tile_y[y0 - y:, x0 - x:] = fused_y[::-1, ::-1]
+    return tile_x, tile_y
+
+def _remap_args(maps):
+    """ `cv2.remap` arguments of float or fixed-point maps, a single map is nearest-neighbour. """
+    if len(maps) == 1:
+        return maps[0], None, cv2.INTER_NEAREST
+    return maps[0], maps[1], cv2.INTER_LINEAR
+
 class FisheyeWarping:
 
-    def __init__(self, img, use_multiprocessing=False):
+    MAP_TYPES = ('float', 'fixed')
+
+    def __init__(self, img, use_multiprocessing=False, use_vectorization=True, mesh_cache=None, map_type='float', fuse_rewarp=True, output_spec=None, verbose=True, timings=None, mesh_registry=None, geometry=None, engine=None, pyramid=None):
+        assert map_type in self.MAP_TYPES, f'`map_type` must be one of {self.MAP_TYPES}.'
         self.img = img
+        # the `CameraGeometry` the meshes are built from, taken from `img` when `None`
+        self.geometry = geometry
+        # `False` drops every print and progress bar
+        self.verbose = verbose
+        # a `Timings` that receives the time of every stage
+        self.timings = timings
+        # baked into the maps of `dewarp(..., flip=True)`, the default is the 180 degree rotation of `__wrap`
+        self.output_spec = output_spec or OutputSpec(rotate=180, size=geometry.output_size if geometry else None)
+        # `fixed` remaps every frame with maps converted once by `fixed_point_maps`
+        self.map_type = map_type
+        # `rewarp(..., flip=True)` runs a single remap with `fused_rewarp_maps`
+        self.fuse_rewarp = fuse_rewarp
         self.use_multiprocessing = use_multiprocessing
+        self.use_vectorization = use_vectorization
+        # `None` uses the default cache, `False` disables caching
+        if mesh_cache is None:
+            mesh_cache = default_mesh_cache()
+        self.mesh_cache = mesh_cache or None
+        # a `SharedMeshRegistry` that keeps the maps in shared memory, `None` keeps them private
+        self.mesh_registry = mesh_registry
+        # a `RemapEngine` that splits each remap in bands on its threads, `None` leaves it to OpenCV
+        self.engine = engine
+        # `(w, h)` sizes of the outputs of `dewarp_pyramid`, each with the maps of `output_spec` at that size
+        self.pyramid = tuple(tuple(size) for size in pyramid) if pyramid else ()
 
         self.__dewarp_map_x, self.__dewarp_map_y = None, None
         self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = None, None, None
+        # (map1, map2, interpolation) passed to `cv2.remap` for every frame
+        self.__dewarp_remap, self.__rewarp_remap = None, None
+        self.__dewarp_output_remap = None
+        # fused rewarp maps by panorama width, and by input size for `rewarp_with_mesh`
+        self.__fused_rewarp_remaps = dict()
+        self.__panorama_input_remaps = dict()
+        self.__chroma_remaps = dict()
+        # output maps of frames decoded at a reduced scale, by scale
+        self.__reduced_remaps = dict()
+        # remaps of the levels of `pyramid`, derived with the dewarp mesh
+        self.__pyramid_remaps = list()
 
         self.__panorama_shape = None
+        # keys of the meshes in the mesh registry, also keying the maps derived from them
+        self.__dewarp_key, self.__rewarp_key = None, None
+        # (view, remap) by name
+        self.__views = dict()
+        # `(img_shape, center, fraction, distance)` of `rewarp_polar_block` over
+        # the whole frame, kept by `set_geometry` for the next radius change
+        self.__polar_grid = None
+        # intermediate frames of the two-pass rewarp, reused by each thread
+        self.__scratch = threading.local()
 
-    def build_dewarp_mesh(self, save_path=None):
-        if self.use_multiprocessing:
-            self.__dewarp_map_x, self.__dewarp_map_y = self.__build_dewarp_map_with_mp(self.img)
-        else:
-            self.__dewarp_map_x, self.__dewarp_map_y = self.__build_dewarp_map(self.img)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_FisheyeWarping__scratch']
+        # cheap to compute again, and much larger than the maps
+        state['_FisheyeWarping__polar_grid'] = None
+
+        if self.mesh_registry is not None:
+            # workers attach to the shared maps instead of receiving copies
+            state = detach_arrays(self.mesh_registry, state)
+        return state
+
+    def __copy__(self):
+        # a copy in this process keeps the polar grid, which `__getstate__` drops
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.__scratch = threading.local()
+        return clone
+
+    def __setstate__(self, state):
+        if state.get('mesh_registry') is not None:
+            state = attach_arrays(state['mesh_registry'], state)
+        self.__dict__.update(state)
+        self.__scratch = threading.local()
+
+    @property
+    def panorama_shape(self):
+        """ `(w, h)` of the dewarp mesh, `None` before it is built or loaded. """
+        return self.__panorama_shape
+
+    def build_dewarp_mesh(self, save_path=None, downsample=1):
+        """ Builds the dewarp maps, or takes them from the mesh registry or cache,
+            and saves them to `save_path` when given. A `downsample` of 4 or 8
+            saves a compact mesh file, within `COMPACT_MAX_ERROR` pixels of the
+            maps once loaded, see `meshio.compact_arrays`.
+        """
+        img_shape, img_details = self.__fisheye_geometry()
+        self.__set_dewarp_mesh(img_shape, img_details)
         if save_path and isinstance(save_path, str):
-            with open(save_path, 'wb') as f:
-                pickle.dump((self.__dewarp_map_x, self.__dewarp_map_y), f)
-        print(f'Dewarp Map X shape -> {self.__dewarp_map_x.shape}')
-        print(f'Dewarp Map Y shape -> {self.__dewarp_map_y.shape}')
+            with timed(self.timings, 'mesh_save'):
+                save_mesh(
+                    save_path,
+                    'dewarp',
+                    dict(map_x=self.__dewarp_map_x, map_y=self.__dewarp_map_y),
+                    panorama_shape=self.__panorama_shape,
+                    img_shape=img_shape,
+                    geometry=img_details,
+                    downsample=downsample
+                )
+        self.__log(f'Dewarp Map X shape -> {self.__dewarp_map_x.shape}')
+        self.__log(f'Dewarp Map Y shape -> {self.__dewarp_map_y.shape}')
+        return  self.__panorama_shape, self.__dewarp_map_x, self.__dewarp_map_y
+
+    def __set_dewarp_mesh(self, img_shape, img_details, disk=True):
+        key = mesh_key('dewarp', img_shape, img_details)
+        self.__dewarp_key = key
+        self.__dewarp_map_x, self.__dewarp_map_y = self.__mesh(key, self.__build_dewarp_maps, disk)
         h, w = self.__dewarp_map_x.shape
         self.__panorama_shape = (w, h)
-        return  self.__panorama_shape, self.__dewarp_map_x, self.__dewarp_map_y
+        self.__update_dewarp_remaps(key if disk else None)
 
     def load_dewarp_mesh(self, mesh_path:str):
-        with open(mesh_path, 'rb') as f:
-             self.__panorama_shape, self.__dewarp_map_x, self.__dewarp_map_y = pickle.load(f)
+        """ Loads a mesh file, memory-mapped unless it is compact, or a mesh pickled by older versions. """
+        with timed(self.timings, 'mesh_load'):
+            mesh = read_mesh(mesh_path, 'dewarp')
+            self.__panorama_shape = mesh.panorama_shape
+            if mesh.geometry is not None:
+                self.geometry = CameraGeometry.from_details(mesh.img_shape, mesh.geometry)
+            self.__dewarp_key = self.__loaded_mesh_key(mesh, mesh_path)
+            self.__dewarp_map_x, self.__dewarp_map_y = self.__shared(self.__dewarp_key, mesh.maps)
+            self.__update_dewarp_remaps()
         return self.__panorama_shape, self.__dewarp_map_x, self.__dewarp_map_y
 
-    def run_dewarp(self, save_path=None):
-        result = self.dewarp(self.img, flip=True)
-        print(f'Panorama shape is `{result.shape}`')
+    def run_dewarp(self, save_path=None, img_path=None):
+        """ Dewarps `img`, or the file `img_path` with `dewarp_file`, and saves it to `save_path`. """
+        result = self.dewarp_file(img_path) if img_path else self.dewarp(self.img, flip=True)
+        self.__log(f'Panorama shape is `{result.shape}`')
         if save_path and isinstance(save_path, str):
-            cv2.imwrite(save_path, result)
+            with timed(self.timings, 'encode'):
+                cv2.imwrite(save_path, result)
         return result
 
-    def build_rewarp_mesh(self, save_path=None):
-        if self.use_multiprocessing:
-            self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = self.__build_rewarp_map_with_mp()
-        else:
-            self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = self.__build_rewarp_map()
+    def build_rewarp_mesh(self, save_path=None, downsample=1):
+        """ `build_dewarp_mesh` of the rewarp maps and mask. """
+        img_shape, img_details = self.__fisheye_geometry()
+        if self.__panorama_shape is None:
+            # the shape of the dewarp mesh, no need to build it
+            self.__panorama_shape = tuple(img_details[:2])
+        key = mesh_key('rewarp', img_shape, img_details, self.__panorama_shape)
+        self.__rewarp_key = key
+        self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = self.__mesh(key, self.__build_rewarp_maps)
+        self.__rewarp_remap = self.__remap_maps(self.__rewarp_map_x, self.__rewarp_map_y, key, key)
+        self.__fused_rewarp_remaps = dict()
+        self.__panorama_input_remaps = dict()
+        self.__chroma_remaps = dict()
         if save_path and isinstance(save_path, str):
-            with open(save_path, 'wb') as f:
-                pickle.dump((self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask), f)
-        print(f'Rewarp Map X shape -> {self.__rewarp_map_x.shape}')
-        print(f'Rewarp Map Y shape -> {self.__rewarp_map_y.shape}')
-        print(f'Rewarp Map MASK shape -> {self.__rewarp_mask.shape}')
+            with timed(self.timings, 'mesh_save'):
+                save_mesh(
+                    save_path,
+                    'rewarp',
+                    dict(map_x=self.__rewarp_map_x, map_y=self.__rewarp_map_y, mask=self.__rewarp_mask),
+                    panorama_shape=self.__panorama_shape,
+                    img_shape=img_shape,
+                    geometry=img_details,
+                    downsample=downsample
+                )
+        self.__log(f'Rewarp Map X shape -> {self.__rewarp_map_x.shape}')
+        self.__log(f'Rewarp Map Y shape -> {self.__rewarp_map_y.shape}')
+        self.__log(f'Rewarp Map MASK shape -> {self.__rewarp_mask.shape}')
         return self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask
 
     def load_rewarp_mesh(self, mesh_path:str):
-        with open(mesh_path, 'rb') as f:
-            self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = pickle.load(f)
+        """ Loads a mesh file, memory-mapped unless it is compact, or a mesh pickled by older versions. """
+        with timed(self.timings, 'mesh_load'):
+            mesh = read_mesh(mesh_path, 'rewarp')
+            if self.__panorama_shape is None:
+                self.__panorama_shape = mesh.panorama_shape
+            if mesh.geometry is not None:
+                self.geometry = CameraGeometry.from_details(mesh.img_shape, mesh.geometry)
+            self.__rewarp_key = self.__loaded_mesh_key(mesh, mesh_path)
+            self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = self.__shared(self.__rewarp_key, mesh.maps)
+            self.__rewarp_remap = self.__remap_maps(self.__rewarp_map_x, self.__rewarp_map_y, shared_key=self.__rewarp_key)
+        self.__fused_rewarp_remaps = dict()
+        self.__panorama_input_remaps = dict()
+        self.__chroma_remaps = dict()
         return self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask
 
     def run_rewarp(self, save_path=None):
         dewarp_result = self.dewarp(self.img, flip=False)
         result = self.rewarp(dewarp_result, flip=True)
-        print(f'Fisheye image shape is `{result.shape}`')
+        self.__log(f'Fisheye image shape is `{result.shape}`')
+        if save_path and isinstance(save_path, str):
+            with timed(self.timings, 'encode'):
+                cv2.imwrite(save_path, result)
+        return result
+
+    def run_rewarp_with_mesh(self, panorama_img, save_path=None):
+        result = self.rewarp_with_mesh(panorama_img)
+        self.__log(f'Fisheye image shape is `{result.shape}`')
         if save_path and isinstance(save_path, str):
-            cv2.imwrite(save_path, result)
+            with timed(self.timings, 'encode'):
+                cv2.imwrite(save_path, result)
         return result
 
-    def run_rewarp_with_mesh(self, panorama_img, save_path):
+    def __log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def __progress(self, iterable, desc):
+        return tqdm(iterable, desc=desc) if self.verbose else iterable
+
+    def __cached_maps(self, key):
+        maps = self.mesh_cache.get(key) if self.mesh_cache else None
+        if self.timings is not None and self.mesh_cache:
+            self.timings.count('mesh_cache_misses' if maps is None else 'mesh_cache_hits')
+        return maps
+
+    def __shared(self, key, build):
+        """ Returns the arrays of `key` in the mesh registry, placing the ones
+            `build()` returns on a miss, or `build()` without a registry.
+        """
+        if self.mesh_registry is None or key is None:
+            return tuple(build())
+        return self.mesh_registry.get_or_create(key, build)
+
+    def __mesh(self, key, build, disk=True):
+        """ Returns the maps of `key` from the mesh registry, the mesh cache or
+            `build()`. Built maps skip the disk tier of the cache without `disk`.
+        """
+        def cached_or_built():
+            maps = self.__cached_maps(key)
+            if maps is None:
+                with timed(self.timings, 'mesh_build'):
+                    maps = build()
+                if self.mesh_cache:
+                    maps = self.mesh_cache.put(key, maps, disk=disk)
+            return maps
+        return self.__shared(key, cached_or_built)
+
+    def __loaded_mesh_key(self, mesh, mesh_path):
+        if mesh.geometry is None:
+            return mesh_file_key(mesh.kind, mesh_path)
+        panorama_shape = mesh.panorama_shape if mesh.kind == 'rewarp' else None
+        return mesh_key(mesh.kind, mesh.img_shape, mesh.geometry, panorama_shape)
+
+    def __build_dewarp_maps(self):
+        _, img_details = self.__fisheye_geometry()
+        if self.use_vectorization:
+            return self.__build_dewarp_map_vectorized(img_details)
+        elif self.use_multiprocessing:
+            return self.__build_dewarp_map_with_mp(img_details)
+        return self.__build_dewarp_map(img_details)
+
+    def __build_rewarp_maps(self):
+        if self.use_vectorization:
+            return self.__build_rewarp_map_vectorized()
+        elif self.use_multiprocessing:
+            return self.__build_rewarp_map_with_mp()
+        return self.__build_rewarp_map()
+
+    def __remap_maps(self, map_x, map_y, key=None, shared_key=None):
+        """ Returns the `cv2.remap` arguments of float maps. Fixed-point maps
+            are kept in the mesh cache under `key` and in the mesh registry
+            under `shared_key`.
+        """
+        if self.map_type == 'float':
+            return map_x, map_y, cv2.INTER_LINEAR
+        key = key and f'{key}-fixed'
+        shared_key = shared_key and f'{shared_key}-fixed'
+        return _remap_args(self.__shared(shared_key, lambda: self.__fixed_maps(map_x, map_y, key)))
+
+    def __fixed_maps(self, map_x, map_y, key=None):
+        maps = self.mesh_cache.get(key) if key and self.mesh_cache else None
+        if maps is None:
+            map1, map2, _ = fixed_point_maps(map_x, map_y)
+            maps = (map1,) if map2 is None else (map1, map2)
+            if key and self.mesh_cache:
+                maps = self.mesh_cache.put(key, maps)
+        return maps
+
+    def __derived_remap(self, shared_key, build):
+        """ Returns the `cv2.remap` arguments of the float maps `build()`
+            returns, kept in the mesh registry under `shared_key`.
+        """
+        if self.map_type == 'float':
+            return _remap_args(self.__shared(shared_key, build))
+        shared_key = shared_key and f'{shared_key}-fixed'
+        return _remap_args(self.__shared(shared_key, lambda: self.__fixed_maps(*build())))
+
+    def __update_dewarp_remaps(self, key=None):
+        shared_key = self.__dewarp_key
+        self.__dewarp_remap = self.__remap_maps(self.__dewarp_map_x, self.__dewarp_map_y, key, shared_key)
+        self.__dewarp_output_remap = self.__derived_remap(
+            shared_key and f'{shared_key}-output-{self.output_spec.key()}',
+            lambda: output_maps(self.__dewarp_map_x, self.__dewarp_map_y, self.output_spec)
+        )
+        self.__panorama_input_remaps = dict()
+        self.__chroma_remaps = dict()
+        self.__reduced_remaps = dict()
+        self.__update_pyramid_remaps()
+
+    def __update_pyramid_remaps(self):
+        h_d, w_d = self.__dewarp_map_x.shape
+        self.__pyramid_remaps = list()
+        for size in self.pyramid:
+            spec = self.output_spec.for_output_size(size, w_d, h_d)
+            if spec == self.output_spec:
+                self.__pyramid_remaps.append(self.__dewarp_output_remap)
+                continue
+            shared_key = self.__dewarp_key
+            self.__pyramid_remaps.append(self.__derived_remap(
+                shared_key and f'{shared_key}-output-{spec.key()}',
+                lambda spec=spec: output_maps(self.__dewarp_map_x, self.__dewarp_map_y, spec)
+            ))
+
+    def set_geometry(self, geometry):
+        """ Moves the built meshes and views to a new `CameraGeometry`.
+
+            A new circle center translates the rewarp maps instead of computing
+            them again, with the same result. Other changes rebuild the meshes
+            that were built. `output_size` resizes the output like `set_output_spec`.
+        """
+        previous = self.geometry
+        if (previous is None or previous.frame_size is None) and self.img is not None:
+            previous = (previous or CameraGeometry()).for_shape(self.img.shape)
+        if previous is not None and previous.frame_size is not None:
+            geometry = geometry.for_shape(previous.img_shape)
+        else:
+            previous = None
+        self.geometry = geometry
+        self.output_spec = self.output_spec.with_size(geometry.output_size)
+        img_shape, img_details = self.__fisheye_geometry()
+
+        shift = previous is not None and geometry.is_center_shift_of(previous)
+        if not shift:
+            self.__panorama_shape = None
+        # geometries passed while tuning are kept in memory, not on disk
+        if self.__dewarp_map_x is not None:
+            # an outer product of a column of radii and a row of angles, cheaper than any offset
+            self.__set_dewarp_mesh(img_shape, img_details, disk=False)
+        if self.__rewarp_map_x is not None:
+            if self.__panorama_shape is None:
+                self.__panorama_shape = tuple(img_details[:2])
+            key = mesh_key('rewarp', img_shape, img_details, self.__panorama_shape)
+            self.__rewarp_key = key
+            if shift:
+                previous_details = previous.details()
+                build = lambda: shift_rewarp_maps(
+                    self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask, img_shape, previous_details, img_details[4:]
+                )
+            else:
+                build = lambda: self.__polar_rewarp_maps(img_shape, img_details)
+            self.__rewarp_map_x, self.__rewarp_map_y, self.__rewarp_mask = self.__mesh(key, build, disk=False)
+            self.__rewarp_remap = self.__remap_maps(self.__rewarp_map_x, self.__rewarp_map_y, shared_key=key)
+            self.__fused_rewarp_remaps = dict()
+            self.__panorama_input_remaps = dict()
+        self.__chroma_remaps = dict()
+
+        views, self.__views = self.__views, dict()
+        for name, (view, _) in views.items():
+            self.__add_view(name, view, disk=False)
+
+    def __polar_rewarp_maps(self, img_shape, img_details):
+        """ Returns the rewarp maps of new radii from the polar grid of the
+            circle center, computed over the whole frame on the first call.
+        """
+        center = tuple(img_details[4:])
+        grid = self.__polar_grid
+        if grid is None or grid[:2] != (img_shape, center):
+            rows = img_shape[0]
+            grid = (img_shape, center) + rewarp_polar_block(img_shape, img_details, 0, rows)
+            self.__polar_grid = grid
+        _, _, fraction, distance = grid
+        return polar_rewarp_maps(fraction, distance, img_details)
+
+    def set_output_spec(self, output_spec):
+        """ Bakes a new `OutputSpec` into the maps of `dewarp(..., flip=True)`. """
+        self.output_spec = output_spec
+        if self.__dewarp_map_x is not None:
+            self.__update_dewarp_remaps()
+
+    def set_pyramid(self, sizes):
+        """ Derives the maps of `dewarp_pyramid` for the output `sizes` `(w, h)`. """
+        self.pyramid = tuple(tuple(size) for size in sizes)
+        if self.__dewarp_map_x is not None:
+            self.__update_pyramid_remaps()
+
+    def __fisheye_geometry(self):
+        """ Returns `(img_shape, img_details)` of `geometry`, completed from `img` when needed. """
+        if self.geometry is None or self.geometry.frame_size is None:
+            warning_msg = "Meshes need the fisheye image, a `CameraGeometry` with `frame_size` or a mesh file that records its geometry."
+            assert self.img is not None, warning_msg
+            self.geometry = (self.geometry or CameraGeometry()).for_shape(self.img.shape)
+        return self.geometry.img_shape, self.geometry.details()
+
+    def __rewarp_split(self):
+        if self.geometry is None and self.img is None:
+            # meshes pickled by older versions, with a centered circle
+            return None
+        return rewarp_split(*self.__fisheye_geometry())
+
+    def add_view(self, name, view):
+        """ Builds, or takes from the mesh cache, the maps of a `PanoramaView` or
+            `PerspectiveView` and keeps them under `name`.
+        """
+        return self.__add_view(name, view)
+
+    def __add_view(self, name, view, disk=True):
+        img_shape, img_details = self.__fisheye_geometry()
+        _, _, _, r2, c_x, c_y = img_details
+        key = mesh_key('view', img_shape, img_details, extra=view.key())
+        maps = self.__mesh(key, lambda: view.build_maps((c_x, c_y), r2), disk)
+        self.__views[name] = (view, self.__remap_maps(*maps, key if disk else None, key))
+        return view
+
+    def remove_view(self, name):
+        del self.__views[name]
+
+    @property
+    def views(self):
+        return {name: view for name, (view, _) in self.__views.items()}
+
+    def render_view(self, img, name):
+        warning_msg = f"View `{name}` has not been added! Please run `add_view` first."
+        assert name in self.__views, warning_msg
+        map1, map2, interpolation = self.__views[name][1]
+        with timed(self.timings, 'remap'):
+            return self.__engine_remap(img, map1, map2, interpolation)
+
+    def render_views(self, img, names=None):
+        """ Renders every view, or the views in `names`, of one fisheye frame.
+
+            Each view remaps only its own output pixels, so many small views
+            cost far less than dewarping the full panorama and cropping it.
+        """
+        names = list(self.__views) if names is None else names
+        return {name: self.render_view(img, name) for name in names}
+
+    def dewarp_tiled(self, img, flip=False, tile=DEFAULT_TILE, out=None):
+        """ Same pixels as `dewarp` with float maps, computed tile by tile.
+
+            The mesh of each output `tile` `(w, h)` is built on the fly and only
+            the part of `img` it needs is read, so no full-frame map is needed
+            and `img` and `out` may be memory-mapped. Peak memory is bounded by
+            the tile size.
+        """
+        img_shape, img_details = self.__fisheye_geometry()
+        output_spec = self.output_spec if flip else None
+        w_d, h_d = img_details[:2]
+        size = output_spec.output_size(w_d, h_d) if flip else (w_d, h_d)
+        out = output_array(out, (size[1], size[0]) + img.shape[2:], img.dtype)
+        for window in tile_windows(size, tile):
+            x, y, w, h = window
+            with timed(self.timings, 'mesh_build'):
+                map_x, map_y = dewarp_tile_maps(img_details, window, output_spec)
+            with timed(self.timings, 'remap'):
+                remap_window(img, map_x, map_y, out[y:y + h, x:x + w])
+        return out
+
+    def rewarp_with_mesh_tiled(self, panorama_img, tile=DEFAULT_TILE, out=None):
+        """ Same pixels as `rewarp_with_mesh` with fused float maps, computed
+            tile by tile like `dewarp_tiled`.
+        """
+        img_shape, img_details = self.__fisheye_geometry()
+        panorama_shape = self.__panorama_shape or tuple(img_details[:2])
+        input_size = panorama_img.shape[1::-1]
+        h, w = img_shape[:2]
+        out = output_array(out, (h, w) + panorama_img.shape[2:], panorama_img.dtype)
+        for window in tile_windows((w, h), tile):
+            x, y, tile_w, tile_h = window
+            with timed(self.timings, 'mesh_build'):
+                fused_x, fused_y = fused_rewarp_tile_maps(img_shape, img_details, window)
+                map_x, map_y = panorama_input_maps(fused_x, fused_y, panorama_shape, input_size)
+            with timed(self.timings, 'remap'):
+                remap_window(panorama_img, map_x, map_y, out[y:y + tile_h, x:x + tile_w])
+        return out
+
+    def incremental(self, mode='dewarp', input_size=None, tile=INCREMENTAL_TILE, threshold=CHANGE_THRESHOLD, refresh_interval=REFRESH_INTERVAL):
+        """ Returns an `IncrementalRemap` that follows `dewarp(..., flip=True)`,
+            or `rewarp_with_mesh` of panoramas of `input_size` `(w, h)`, for
+            streams of a still camera. It keeps the maps of now, build the
+            meshes first and call it again after changing them.
+        """
+        if mode == 'dewarp':
+            warning_msg = "Dewarp mesh have not been created! Please run `build_dewarp_mesh` first."
+            assert self.__dewarp_map_x is not None, warning_msg
+            remap = self.__dewarp_output_remap
+        else:
+            warning_msg = "Incremental rewarp needs `fuse_rewarp`, the shape of panorama and `input_size`."
+            assert self.fuse_rewarp and self.__panorama_shape is not None and input_size is not None, warning_msg
+            remap = self.__panorama_input_remap(tuple(input_size))
+        return IncrementalRemap(remap, tile=tile, threshold=threshold, refresh_interval=refresh_interval, timings=self.timings)
+
+    def rewarp_with_mesh(self, panorama_img, out=None):
+        """ Rewarps a panorama of any size, into the preallocated `out` when given. """
         warning_msg = "Rewarp needs the shape of panorama generated from `run_dewarp`. Please run it first."
         assert self.__panorama_shape != None, warning_msg
-        panorama_img = cv2.resize(panorama_img, self.__panorama_shape)
-        panorama_img = self.__wrap(panorama_img, rotate_angle=180, scale=1)
-        result = self.rewarp(
+        if self.fuse_rewarp:
+            return self.__remap(panorama_img, *self.__panorama_input_remap(panorama_img.shape[1::-1]), out=out)
+        w, h = self.__panorama_shape
+        shape = (h, w) + panorama_img.shape[2:]
+        with timed(self.timings, 'rotate_resize'):
+            panorama_img = cv2.resize(panorama_img, self.__panorama_shape, dst=self.__buffer('resized', shape, panorama_img.dtype))
+        panorama_img = self.__wrap(panorama_img, rotate_angle=180, scale=1, out=self.__buffer('wrapped', shape, panorama_img.dtype))
+        return self.rewarp(
             panorama_img,
-            flip=True
+            flip=True,
+            out=out
         )
-        print(f'Fisheye image shape is `{result.shape}`')
-        if save_path and isinstance(save_path, str):
-            cv2.imwrite(save_path, result)
-        return result
 
-    def __get_fisheye_img_data(self, img):
-        # Center
-        c_x = int(img.shape[1]/2)
-        c_y = int(img.shape[0]/2)
-        # Inner circle, now is zero
-        r1_x = int(img.shape[1]/2)
-        #r1_y = int(img.shape[0]/2)
-        r1 = r1_x - c_x
-        # Outter circle
-        r2_x = int(img.shape[1])
-        #r2_y = 0
-        r2 = r2_x - c_x
-        # Rectangle width and height
-        w_d = int(2.0 * (( r2 + r1 ) / 2) * np.pi)
-        h_d = (r2 - r1)
-        return w_d, h_d, r1, r2, c_x, c_y
+    def rewarp_with_mesh_batch(self, frames, out=None):
+        """ `rewarp_with_mesh` of a stack of panoramas `(n, h, w[, c])` into `out`. """
+        return self.__batch(lambda frame, result: self.rewarp_with_mesh(frame, out=result), frames, out)
 
     def _dewarp_map_job(self, point):
         y, x, img_details = point
@@ -140,161 +793,410 @@ class FisheyeWarping:
         y_s = int(c_y + r * np.cos(theta))
         return (y, x), x_s, y_s
 
-    def __build_dewarp_map(self, img):
-        img_details = self.__get_fisheye_img_data(img)
+    def __build_dewarp_map(self, img_details):
         w_d, h_d, _, _, _, _ = img_details
         mapx = np.zeros((h_d, w_d), np.float32)
         mapy = np.zeros((h_d, w_d), np.float32)
-        for y in tqdm(range(0, int(h_d-1)), desc='Run dewarp job...'):
+        for y in self.__progress(range(0, int(h_d-1)), desc='Run dewarp job...'):
             for x in range(0, int(w_d-1)):
                 _, x_s, y_s = self._dewarp_map_job((y, x, img_details))
-                mapx.itemset((y, x), x_s)
-                mapy.itemset((y, x), y_s)
+                mapx[y, x] = x_s
+                mapy[y, x] = y_s
         return mapx, mapy
 
-    def __build_dewarp_map_with_mp(self, img):
-        img_details = self.__get_fisheye_img_data(img)
+    def __build_dewarp_map_with_mp(self, img_details):
         w_d, h_d, _, _, _, _ = img_details
         mapx = np.zeros((h_d, w_d), np.float32)
         mapy = np.zeros((h_d, w_d), np.float32)
 
         jobList = list()
-        for y in tqdm(range(0, int(h_d-1)), desc='Getting (x, y) for rectangle...'):
+        for y in self.__progress(range(0, int(h_d-1)), desc='Getting (x, y) for rectangle...'):
             for x in range(0, int(w_d-1)):
                 jobList.append((y, x, img_details))
-        st = time.time()
-        print('-------Start multi pixel mapping for dewarpping-------')
-        with mp.Pool() as p:
+        st = time.perf_counter()
+        self.__log('-------Start multi pixel mapping for dewarpping-------')
+        with mp.Pool(self.engine and self.engine.workers) as p:
             results = p.map(self._dewarp_map_job, jobList)
-        print('--------Mapping Completed-------- ({:0.3f} s)'.format(time.time() - st))
-        for result in tqdm(results, desc='Mapping values to rectangle...'):
+        self.__log('--------Mapping Completed-------- ({:0.3f} s)'.format(time.perf_counter() - st))
+        for result in self.__progress(results, desc='Mapping values to rectangle...'):
             point, x_s, y_s = result
-            mapx.itemset(point, x_s)
-            mapy.itemset(point, y_s)
+            mapx[point] = x_s
+            mapy[point] = y_s
         
         return mapx, mapy
 
-    def dewarp(self, img, flip=False):
+    def __build_dewarp_map_vectorized(self, img_details):
+        w_d, h_d, _, _, _, _ = img_details
+        mapx = np.zeros((h_d, w_d), np.float32)
+        mapy = np.zeros((h_d, w_d), np.float32)
+        for row_start in range(0, h_d, MESH_BLOCK_ROWS):
+            row_stop = min(row_start + MESH_BLOCK_ROWS, h_d)
+            mapx[row_start:row_stop], mapy[row_start:row_stop] = dewarp_map_block(img_details, row_start, row_stop)
+        return mapx, mapy
+
+    def dewarp(self, img, flip=False, out=None):
+        """ Dewarps `img`, into the preallocated `out` when given. """
         warning_msg = "Dewarp mesh have not been created! Please run `build_dewarp_mesh` first."
         assert self.__dewarp_map_x is not None, warning_msg
         assert self.__dewarp_map_y is not None, warning_msg
-        output = cv2.remap(
-            img,
-            self.__dewarp_map_x,
-            self.__dewarp_map_y,
-            cv2.INTER_LINEAR
-        )
-        if flip:
-            output = self.__wrap(output, 180, scale=1)
-        return output
+        # `flip` applies `output_spec`, baked into the maps
+        return self.__remap(img, *(self.__dewarp_output_remap if flip else self.__dewarp_remap), out=out)
+
+    def dewarp_pyramid(self, img, out=None):
+        """ Returns `dewarp(img, flip=True)` at every size of `pyramid`, in its
+            order, into the preallocated arrays of `out` when given.
+
+            Each level is remapped from `img` at its own size, with the output
+            maps of the dewarp mesh resampled once when it is built or loaded,
+            so no level goes through a full-size panorama. Levels much smaller
+            than the panorama sample `img` like a resize with `INTER_LINEAR`
+            rather than `INTER_AREA`.
+        """
+        warning_msg = "Dewarp mesh have not been created! Please run `build_dewarp_mesh` first."
+        assert self.__dewarp_map_x is not None, warning_msg
+        out = out or [None] * len(self.__pyramid_remaps)
+        assert len(out) == len(self.__pyramid_remaps), '`out` must hold one array per level.'
+        return [self.__remap(img, *remap, out=level) for remap, level in zip(self.__pyramid_remaps, out)]
+
+    def decode_scale(self):
+        """ Returns how many times smaller the fisheye frames can be decoded,
+            1, 2, 4 or 8, with the panorama still at least as large as the
+            output of `dewarp(..., flip=True)`, or 1 before the frame size is known.
+        """
+        if (self.geometry is None or self.geometry.frame_size is None) and self.img is None:
+            return 1
+        _, img_details = self.__fisheye_geometry()
+        w_d, h_d = img_details[:2]
+        return decode_scale((w_d, h_d), self.output_spec.resized_size(w_d, h_d))
+
+    def dewarp_file(self, path, out=None):
+        """ `dewarp(img, flip=True)` of an image file. JPEG files are decoded
+            `decode_scale()` times smaller and remapped with the output maps
+            scaled to them, close to decoding them whole at a fraction of the cost.
+        """
+        warning_msg = "Dewarp mesh have not been created! Please run `build_dewarp_mesh` first."
+        assert self.__dewarp_map_x is not None, warning_msg
+        scale = self.decode_scale() if is_jpeg(path) else 1
+        with timed(self.timings, 'decode'):
+            img = read_image(path, scale)
+        if img is None:
+            raise IOError(f'Cannot read image `{path}`.')
+        if scale == 1:
+            return self.dewarp(img, flip=True, out=out)
+        warning_msg = f'`{path}` is not a frame of {self.geometry.frame_size}.'
+        assert img.shape[:2] == decoded_size(self.geometry.img_shape, scale), warning_msg
+        return self.__remap(img, *self.__reduced_output_remap(scale), out=out)
+
+    def __reduced_output_remap(self, scale):
+        """ Returns the `cv2.remap` arguments of `dewarp(..., flip=True)` for
+            frames decoded `scale` times smaller.
+        """
+        if scale not in self.__reduced_remaps:
+            def reduced_maps():
+                if self.map_type == 'float':
+                    maps = self.__dewarp_output_remap[:2]
+                else:
+                    maps = output_maps(self.__dewarp_map_x, self.__dewarp_map_y, self.output_spec)
+                return scaled_maps(*maps, 1 / scale)
+            shared_key = self.__dewarp_key
+            self.__reduced_remaps[scale] = self.__derived_remap(
+                shared_key and f'{shared_key}-output-{self.output_spec.key()}-decoded-{scale}',
+                reduced_maps
+            )
+        return self.__reduced_remaps[scale]
+
+    def dewarp_batch(self, frames, flip=False, out=None):
+        """ Dewarps a stack of frames `(n, h, w[, c])` into `out`, a stack of
+            panoramas. With `out` given, no frame allocates memory.
+        """
+        return self.__batch(lambda frame, result: self.dewarp(frame, flip=flip, out=result), frames, out)
 
-    def __wrap(self, img, rotate_angle, scale=1/3):
+    def __wrap(self, img, rotate_angle, scale=1/3, out=None):
         h, w = img.shape[:2]
         # get the center
         center = (w / 2, h / 2)
-        r_matrix = cv2.getRotationMatrix2D(center, rotate_angle, 1)
-        img = cv2.warpAffine(img, r_matrix, (w, h))
-        img = cv2.resize(
-            img,
-            dsize=(int(w * scale), int(h * scale)),
-            interpolation=cv2.INTER_AREA
-        )
+        with timed(self.timings, 'rotate_resize'):
+            r_matrix = cv2.getRotationMatrix2D(center, rotate_angle, 1)
+            rotated = self.__buffer('rotated', img.shape, img.dtype)
+            if self.engine is None:
+                img = cv2.warpAffine(img, r_matrix, (w, h), dst=rotated)
+            else:
+                img = self.engine.warp_affine(img, r_matrix, (w, h), out=rotated)
+            size = (int(w * scale), int(h * scale))
+            if out is not None:
+                out = output_array(out, size[::-1] + img.shape[2:], img.dtype)
+            img = cv2.resize(
+                img,
+                dsize=size,
+                dst=out,
+                interpolation=cv2.INTER_AREA
+            )
         return img
 
     def __build_rewarp_map(self):
-        width, height, _  = self.img.shape
-        xmap = np.zeros((width, height), dtype=np.float32)
-        ymap = np.zeros((width, height), dtype=np.float32)
-        mask = np.zeros((width, height), dtype=np.uint8)
-        center = np.asarray([int(width/2), int(height/2)])
-        top_point = np.asarray([int(width/2), 0])
-        radius = width/2
+        img_shape, img_details = self.__fisheye_geometry()
+        rows, cols = img_shape
+        panorama_width, _, r1, r2, _, _ = img_details
+        xmap = np.zeros((rows, cols), dtype=np.float32)
+        ymap = np.zeros((rows, cols), dtype=np.float32)
+        mask = np.zeros((rows, cols), dtype=np.uint8)
+        center = np.asarray(rewarp_center(img_shape, img_details))
+        top_point = np.asarray([center[0], 0])
         results = list()
-        for y, channel in enumerate(tqdm(self.img, desc='Run rewarp job...')):
-            for x, _ in enumerate(channel):
-                points = ((x, y), center, top_point, radius)
+        for y in self.__progress(range(rows), desc='Run rewarp job...'):
+            for x in range(cols):
+                points = ((x, y), center, top_point, r2)
                 results.append(angle_map(points))
 
-        dewarp_result = self.dewarp(self.img, flip=False)
         for result in results:
             (x, y), length_percentage, distance = result
-            if length_percentage is not None:
+            if length_percentage is not None and distance >= r1:
                 point = (y, x)
-                length = length_percentage * dewarp_result.shape[1]
-                xmap.itemset(point, length)
-                ymap.itemset(point, distance)
-                mask.itemset(point, 255)
+                length = length_percentage * panorama_width
+                xmap[point] = length
+                ymap[point] = distance - r1
+                mask[point] = 255
         
         return xmap, ymap, mask
 
     def __build_rewarp_map_with_mp(self):
-        width, height, _  = self.img.shape
-        xmap = np.zeros((width, height), dtype=np.float32)
-        ymap = np.zeros((width, height), dtype=np.float32)
-        mask = np.zeros((width, height), dtype=np.uint8)
-        center = np.asarray([int(width/2), int(height/2)])
-        top_point = np.asarray([int(width/2), 0])
-        radius = width / 2
+        img_shape, img_details = self.__fisheye_geometry()
+        rows, cols = img_shape
+        panorama_width, _, r1, r2, _, _ = img_details
+        xmap = np.zeros((rows, cols), dtype=np.float32)
+        ymap = np.zeros((rows, cols), dtype=np.float32)
+        mask = np.zeros((rows, cols), dtype=np.uint8)
+        center = np.asarray(rewarp_center(img_shape, img_details))
+        top_point = np.asarray([center[0], 0])
         jobs = list()
-        for y, channel in enumerate(tqdm(self.img, desc='Getting (x, y) for circle...')):
-            for x, _ in enumerate(channel):
-                points = ((x, y), center, top_point, radius)
+        for y in self.__progress(range(rows), desc='Getting (x, y) for circle...'):
+            for x in range(cols):
+                points = ((x, y), center, top_point, r2)
                 jobs.append(points)
-        s = time.time()
-        print('-------Start multi pixel mapping for rewarpping-------')
-        with mp.Pool() as p:
+        s = time.perf_counter()
+        self.__log('-------Start multi pixel mapping for rewarpping-------')
+        with mp.Pool(self.engine and self.engine.workers) as p:
             results = p.map(angle_map, jobs)
-        print('--------Mapping Completed-------- ({:0.3f} s)'.format(time.time()-s))
-        dewarp_result = self.dewarp(self.img, flip=False)
-        for result in tqdm(results, desc='Mapping values to circle...'):
+        self.__log('--------Mapping Completed-------- ({:0.3f} s)'.format(time.perf_counter()-s))
+        for result in self.__progress(results, desc='Mapping values to circle...'):
             (x, y), length_percentage, distance = result
-            if length_percentage is not None:
+            if length_percentage is not None and distance >= r1:
                 point = (y, x)
-                length = length_percentage * dewarp_result.shape[1]
-                xmap.itemset(point, length)
-                ymap.itemset(point, distance)
-                mask.itemset(point, 255)
+                length = length_percentage * panorama_width
+                xmap[point] = length
+                ymap[point] = distance - r1
+                mask[point] = 255
+
+        return xmap, ymap, mask
 
+    def __build_rewarp_map_vectorized(self):
+        img_shape, img_details = self.__fisheye_geometry()
+        rows, cols = img_shape
+        xmap = np.zeros((rows, cols), dtype=np.float32)
+        ymap = np.zeros((rows, cols), dtype=np.float32)
+        mask = np.zeros((rows, cols), dtype=np.uint8)
+        # pixels outside the bounding box of the circle stay at zero
+        center_x, center_y = rewarp_center(img_shape, img_details)
+        r2 = img_details[3]
+        row_lo, row_hi = max(0, center_y - r2), min(rows, center_y + r2 + 1)
+        col_lo, col_hi = max(0, center_x - r2), min(cols, center_x + r2 + 1)
+        for row_start in range(row_lo, row_hi, MESH_BLOCK_ROWS):
+            row_stop = min(row_start + MESH_BLOCK_ROWS, row_hi)
+            block = (slice(row_start, row_stop), slice(col_lo, col_hi))
+            xmap[block], ymap[block], mask[block] = rewarp_map_block(
+                img_shape, img_details, row_start, row_stop, col_lo, col_hi
+            )
         return xmap, ymap, mask
 
     # =================================================================
 
-    def __remap(self, img, x, y):
-        return cv2.remap(img, x, y, cv2.INTER_LINEAR)
+    def __remap(self, img, x, y, interpolation=cv2.INTER_LINEAR, out=None):
+        if out is not None:
+            # `cv2.remap` silently allocates a new array when `dst` does not fit
+            out = output_array(out, x.shape[:2] + img.shape[2:], img.dtype)
+        with timed(self.timings, 'remap'):
+            return self.__engine_remap(img, x, y, interpolation, out=out)
+
+    def __engine_remap(self, img, map1, map2, interpolation, out=None, **kwargs):
+        if self.engine is None:
+            return cv2.remap(img, map1, map2, interpolation, dst=out, **kwargs)
+        return self.engine.remap(img, map1, map2, interpolation, out=out, **kwargs)
+
+    def __buffer(self, name, shape, dtype):
+        """ Returns this thread's scratch array `name` of `shape`, allocated on first use. """
+        if not hasattr(self.__scratch, 'buffers'):
+            self.__scratch.buffers = dict()
+        key = (name, shape, np.dtype(dtype))
+        if key not in self.__scratch.buffers:
+            self.__scratch.buffers[key] = np.empty(shape, dtype=dtype)
+        return self.__scratch.buffers[key]
+
+    def __batch(self, warp, frames, out=None):
+        """ Runs `warp(frame, result)` on every frame, writing `out[i]`. """
+        if out is None:
+            first = warp(frames[0], None)
+            out = np.empty((len(frames),) + first.shape, dtype=first.dtype)
+            out[0] = first
+            start = 1
+        else:
+            assert len(out) == len(frames), '`out` must hold one result per frame.'
+            start = 0
+        for i in range(start, len(frames)):
+            warp(frames[i], out[i])
+        return out
+
+    def __fused_rewarp_remap(self, panorama_width):
+        if panorama_width not in self.__fused_rewarp_remaps:
+            self.__fused_rewarp_remaps[panorama_width] = self.__derived_remap(
+                self.__rewarp_key and f'{self.__rewarp_key}-fused-{panorama_width}',
+                lambda: fused_rewarp_maps(
+                    self.__rewarp_map_x,
+                    self.__rewarp_map_y,
+                    self.__rewarp_mask,
+                    panorama_width,
+                    split=self.__rewarp_split()
+                )
+            )
+        return self.__fused_rewarp_remaps[panorama_width]
+
+    def __panorama_input_maps(self, input_size):
+        fused_x, fused_y = fused_rewarp_maps(
+            self.__rewarp_map_x,
+            self.__rewarp_map_y,
+            self.__rewarp_mask,
+            self.__panorama_shape[0],
+            split=self.__rewarp_split()
+        )
+        return panorama_input_maps(fused_x, fused_y, self.__panorama_shape, input_size)
+
+    def __panorama_input_remap(self, input_size):
+        if input_size not in self.__panorama_input_remaps:
+            self.__panorama_input_remaps[input_size] = self.__derived_remap(
+                self.__rewarp_key and f'{self.__rewarp_key}-input-{self.__panorama_shape}-{input_size}',
+                lambda: self.__panorama_input_maps(input_size)
+            )
+        return self.__panorama_input_remaps[input_size]
+
+    def __chroma_remap(self, shared_key, luma_remap, build):
+        """ Returns the remap of the chroma planes for `luma_remap`, derived
+            from its float maps, which `build()` returns for fixed-point remaps.
+        """
+        if shared_key not in self.__chroma_remaps:
+            def float_maps():
+                return luma_remap[:2] if self.map_type == 'float' else build()
+            self.__chroma_remaps[shared_key] = self.__derived_remap(
+                shared_key and f'{shared_key}-chroma',
+                lambda: chroma_maps(*float_maps())
+            )
+        return self.__chroma_remaps[shared_key]
 
-    def half_rewarp_map(self, panorama_img, x, y):
+    def __remap_yuv(self, frame, layout, luma_remap, chroma_remap, out=None):
+        map1, map2, interpolation = luma_remap
+        chroma_map1, chroma_map2, chroma_interpolation = chroma_remap
+        h, w = chroma_map1.shape[0] * 2, chroma_map1.shape[1] * 2
+        out = output_array(out, yuv_frame_shape(w, h), frame.dtype)
+        src_y, src_chroma = yuv_planes(frame, layout)
+        dst_y, dst_chroma = yuv_planes(out, layout)
+        with timed(self.timings, 'remap'):
+            self.__engine_remap(src_y, map1[:h, :w], map2[:h, :w] if map2 is not None else None, interpolation, out=dst_y)
+            for src, dst in zip(src_chroma, dst_chroma):
+                self.__engine_remap(src, chroma_map1, chroma_map2, chroma_interpolation, out=dst, borderValue=(NEUTRAL_CHROMA,) * 4)
+        return out
+
+    def dewarp_yuv(self, frame, layout='nv12', flip=False, out=None):
+        """ Dewarps a planar YUV 4:2:0 frame, `nv12` or `i420`, into a panorama
+            of the same layout, into the preallocated `out` when given.
+
+            The Y plane takes the dewarp maps and the chroma planes maps of half
+            the resolution derived from them, so frames never change color
+            space. A panorama of odd width or height loses its last column or row.
+        """
+        warning_msg = "Dewarp mesh have not been created! Please run `build_dewarp_mesh` first."
+        assert self.__dewarp_map_x is not None, warning_msg
+        if flip:
+            luma_remap = self.__dewarp_output_remap
+            chroma_remap = self.__chroma_remap(
+                self.__dewarp_key and f'{self.__dewarp_key}-output-{self.output_spec.key()}',
+                luma_remap,
+                lambda: output_maps(self.__dewarp_map_x, self.__dewarp_map_y, self.output_spec)
+            )
+        else:
+            luma_remap = self.__dewarp_remap
+            chroma_remap = self.__chroma_remap(
+                self.__dewarp_key,
+                luma_remap,
+                lambda: (self.__dewarp_map_x, self.__dewarp_map_y)
+            )
+        return self.__remap_yuv(frame, layout, luma_remap, chroma_remap, out)
+
+    def rewarp_with_mesh_yuv(self, panorama_frame, layout='nv12', out=None):
+        """ `rewarp_with_mesh` of a planar YUV 4:2:0 panorama of any size, the
+            planes remapped like `dewarp_yuv`.
+        """
+        warning_msg = "Rewarp needs the shape of panorama generated from `run_dewarp`. Please run it first."
+        assert self.__panorama_shape is not None, warning_msg
+        input_size = yuv_frame_size(panorama_frame)
+        luma_remap = self.__panorama_input_remap(input_size)
+        chroma_remap = self.__chroma_remap(
+            self.__rewarp_key and f'{self.__rewarp_key}-input-{self.__panorama_shape}-{input_size}',
+            luma_remap,
+            lambda: self.__panorama_input_maps(input_size)
+        )
+        return self.__remap_yuv(panorama_frame, layout, luma_remap, chroma_remap, out)
+
+    def half_rewarp_map(self, panorama_img, x, y, interpolation=cv2.INTER_LINEAR, out=None):
+        """ Remaps the left part into `out` and the right part into a scratch
+            array that the next call of this thread overwrites.
+        """
         # get left part
-        left_output = self.__remap(panorama_img, x, y)
+        left_output = self.__remap(panorama_img, x, y, interpolation, out=out)
         # get right part
-        right_output = self.__remap(cv2.flip(panorama_img, 1), x, y)
+        flipped = cv2.flip(panorama_img, 1, dst=self.__buffer('flipped', panorama_img.shape, panorama_img.dtype))
+        right_output = self.__remap(flipped, x, y, interpolation, out=self.__buffer('right', left_output.shape, left_output.dtype))
         return left_output, right_output
 
-    def rewarp(self, panorama_img, flip=False):
+    def rewarp(self, panorama_img, flip=False, out=None):
+        """ Rewarps `panorama_img`, into the preallocated `out` when given. """
         warning_msg = "Rewarp mesh have not been created! Please run `build_rewarp_mesh` first."
         assert self.__rewarp_map_x is not None, warning_msg
         assert self.__rewarp_map_y is not None, warning_msg
         assert self.__rewarp_mask is not None, warning_msg
-        left_output, right_output = self.half_rewarp_map(
-            panorama_img,
-            self.__rewarp_map_x,
-            self.__rewarp_map_y
-        )
 
-        re_render_canvas = left_output
-        # find the center of the image
-        vertical_center = int(re_render_canvas.shape[0] / 2) + 1
-        # combine 2 parts
-        re_render_canvas[:, vertical_center:, :] = right_output[:, vertical_center:, :]
+        if flip and self.fuse_rewarp:
+            return self.__remap(panorama_img, *self.__fused_rewarp_remap(panorama_img.shape[1]), out=out)
 
-        re_render_canvas = cv2.add(
-            re_render_canvas,
-            np.zeros(re_render_canvas.shape, dtype=np.uint8),
-            mask=self.__rewarp_mask
-        )
+        map1, map2, interpolation = self.__rewarp_remap
+        # with `flip` the canvas is rotated into `out` at the end
+        canvas = self.__buffer('canvas', map1.shape[:2] + panorama_img.shape[2:], panorama_img.dtype) if flip else out
+        left_output, right_output = self.half_rewarp_map(panorama_img, map1, map2, interpolation, out=canvas)
+
+        with timed(self.timings, 'splice'):
+            re_render_canvas = left_output
+            # find the center of the circle
+            vertical_center = self.__rewarp_split()
+            if vertical_center is None:
+                vertical_center = int(re_render_canvas.shape[0] / 2) + 1
+            # combine 2 parts
+            re_render_canvas[:, vertical_center:] = right_output[:, vertical_center:]
+
+            # clear the pixels outside the circle, in place
+            outside = cv2.compare(
+                self.__rewarp_mask,
+                0,
+                cv2.CMP_EQ,
+                dst=self.__buffer('outside', self.__rewarp_mask.shape, np.uint8)
+            )
+            cv2.subtract(re_render_canvas, re_render_canvas, dst=re_render_canvas, mask=outside)
 
         if flip:
-            re_render_canvas = self.__wrap(re_render_canvas, 180, scale=1)
+            re_render_canvas = self.__wrap(re_render_canvas, 180, scale=1, out=out)
 
         return re_render_canvas
 
+    def rewarp_batch(self, frames, flip=False, out=None):
+        """ Rewarps a stack of panoramas `(n, h, w[, c])` into `out`, a stack
+            of fisheye frames. With `out` given, no frame allocates memory.
+        """
+        return self.__batch(lambda frame, result: self.rewarp(frame, flip=flip, out=result), frames, out)
+
     # =================================================================
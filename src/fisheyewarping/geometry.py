@@ -0,0 +1,290 @@
+"""
+Camera And Output Geometry
+"""
+import cv2
+import numpy as np
+
+# Map coordinate that `cv2.remap` renders as the (black) border value.
+OUT_OF_FRAME = -16.0
+
+# Coordinates this close to an integer are snapped to it, so that rotations by
+# multiples of 90 degrees sample the maps exactly.
+_SNAP = 1e-6
+
+class CameraGeometry:
+    """ Where the fisheye circle lies in the frames of a camera, all that the
+        meshes depend on, so they can be built without any pixels.
+
+        `frame_size` `(w, h)` is the size of the fisheye frames, taken from the
+        first image when `None`. The circle has its `center` `(x, y)`, the frame
+        center by default, and `outer_radius`, half the frame width by default.
+        It may be off-center or cropped by the frame edges. Pixels closer to the
+        center than `inner_radius` are left out of the panorama.
+        `output_size` `(w, h)` resizes the panorama like `OutputSpec(size=...)`.
+    """
+
+    def __init__(self, frame_size=None, center=None, inner_radius=0, outer_radius=None, output_size=None):
+        self.frame_size = tuple(int(v) for v in frame_size) if frame_size is not None else None
+        self.center = tuple(int(v) for v in center) if center is not None else None
+        self.inner_radius = int(inner_radius)
+        self.outer_radius = int(outer_radius) if outer_radius is not None else None
+        self.output_size = tuple(int(v) for v in output_size) if output_size is not None else None
+
+    @classmethod
+    def from_details(cls, img_shape, img_details):
+        """ Returns the geometry of `img_details`, as recorded in mesh files. """
+        _, _, r1, r2, c_x, c_y = img_details
+        return cls((img_shape[1], img_shape[0]), center=(c_x, c_y), inner_radius=r1, outer_radius=r2)
+
+    def __repr__(self):
+        return (
+            f'CameraGeometry(frame_size={self.frame_size}, center={self.center}, inner_radius={self.inner_radius}, '
+            f'outer_radius={self.outer_radius}, output_size={self.output_size})'
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, CameraGeometry) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return (self.frame_size, self.center, self.inner_radius, self.outer_radius, self.output_size)
+
+    def is_center_shift_of(self, other):
+        """ Whether this geometry only moves the circle center of `other`, so
+            its maps are the maps of `other` moved instead of rebuilt.
+        """
+        if self.frame_size is None or self.frame_size != other.frame_size:
+            return False
+        return self.details()[:4] == other.details()[:4]
+
+    def scaled(self, factor):
+        """ Returns this geometry for frames resized by `factor`. """
+        def scale(values):
+            return tuple(max(1, int(v * factor)) for v in values) if values is not None else None
+        inner_radius = int(self.inner_radius * factor)
+        outer_radius = max(inner_radius + 1, int(self.outer_radius * factor)) if self.outer_radius is not None else None
+        center = tuple(int(v * factor) for v in self.center) if self.center is not None else None
+        return CameraGeometry(scale(self.frame_size), center, inner_radius, outer_radius, scale(self.output_size))
+
+    def for_shape(self, shape):
+        """ Returns this geometry with the frame size of an image of `shape`. """
+        if self.frame_size is not None:
+            return self
+        return CameraGeometry((shape[1], shape[0]), self.center, self.inner_radius, self.outer_radius, self.output_size)
+
+    @property
+    def img_shape(self):
+        """ `(h, w)` of the frames. """
+        assert self.frame_size is not None, '`frame_size` of the geometry is not known yet.'
+        return self.frame_size[1], self.frame_size[0]
+
+    def details(self):
+        """ Returns `(w_d, h_d, r1, r2, c_x, c_y)`, the panorama size, the inner
+            and outer radius and the center the mesh builders use.
+        """
+        w, h = self.frame_size
+        c_x, c_y = self.center if self.center is not None else (int(w / 2), int(h / 2))
+        r1 = self.inner_radius
+        r2 = self.outer_radius if self.outer_radius is not None else w - int(w / 2)
+        assert 0 <= r1 < r2, '`inner_radius` must be smaller than `outer_radius`.'
+        # the panorama is as wide as the circle halfway between the radii
+        w_d = int(2.0 * ((r2 + r1) / 2) * np.pi)
+        h_d = r2 - r1
+        return w_d, h_d, r1, r2, c_x, c_y
+
+class OutputSpec:
+    """ Fixed output transform of the dewarped panorama.
+
+        Applied in the order of `FisheyeWarping.__wrap`: rotate by `rotate`
+        degrees about the center on a canvas of the same size, resize to `size`
+        `(w, h)` or by `scale`, then keep the `crop` window `(x, y, w, h)`.
+    """
+
+    def __init__(self, rotate=0, size=None, scale=1, crop=None):
+        self.rotate = rotate
+        self.size = tuple(size) if size is not None else None
+        self.scale = scale
+        self.crop = tuple(crop) if crop is not None else None
+
+    def __repr__(self):
+        return f'OutputSpec(rotate={self.rotate}, size={self.size}, scale={self.scale}, crop={self.crop})'
+
+    def __eq__(self, other):
+        return isinstance(other, OutputSpec) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return (self.rotate, self.size, self.scale, self.crop)
+
+    def with_size(self, size):
+        """ Returns this spec resizing to `size` `(w, h)`, or itself for `None`. """
+        if size is None:
+            return self
+        return OutputSpec(self.rotate, size, self.scale, self.crop)
+
+    def for_output_size(self, size, w, h):
+        """ Returns this spec with an output of `size` `(w, h)` showing the same
+            part of a `w` x `h` panorama, the crop window resized with it.
+        """
+        if self.crop is None:
+            return OutputSpec(self.rotate, size)
+        out_w, out_h = self.output_size(w, h)
+        resized_w, resized_h = self.resized_size(w, h)
+        f_x, f_y = size[0] / out_w, size[1] / out_h
+        crop = (round(self.crop[0] * f_x), round(self.crop[1] * f_y), size[0], size[1])
+        return OutputSpec(self.rotate, (round(resized_w * f_x), round(resized_h * f_y)), crop=crop)
+
+    def resized_size(self, w, h):
+        if self.size is not None:
+            return self.size
+        return int(w * self.scale), int(h * self.scale)
+
+    def output_size(self, w, h):
+        if self.crop is not None:
+            return self.crop[2], self.crop[3]
+        return self.resized_size(w, h)
+
+    def scaled(self, factor):
+        """ Returns this spec for a panorama resized by `factor`. """
+        def scale(values):
+            return tuple(max(1, int(v * factor)) for v in values) if values is not None else None
+        return OutputSpec(self.rotate, scale(self.size), self.scale, scale(self.crop))
+
+    def source_coordinates(self, w, h, window=None):
+        """ Returns where each output pixel comes from in a `w` x `h` panorama.
+
+            `window` `(x, y, w, h)` limits the result to part of the output.
+        """
+        x, y = self.__axes(w, h, window)
+        x, y = np.meshgrid(x, y)
+        matrix = self.__inverse_rotation(w, h)
+        src_x = matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]
+        src_y = matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]
+        return _snap(src_x), _snap(src_y)
+
+    def pixel_sources(self, w, h):
+        """ Returns `(rows, cols, transposed)` when every output pixel comes
+            from a whole pixel of a `w` x `h` panorama, else `None`.
+
+            That holds for rotations by multiples of 90 degrees without a
+            fractional resize. Output pixel `(x, y)` then comes from panorama
+            pixel `(cols[x], rows[y])`, or `(rows[y], cols[x])` swapped when
+            `transposed`, with out of range indices outside the panorama.
+        """
+        if self.rotate % 90 != 0:
+            return None
+        x, y = self.__axes(w, h)
+        matrix = self.__inverse_rotation(w, h)
+        # the other coefficients are rounding noise of `cos` and `sin`
+        transposed = abs(matrix[0, 0]) < 0.5
+        if transposed:
+            cols = _snap(matrix[1, 0] * x + matrix[1, 2])
+            rows = _snap(matrix[0, 1] * y + matrix[0, 2])
+        else:
+            cols = _snap(matrix[0, 0] * x + matrix[0, 2])
+            rows = _snap(matrix[1, 1] * y + matrix[1, 2])
+        if (cols != np.rint(cols)).any() or (rows != np.rint(rows)).any():
+            return None
+        return rows.astype(np.int64), cols.astype(np.int64), transposed
+
+    def __axes(self, w, h, window=None):
+        resized_w, resized_h = self.resized_size(w, h)
+        crop_x, crop_y, out_w, out_h = self.crop or (0, 0, resized_w, resized_h)
+        if window is not None:
+            crop_x, crop_y = crop_x + window[0], crop_y + window[1]
+            out_w, out_h = window[2], window[3]
+        # resize, the same pixel centers as `cv2.resize`
+        x = (np.arange(crop_x, crop_x + out_w, dtype=np.float64) + 0.5) * (w / resized_w) - 0.5
+        y = (np.arange(crop_y, crop_y + out_h, dtype=np.float64) + 0.5) * (h / resized_h) - 0.5
+        return x, y
+
+    def __inverse_rotation(self, w, h):
+        # the inverse of the matrix `cv2.warpAffine` applies
+        return cv2.invertAffineTransform(cv2.getRotationMatrix2D((w / 2, h / 2), self.rotate, 1))
+
+def _snap(values):
+    rounded = np.rint(values)
+    return np.where(np.abs(values - rounded) < _SNAP, rounded, values)
+
+def sample_maps(map_x, map_y, src_x, src_y, origin=(0, 0), shape=None):
+    """ Samples a pair of maps at fractional coordinates.
+
+        Coordinates outside the maps become `OUT_OF_FRAME`, so the composed maps
+        render the same black border as remapping first and transforming after.
+        `map_x`/`map_y` may also be the block at `origin` `(x, y)` of maps of
+        `shape` `(h, w)`, as long as it holds every coordinate sampled.
+    """
+    h, w = shape or map_x.shape
+    valid = (src_x >= 0) & (src_x <= w - 1) & (src_y >= 0) & (src_y <= h - 1)
+    # shifted after the cast, which is exact, so blocks sample like the whole maps
+    src_x = np.where(valid, src_x, origin[0]).astype(np.float32) - np.float32(origin[0])
+    src_y = np.where(valid, src_y, origin[1]).astype(np.float32) - np.float32(origin[1])
+    sampled_x = cv2.remap(np.ascontiguousarray(map_x, dtype=np.float32), src_x, src_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    sampled_y = cv2.remap(np.ascontiguousarray(map_y, dtype=np.float32), src_x, src_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    sampled_x[~valid] = OUT_OF_FRAME
+    sampled_y[~valid] = OUT_OF_FRAME
+    return sampled_x, sampled_y
+
+def take_maps(map_x, map_y, rows, cols, transposed=False):
+    """ Same as `sample_maps` at the whole pixels of `OutputSpec.pixel_sources`,
+        by indexing instead of interpolating.
+    """
+    if transposed:
+        map_x, map_y = map_x.T, map_y.T
+    h, w = map_x.shape
+    valid_rows = (rows >= 0) & (rows <= h - 1)
+    valid_cols = (cols >= 0) & (cols <= w - 1)
+    index = np.ix_(np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1))
+    sampled = list()
+    for m in (map_x, map_y):
+        taken = np.ascontiguousarray(m[index], dtype=np.float32)
+        taken[~valid_rows] = OUT_OF_FRAME
+        taken[:, ~valid_cols] = OUT_OF_FRAME
+        sampled.append(taken)
+    return tuple(sampled)
+
+def output_maps(map_x, map_y, output_spec):
+    """ Bakes `output_spec` into a pair of dewarp maps. """
+    h, w = map_x.shape
+    sources = output_spec.pixel_sources(w, h)
+    if sources is not None:
+        return take_maps(map_x, map_y, *sources)
+    return sample_maps(map_x, map_y, *output_spec.source_coordinates(w, h))
+
+def scaled_maps(map_x, map_y, factor):
+    """ Returns the maps for a source resized by `factor`, keeping
+        `OUT_OF_FRAME`. Pixel centers stay in place, like `cv2.resize`.
+    """
+    return tuple(
+        np.where(m == OUT_OF_FRAME, m, (m + 0.5) * factor - 0.5).astype(np.float32)
+        for m in (map_x, map_y)
+    )
+
+def panorama_input_maps(map_x, map_y, panorama_shape, input_size):
+    """ Folds the resize and 180 degree rotation of `rewarp_with_mesh` into maps.
+
+        `map_x`/`map_y` sample the resized and rotated panorama of
+        `panorama_shape` `(w, h)`. The returned maps sample the `input_size`
+        `(w, h)` panorama directly. The result is exact when the two sizes
+        match. Otherwise one bilinear sample replaces resize-then-sample,
+        which differs by up to ~150 gray levels along the rim and the seam of
+        the fisheye, and within a gray level on average elsewhere.
+    """
+    w, h = panorama_shape
+    input_w, input_h = input_size
+    outside = map_x == OUT_OF_FRAME
+    # `__wrap` moves pixel (x, y) to (w - x, h - y)
+    src_x = w - map_x.astype(np.float64)
+    src_y = h - map_y.astype(np.float64)
+    if (input_w, input_h) != (w, h):
+        src_x = np.clip((src_x + 0.5) * (input_w / w) - 0.5, 0, input_w - 1)
+        src_y = np.clip((src_y + 0.5) * (input_h / h) - 0.5, 0, input_h - 1)
+    src_x = src_x.astype(np.float32)
+    src_y = src_y.astype(np.float32)
+    src_x[outside] = OUT_OF_FRAME
+    src_y[outside] = OUT_OF_FRAME
+    return src_x, src_y
@@ -0,0 +1,166 @@
+"""
+Incremental Remapping
+"""
+import cv2
+import numpy as np
+
+from .timing import timed
+
+# Default `(w, h)` of the tiles compared in the input and remapped in the output.
+INCREMENTAL_TILE = (64, 64)
+
+# Largest absolute difference of a pixel, in gray levels, still treated as
+# unchanged, above the noise of a still scene.
+CHANGE_THRESHOLD = 8
+
+# Frames between two full remaps, so changes below the threshold never linger.
+REFRESH_INTERVAL = 300
+
+def _tile_starts(n, tile):
+    return np.arange(0, n, tile)
+
+def _source_pixels(map1, map2):
+    """ Returns the integer `(x, y)` of the top left source pixel each output
+        pixel reads, from float maps or the `map1` of fixed-point ones.
+    """
+    if map1.ndim == 3:
+        return map1[..., 0].astype(np.int32), map1[..., 1].astype(np.int32)
+    # out of frame and NaN pixels land far outside and read nothing
+    return tuple(np.nan_to_num(np.floor(m), nan=-2).astype(np.int32) for m in (map1, map2))
+
+def tile_dependencies(map1, map2, src_shape, src_tile=INCREMENTAL_TILE, out_tile=INCREMENTAL_TILE):
+    """ Returns `(out_ids, src_ids)`, the pairs of an output tile and an input
+        tile it reads, the inverse footprint of the maps.
+
+        Tiles are numbered row by row. Each output pixel reads the source
+        pixels `(x, y)` to `(x + 1, y + 1)` of its top left one, which covers
+        bilinear and nearest remapping.
+    """
+    src_h, src_w = src_shape[:2]
+    src_tile_w, src_tile_h = src_tile
+    out_tile_w, out_tile_h = out_tile
+    out_h, out_w = map1.shape[:2]
+    src_cols = -(-src_w // src_tile_w)
+    src_tiles = src_cols * -(-src_h // src_tile_h)
+    out_cols = -(-out_w // out_tile_w)
+    out_col = np.arange(out_w) // out_tile_w
+    pairs = list()
+    for row, y in enumerate(_tile_starts(out_h, out_tile_h)):
+        xs, ys = _source_pixels(map1[y:y + out_tile_h], map2[y:y + out_tile_h] if map2 is not None else None)
+        reads = np.zeros((out_cols, src_tiles), dtype=bool)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                x, y_ = xs + dx, ys + dy
+                valid = (x >= 0) & (x < src_w) & (y_ >= 0) & (y_ < src_h)
+                src_id = (y_[valid] // src_tile_h) * src_cols + x[valid] // src_tile_w
+                reads[np.broadcast_to(out_col, valid.shape)[valid], src_id] = True
+        cols, src_ids = np.nonzero(reads)
+        pairs.append((row * out_cols + cols, src_ids))
+    return tuple(np.concatenate(p).astype(np.int32) for p in zip(*pairs))
+
+class IncrementalRemap:
+    """ Remaps a stream of frames from a still camera into one persistent
+        output, remapping only the output tiles whose input changed.
+
+        Each frame is compared tile by tile with a reference, the input the
+        output was last remapped from. Input tiles with a pixel more than
+        `threshold` gray levels away are changed, and the output tiles that
+        read them, by the inverse footprint of the maps, are remapped. Every
+        `refresh_interval` frames, and for the first one, all of the output is
+        remapped. The pixels are those of a full remap except where input
+        changes of up to twice `threshold` were skipped, and none after a
+        refresh.
+
+            >>> incremental = frd.incremental('dewarp')
+            >>> for frame in frames:
+            ...     panorama = incremental.update(frame)
+    """
+
+    def __init__(self, remap, tile=INCREMENTAL_TILE, threshold=CHANGE_THRESHOLD, refresh_interval=REFRESH_INTERVAL, timings=None):
+        # `(map1, map2, interpolation)` passed to `cv2.remap`
+        self.remap = remap
+        self.tile = tile
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.timings = timings
+        # the persistent output `update` returns
+        self.output = None
+        self.frames = 0
+        self.__reference = None
+        self.__dependencies = None
+        self.__out_windows = None
+
+    def reset(self):
+        """ Remaps all of the output with the next frame. """
+        self.__reference = None
+
+    def update(self, frame):
+        """ Brings `output` up to date with `frame` and returns it. The array
+            is reused by the next call, copy it to keep it.
+        """
+        full = (
+            self.__reference is None
+            or self.__reference.shape != frame.shape
+            or self.__reference.dtype != frame.dtype
+            or (self.refresh_interval and self.frames % self.refresh_interval == 0)
+        )
+        self.frames += 1
+        with timed(self.timings, 'remap'):
+            if full:
+                self.__full_remap(frame)
+                tiles = len(self.__out_windows)
+            else:
+                tiles = self.__incremental_remap(frame)
+        if self.timings is not None:
+            self.timings.count('tiles_remapped', tiles)
+            self.timings.count('tiles_skipped', len(self.__out_windows) - tiles)
+        return self.output
+
+    def __full_remap(self, frame):
+        map1, map2, interpolation = self.remap
+        h, w = map1.shape[:2]
+        shape = (h, w) + frame.shape[2:]
+        if self.output is None or self.output.shape != shape or self.output.dtype != frame.dtype:
+            self.output = np.empty(shape, dtype=frame.dtype)
+        cv2.remap(frame, map1, map2, interpolation, dst=self.output)
+        if self.__reference is None or self.__reference.shape != frame.shape:
+            self.__dependencies = tile_dependencies(map1, map2, frame.shape, self.tile, self.tile)
+            tile_w, tile_h = self.tile
+            self.__out_windows = [(x, y) for y in _tile_starts(h, tile_h) for x in _tile_starts(w, tile_w)]
+        self.__reference = frame.copy()
+
+    def __changed_tiles(self, frame):
+        """ Returns a boolean grid of the input tiles with a pixel above `threshold`. """
+        tile_w, tile_h = self.tile
+        diff = cv2.absdiff(frame, self.__reference)
+        h, w = diff.shape[:2]
+        # channels fold into the columns of each tile
+        channels = diff.size // (h * w)
+        diff = diff.reshape(h, w * channels)
+        # a reshape is much faster than `reduceat` along the rows
+        full_rows = h // tile_h * tile_h
+        tiles = diff[:full_rows].reshape(h // tile_h, tile_h, w * channels).max(axis=1)
+        if full_rows < h:
+            tiles = np.vstack([tiles, diff[full_rows:].max(axis=0)])
+        tiles = np.maximum.reduceat(tiles, _tile_starts(w, tile_w) * channels, axis=1)
+        return tiles > self.threshold
+
+    def __incremental_remap(self, frame):
+        map1, map2, interpolation = self.remap
+        tile_w, tile_h = self.tile
+        changed = self.__changed_tiles(frame)
+        if not changed.any():
+            return 0
+        out_ids, src_ids = self.__dependencies
+        dirty = np.zeros(len(self.__out_windows), dtype=bool)
+        dirty[out_ids[changed.reshape(-1)[src_ids]]] = True
+        for i in np.flatnonzero(dirty):
+            x, y = self.__out_windows[i]
+            window = (slice(y, y + tile_h), slice(x, x + tile_w))
+            cv2.remap(frame, map1[window], map2[window] if map2 is not None else None, interpolation, dst=self.output[window])
+        # only changed tiles move the reference, so slow drifts still add up to a change
+        rows, cols = np.nonzero(changed)
+        for row, col in zip(rows, cols):
+            window = (slice(row * tile_h, (row + 1) * tile_h), slice(col * tile_w, (col + 1) * tile_w))
+            self.__reference[window] = frame[window]
+        return int(dirty.sum())
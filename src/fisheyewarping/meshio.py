@@ -0,0 +1,274 @@
+"""
+Mesh File Format
+
+A mesh file is a small header followed by the raw map arrays, so the maps can
+be opened with `np.memmap` without copying and their pages are shared by every
+process that opens the same file.
+
+    offset  size  content
+    0       8     magic `b'FWMESH\\x00\\x00'`
+    8       4     little-endian uint32 `n`, length of the JSON header
+    12      n     UTF-8 JSON header
+    ...           zero padding up to the next multiple of 64
+    data          the arrays, C-ordered, each starting at a multiple of 64
+
+The JSON header holds
+
+    {
+        "version": 1,
+        "kind": "dewarp" | "rewarp",
+        "img_shape": [height, width] | null,
+        "geometry": [w_d, h_d, r1, r2, c_x, c_y] | null,
+        "panorama_shape": [width, height] | null,
+        "arrays": [{"name": "map_x", "dtype": "<f4", "shape": [h, w], "offset": 0}, ...]
+    }
+
+where each `offset` is relative to the start of the data section.
+
+Compact files, version 2, add
+
+        "compact": {"downsample": f, "max_error": e, "arrays": [{"name": "map_x", "dtype": "<f4", "shape": [h, w], "rounded": true}, ...]}
+
+and store each map as its `name` sampled every `f` pixels, with the `cells`
+of the sampling grid interpolation misses by more than `e` as `(row, col)`
+pairs and their pixels in `{name}_cells`. `load_mesh` expands them with
+`expand_arrays`.
+"""
+import json
+import os
+import pickle
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'FWMESH\x00\x00'
+FORMAT_VERSION = 2
+# files without `compact` keep version 1, so older readers still open them
+PLAIN_VERSION = 1
+# in pixels, the default bound of compact meshes, the step of the truncated dewarp maps
+COMPACT_MAX_ERROR = 1.0
+ALIGNMENT = 64
+
+MESH_ARRAY_NAMES = {
+    'dewarp': ('map_x', 'map_y'),
+    'rewarp': ('map_x', 'map_y', 'mask'),
+}
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def _grid_size(n, downsample):
+    return -(-(n - 1) // downsample) + 1
+
+def _upsample(grid, downsample, shape):
+    """ Bilinear interpolation of the grid samples, every `downsample` pixels,
+        back to `shape`, in float32 at both save and load.
+    """
+    def weights(n, size):
+        k = np.arange(n)
+        start = k // downsample
+        return start, np.minimum(start + 1, size - 1), ((k % downsample) / downsample).astype(np.float32)
+
+    grid = grid.astype(np.float32)
+    top, bottom, t = weights(shape[0], grid.shape[0])
+    t = t[:, np.newaxis]
+    rows = grid[top] * (1 - t) + grid[bottom] * t
+    left, right, t = weights(shape[1], grid.shape[1])
+    return rows[:, left] * (1 - t) + rows[:, right] * t
+
+def _cells(array, downsample, grid_shape):
+    """ Returns a view of `array` as `(rows, cols, downsample, downsample)` cells. """
+    gh, gw = grid_shape
+    return array[:(gh - 1) * downsample, :(gw - 1) * downsample].reshape(gh - 1, downsample, gw - 1, downsample).swapaxes(1, 2)
+
+def compact_arrays(arrays, downsample, max_error=COMPACT_MAX_ERROR):
+    """ Returns `(grids, description)`, the 2D `arrays` sampled every
+        `downsample` pixels and the `compact` entry of the header.
+
+        Cells of the sampling grid where bilinear interpolation misses a value
+        by more than `max_error`, like the edges of the fisheye circle, keep
+        all their pixels. Integer-valued arrays, like the dewarp maps, are
+        rounded after interpolation.
+    """
+    shape = next(iter(arrays.values())).shape
+    grid_shape = tuple(_grid_size(n, downsample) for n in shape)
+    padded_shape = tuple((n - 1) * downsample + 1 for n in grid_shape)
+    padded, entries = dict(), list()
+    exact = np.zeros((grid_shape[0] - 1, grid_shape[1] - 1), dtype=bool)
+    for name, array in arrays.items():
+        assert array.shape == shape, 'Compact meshes need arrays of the same shape.'
+        array = np.pad(np.asarray(array), [(0, p - n) for p, n in zip(padded_shape, shape)], mode='edge')
+        rounded = bool(np.array_equal(array, np.trunc(array)))
+        restored = _upsample(array[::downsample, ::downsample], downsample, padded_shape)
+        if rounded:
+            restored = np.round(restored)
+        with np.errstate(invalid='ignore'):
+            error = np.abs(restored - array.astype(np.float32))
+        # NaN, like the rewarp maps at the circle center, is never within the bound
+        exact |= ~(_cells(error, downsample, grid_shape) <= max_error).all(axis=(2, 3))
+        padded[name] = array
+        entries.append(dict(name=name, dtype=np.asarray(arrays[name]).dtype.str, shape=list(shape), rounded=rounded))
+
+    cells = np.argwhere(exact).astype(np.int32)
+    grids = dict(cells=cells)
+    for name, array in padded.items():
+        grids[name] = array[::downsample, ::downsample]
+        grids[f'{name}_cells'] = _cells(array, downsample, grid_shape)[cells[:, 0], cells[:, 1]]
+    return grids, dict(downsample=downsample, max_error=max_error, arrays=entries)
+
+def expand_arrays(grids, description):
+    """ Returns the full arrays of `compact_arrays`, within `max_error` of the originals. """
+    downsample = description['downsample']
+    cells = grids['cells']
+    arrays = dict()
+    for entry in description['arrays']:
+        name, shape = entry['name'], entry['shape']
+        grid = grids[name]
+        padded_shape = tuple((n - 1) * downsample + 1 for n in grid.shape)
+        array = _upsample(grid, downsample, padded_shape)
+        if entry['rounded']:
+            array = np.round(array, out=array)
+        array = array.astype(entry['dtype'])
+        _cells(array, downsample, grid.shape)[cells[:, 0], cells[:, 1]] = grids[f'{name}_cells']
+        arrays[name] = np.ascontiguousarray(array[:shape[0], :shape[1]])
+    return arrays
+
+class MeshFile:
+
+    def __init__(self, kind, arrays, panorama_shape=None, img_shape=None, geometry=None, version=FORMAT_VERSION, compact=None):
+        self.kind = kind
+        self.arrays = arrays
+        self.panorama_shape = tuple(panorama_shape) if panorama_shape is not None else None
+        self.img_shape = tuple(img_shape) if img_shape is not None else None
+        self.geometry = tuple(geometry) if geometry is not None else None
+        self.version = version
+        # the `compact` entry of the header, `None` for files of full maps
+        self.compact = compact
+
+    @property
+    def max_error(self):
+        """ Bound of the difference between the arrays and the maps that were saved, in pixels. """
+        return self.compact['max_error'] if self.compact else 0.0
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def maps(self):
+        """ Returns the arrays in the order `FisheyeWarping` stores them. """
+        return tuple(self.arrays[name] for name in MESH_ARRAY_NAMES[self.kind])
+
+def is_mesh_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def save_mesh(path, kind, arrays, panorama_shape=None, img_shape=None, geometry=None, downsample=1, max_error=COMPACT_MAX_ERROR):
+    """ Writes `arrays`, a dict of name to array, as a mesh file at `path`.
+
+        A `downsample` above 1 writes a compact file, see `compact_arrays`.
+    """
+    compact = None
+    if downsample > 1:
+        arrays, compact = compact_arrays(arrays, downsample, max_error)
+    entries = list()
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entries.append(dict(name=name, dtype=array.dtype.str, shape=list(array.shape), offset=offset))
+        offset = _align(offset + array.nbytes)
+    header = dict(
+        version=PLAIN_VERSION if compact is None else FORMAT_VERSION,
+        kind=kind,
+        img_shape=[int(v) for v in img_shape[:2]] if img_shape is not None else None,
+        geometry=[int(v) for v in geometry] if geometry is not None else None,
+        panorama_shape=[int(v) for v in panorama_shape] if panorama_shape is not None else None,
+        arrays=entries,
+    )
+    if compact is not None:
+        header['compact'] = compact
+    header = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 4 + len(header))
+
+    path = Path(path)
+    # write to a temporary file first so readers never see a partial mesh
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for entry, array in zip(entries, arrays.values()):
+                f.write(b'\x00' * (data_start + entry['offset'] - f.tell()))
+                f.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def load_mesh(path, mmap=True):
+    """ Opens a mesh file. With `mmap` the arrays are read-only views of the
+        file, except those of compact files, which are expanded in memory.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'`{path}` is not a mesh file.')
+        header_size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    if header['version'] > FORMAT_VERSION:
+        raise ValueError(f'Mesh format version {header["version"]} of `{path}` is not supported.')
+    data_start = _align(len(MAGIC) + 4 + header_size)
+
+    raw = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    arrays = dict()
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        stop = start + dtype.itemsize * int(np.prod(entry['shape'], dtype=np.int64))
+        arrays[entry['name']] = raw[start:stop].view(dtype).reshape(entry['shape'])
+    compact = header.get('compact')
+    if compact is not None:
+        arrays = expand_arrays(arrays, compact)
+    return MeshFile(
+        header['kind'],
+        arrays,
+        panorama_shape=header['panorama_shape'],
+        img_shape=header['img_shape'],
+        geometry=header['geometry'],
+        version=header['version'],
+        compact=compact,
+    )
+
+def load_pickle_mesh(path, kind):
+    """ Converts a mesh pickled by older versions into a `MeshFile`.
+
+        Dewarp pickles are `(map_x, map_y)` or `(panorama_shape, map_x, map_y)`,
+        rewarp pickles are `(map_x, map_y, mask)`.
+    """
+    with open(path, 'rb') as f:
+        values = tuple(pickle.load(f))
+    panorama_shape = None
+    if kind == 'dewarp' and len(values) == 3:
+        panorama_shape, values = values[0], values[1:]
+    names = MESH_ARRAY_NAMES[kind]
+    if len(values) != len(names):
+        raise ValueError(f'`{path}` is not a pickled {kind} mesh.')
+    if kind == 'dewarp' and panorama_shape is None:
+        h, w = values[0].shape
+        panorama_shape = (w, h)
+    return MeshFile(kind, dict(zip(names, values)), panorama_shape=panorama_shape)
+
+def read_mesh(path, kind, mmap=True):
+    """ Opens a mesh file or converts an old pickle. """
+    if is_mesh_file(path):
+        mesh = load_mesh(path, mmap=mmap)
+        if mesh.kind != kind:
+            raise ValueError(f'`{path}` holds a {mesh.kind} mesh, not a {kind} mesh.')
+        return mesh
+    return load_pickle_mesh(path, kind)
+
+def convert_mesh(pickle_path, mesh_path, kind):
+    """ Rewrites an old pickled mesh in the mesh file format. """
+    mesh = load_pickle_mesh(pickle_path, kind)
+    save_mesh(mesh_path, kind, mesh.arrays, panorama_shape=mesh.panorama_shape)
+    return mesh
@@ -0,0 +1,295 @@
+"""
+Warping Server
+
+Keeps `FisheyeWarping` instances and their meshes resident and serves dewarp
+and rewarp requests over a Unix socket or localhost HTTP.
+
+    POST /dewarp?camera=NAME    or    POST /rewarp?camera=NAME
+
+The input is the request body, an encoded image, or raw pixels with the
+`shape` (`h,w` or `h,w,c`) and `dtype` parameters, or a file the server reads
+itself with the `path` parameter, relative to the `root` it was started with. Grayscale and 16-bit images stay as they are.
+Raw NV12 or I420 frames add `layout` (`nv12` or `i420`), and the result keeps
+it. The result is encoded as `format` (`png`, `jpg` or `raw`), or written by
+the server to `output_path` under `root` with a JSON reply. Without a `root`,
+the server touches no files, and paths resolving outside it are refused. Raw results carry their shape
+and dtype in the `X-Shape` and `X-Dtype` headers.
+
+    GET /health    cameras and the meshes they hold
+    GET /stats     request counts and stage timings
+
+Errors are JSON `{"error": ...}` with status 400 for bad requests and 500 for
+failed warps.
+"""
+import argparse
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from .client import DEFAULT_PORT
+from .fisheyewarping import FisheyeWarping
+from .shared import SharedMeshRegistry
+from .timing import Timings, timed
+from .decode import IMREAD_FLAGS
+from .yuv import LAYOUTS
+
+ENCODINGS = {
+    'png': ('.png', 'image/png'),
+    'jpg': ('.jpg', 'image/jpeg'),
+}
+
+class RequestError(Exception):
+    """ A request the server cannot serve, answered with status 400. """
+
+class WarpServer:
+    """ Serves warps with the resident meshes of `cameras`, a dict of camera
+        name to `FisheyeWarping`, on at most `workers` threads.
+
+        Requests may name files to read and write only under `root`, any client
+        that reaches the socket or port could otherwise read and overwrite the
+        files of the server user.
+
+            >>> server = WarpServer({'lobby': frd}, workers=4)
+            >>> server.serve('/tmp/fisheyewarping.sock')
+    """
+
+    def __init__(self, cameras, workers=None, timings=None, root=None):
+        self.cameras = dict(cameras)
+        self.workers = workers or os.cpu_count() or 1
+        self.timings = timings
+        # the directory of the `path` and `output_path` parameters, `None` refuses them
+        self.root = Path(root).resolve() if root is not None else None
+        self.requests = 0
+        self.failures = 0
+        self.__executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.__lock = threading.Lock()
+        self.__httpd = None
+
+    def warp(self, mode, camera, img, layout=None):
+        """ Dewarps or rewarps `img` with the meshes of `camera`, a planar YUV
+            frame when `layout` is given.
+        """
+        frd = self.__camera(mode, camera)
+        if layout is not None:
+            if mode == 'dewarp':
+                return frd.dewarp_yuv(img, layout, flip=True)
+            return frd.rewarp_with_mesh_yuv(img, layout)
+        if mode == 'dewarp':
+            return frd.dewarp(img, flip=True)
+        return frd.rewarp_with_mesh(img)
+
+    def handle(self, mode, params, body):
+        """ Runs one request on the worker pool and returns `(headers, payload)`. """
+        with self.__lock:
+            self.requests += 1
+        try:
+            return self.__executor.submit(self.__handle, mode, params, body).result()
+        except Exception:
+            with self.__lock:
+                self.failures += 1
+            raise
+
+    def health(self):
+        return dict(
+            cameras={name: dict(panorama_shape=frd.panorama_shape) for name, frd in self.cameras.items()},
+            workers=self.workers,
+        )
+
+    def stats(self):
+        stats = dict(requests=self.requests, failures=self.failures)
+        if self.timings is not None:
+            stats.update(self.timings.as_dict())
+        return stats
+
+    def serve(self, address):
+        """ Serves until `shutdown`. `address` is a Unix socket path or `(host, port)`. """
+        if isinstance(address, (str, Path)):
+            address = str(address)
+            if os.path.exists(address):
+                os.unlink(address)
+            self.__httpd = _UnixHTTPServer(address, _Handler)
+        else:
+            self.__httpd = _TCPHTTPServer(tuple(address), _Handler)
+        self.__httpd.warp_server = self
+        try:
+            self.__httpd.serve_forever()
+        finally:
+            self.__httpd.server_close()
+            if isinstance(address, str) and os.path.exists(address):
+                os.unlink(address)
+            self.__executor.shutdown(wait=True)
+
+    def shutdown(self):
+        if self.__httpd is not None:
+            self.__httpd.shutdown()
+
+    def __camera(self, mode, camera):
+        if mode not in ('dewarp', 'rewarp'):
+            raise RequestError(f'Unknown method `{mode}`.')
+        if camera not in self.cameras:
+            raise RequestError(f'Unknown camera `{camera}`.')
+        return self.cameras[camera]
+
+    def __handle(self, mode, params, body):
+        camera = params.get('camera', 'default')
+        # reject unknown cameras before decoding anything
+        self.__camera(mode, camera)
+        layout = params.get('layout')
+        if layout is not None and (layout not in LAYOUTS or 'shape' not in params):
+            raise RequestError(f'`layout` must be one of {LAYOUTS} and come with a raw frame and its `shape`.')
+        img = self.__decode(params, body)
+        result = self.warp(mode, camera, img, layout)
+        return self.__encode(params, result)
+
+    def __file_path(self, params, name):
+        """ Returns the path of the `name` parameter resolved under `root`. """
+        if self.root is None:
+            raise RequestError(f'`{name}` needs a server started with a file root, see `--root`.')
+        path = (self.root / params[name]).resolve()
+        if path != self.root and self.root not in path.parents:
+            raise RequestError(f'`{params[name]}` is outside the file root of the server.')
+        return str(path)
+
+    def __decode(self, params, body):
+        with timed(self.timings, 'decode'):
+            if 'path' in params:
+                img = cv2.imread(self.__file_path(params, 'path'), IMREAD_FLAGS)
+                if img is None:
+                    raise RequestError(f'Cannot read image `{params["path"]}`.')
+                return img
+            if not body:
+                raise RequestError('The request has no image, send it as the body or pass `path`.')
+            if 'shape' in params:
+                try:
+                    shape = tuple(int(v) for v in params['shape'].split(','))
+                    dtype = np.dtype(params.get('dtype', 'uint8'))
+                except (TypeError, ValueError):
+                    raise RequestError(f'Bad `shape` `{params["shape"]}` or `dtype` `{params.get("dtype")}`.') from None
+                if int(np.prod(shape)) * dtype.itemsize != len(body):
+                    raise RequestError(f'The body does not hold a {dtype} array of shape {shape}.')
+                try:
+                    return np.frombuffer(body, dtype=dtype).reshape(shape)
+                except (TypeError, ValueError) as e:
+                    raise RequestError(f'The body does not hold a {dtype} array of shape {shape}: {e}') from None
+            img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), IMREAD_FLAGS)
+            if img is None:
+                raise RequestError('Cannot decode the image in the body.')
+            return img
+
+    def __encode(self, params, result):
+        with timed(self.timings, 'encode'):
+            if 'output_path' in params:
+                if not cv2.imwrite(self.__file_path(params, 'output_path'), result):
+                    raise IOError(f'Cannot write image `{params["output_path"]}`.')
+                reply = dict(output_path=params['output_path'], shape=list(result.shape))
+                return {'Content-Type': 'application/json'}, json.dumps(reply).encode('utf-8')
+            fmt = params.get('format', 'png')
+            if fmt == 'raw':
+                headers = {
+                    'Content-Type': 'application/octet-stream',
+                    'X-Shape': ','.join(str(v) for v in result.shape),
+                    'X-Dtype': result.dtype.str,
+                }
+                return headers, np.ascontiguousarray(result).tobytes()
+            if fmt not in ENCODINGS:
+                raise RequestError(f'Unknown format `{fmt}`.')
+            suffix, content_type = ENCODINGS[fmt]
+            ok, encoded = cv2.imencode(suffix, result)
+            if not ok:
+                raise IOError(f'Cannot encode the result as `{fmt}`.')
+            return {'Content-Type': content_type}, encoded.tobytes()
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# `http.server.ThreadingHTTPServer`, which needs Python 3.7
+class _TCPHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # requests are counted in `WarpServer.stats` instead
+        pass
+
+    def do_GET(self):
+        route = urlparse(self.path).path
+        if route == '/health':
+            self.__reply(200, json.dumps(self.server.warp_server.health()).encode('utf-8'))
+        elif route == '/stats':
+            self.__reply(200, json.dumps(self.server.warp_server.stats()).encode('utf-8'))
+        else:
+            self.__error(404, f'Unknown route `{route}`.')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            headers, payload = self.server.warp_server.handle(url.path.strip('/'), params, body)
+        except RequestError as e:
+            return self.__error(400, str(e))
+        except Exception as e:
+            return self.__error(500, f'{type(e).__name__}: {e}')
+        self.__reply(200, payload, headers)
+
+    def __error(self, status, message):
+        self.__reply(status, json.dumps(dict(error=message)).encode('utf-8'))
+
+    def __reply(self, status, payload, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {'Content-Type': 'application/json'}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def parse_camera(spec):
+    """ Parses `NAME=DEWARP_MESH[,REWARP_MESH]`. """
+    name, _, paths = spec.partition('=')
+    if not name or not paths:
+        raise argparse.ArgumentTypeError(f'`{spec}` is not `NAME=DEWARP_MESH[,REWARP_MESH]`.')
+    return (name, *paths.split(',', 1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve dewarp and rewarp requests with resident meshes.')
+    parser.add_argument('--camera', type=parse_camera, action='append', required=True, help='`NAME=DEWARP_MESH[,REWARP_MESH]`, repeat for more cameras.')
+    parser.add_argument('--socket', type=str, default=None, help='Unix socket path to listen on. Default is localhost HTTP.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host of localhost HTTP. Default is `127.0.0.1`.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port of localhost HTTP. Default is `{DEFAULT_PORT}`.')
+    parser.add_argument('--workers', type=int, default=None, help='Concurrent warps. Default is the number of CPUs.')
+    parser.add_argument('--shared_meshes', action='store_true', help='Keep meshes once in shared memory for every server process on the host.')
+    parser.add_argument('--map_type', type=str, default='float', choices=['float', 'fixed'], help='Remap with float maps or fixed-point `CV_16SC2` maps. Default is `float`.')
+    parser.add_argument('--root', type=str, default=None, help='Directory of the files requests may read with `path` and write with `output_path`. Default is `None`, requests send and receive image bytes only.')
+    args = parser.parse_args()
+
+    timings = Timings()
+    mesh_registry = SharedMeshRegistry() if args.shared_meshes else None
+    cameras = dict()
+    for name, dewarp_mesh_path, *rewarp_mesh_path in args.camera:
+        frd = FisheyeWarping(None, mesh_cache=False, map_type=args.map_type, verbose=False, timings=timings, mesh_registry=mesh_registry)
+        frd.load_dewarp_mesh(dewarp_mesh_path)
+        if rewarp_mesh_path:
+            frd.load_rewarp_mesh(rewarp_mesh_path[0])
+        cameras[name] = frd
+
+    server = WarpServer(cameras, workers=args.workers, timings=timings, root=args.root)
+    address = args.socket or (args.host, args.port)
+    print(f'----- Serving {len(cameras)} camera(s) on `{address}`.')
+    try:
+        server.serve(address)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Shared Mesh Registry
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+
+from .meshio import load_mesh, save_mesh
+
+def default_registry_dir():
+    if os.environ.get('FISHEYEWARPING_SHARED_DIR'):
+        return Path(os.environ['FISHEYEWARPING_SHARED_DIR'])
+    # tmpfs keeps the meshes in RAM, with pages shared by every process mapping them
+    if os.path.isdir('/dev/shm'):
+        return Path('/dev/shm') / 'fisheyewarping'
+    return Path(tempfile.gettempdir()) / 'fisheyewarping-shared'
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedMeshRegistry:
+    """ Meshes placed once in shared memory for every process on the host.
+
+        Each mesh is a mesh file under `path`, on tmpfs by default, named after
+        its key. `mesh_key` follows the geometry, so cameras of the same
+        resolution and circle share one copy. `get` and `put` return read-only
+        memory-mapped arrays, so attaching copies nothing.
+
+        A process holds one reference per mesh until `release` or `close`,
+        which also run at exit. The last process to let go removes the mesh,
+        and `prune` removes the meshes of processes that died. POSIX only.
+
+            >>> registry = SharedMeshRegistry()
+            >>> frd = FisheyeWarping(None, mesh_registry=registry)
+            >>> frd.load_dewarp_mesh('./dewarp-mesh.fwm')
+    """
+
+    def __init__(self, path=None):
+        if fcntl is None:
+            raise OSError('`SharedMeshRegistry` needs POSIX file locks.')
+        self.path = Path(path) if path else default_registry_dir()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__held = dict()
+        # a forked child starts without references
+        self.__pid = os.getpid()
+        weakref.finalize(self, _release_all, self.path, self.__held)
+
+    def __getstate__(self):
+        # references stay with the process that took them
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, key):
+        return self.__mesh_path(key).is_file()
+
+    def keys(self):
+        """ Keys held by this process. """
+        return list(self.__references())
+
+    @property
+    def nbytes(self):
+        """ Bytes of the meshes held by this process. """
+        return sum(array.nbytes for arrays in self.__references().values() for array in arrays)
+
+    def get(self, key):
+        """ Attaches to the mesh of `key`, or returns `None` if no process placed it. """
+        with self.__lock:
+            references = self.__references()
+            if key in references:
+                return references[key]
+            with _locked(self.path):
+                if not self.__mesh_path(key).is_file():
+                    return None
+                return self.__attach(key)
+
+    def put(self, key, arrays):
+        """ Places `arrays` under `key` and returns the shared arrays. When
+            another process placed the key first, its arrays are returned.
+        """
+        with self.__lock:
+            references = self.__references()
+            if key in references:
+                return references[key]
+            with _locked(self.path):
+                if not self.__mesh_path(key).is_file():
+                    save_mesh(self.__mesh_path(key), key.split('-')[0], {f'array{i}': array for i, array in enumerate(arrays)})
+                return self.__attach(key)
+
+    def get_or_create(self, key, build):
+        """ Attaches to `key`, or places the arrays `build()` returns.
+
+            `build` runs without the registry lock, so processes racing on a
+            new key may each build it but keep only one copy.
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = self.put(key, build())
+        return arrays
+
+    def release(self, key):
+        """ Drops this process's reference to `key`. Arrays already handed out
+            stay valid, their memory is freed once they are garbage collected.
+        """
+        with self.__lock:
+            if self.__references().pop(key, None) is not None:
+                with _locked(self.path):
+                    _let_go(self.path, _file_name(key), os.getpid())
+
+    def close(self):
+        """ Releases every mesh held by this process. """
+        with self.__lock:
+            _release_all(self.path, self.__references())
+
+    def prune(self):
+        """ Removes the meshes no live process holds, left by processes that died. """
+        with _locked(self.path):
+            for mesh_path in self.path.glob('*.fwm'):
+                _let_go(self.path, mesh_path.stem)
+
+    def locate(self, array):
+        """ Returns `(key, index)` of a shared array held by this process, else `None`. """
+        for key, arrays in self.__references().items():
+            for index, shared in enumerate(arrays):
+                if shared is array:
+                    return key, index
+        return None
+
+    def __references(self):
+        if self.__pid != os.getpid():
+            self.__held.clear()
+            self.__pid = os.getpid()
+        return self.__held
+
+    def __mesh_path(self, key):
+        return self.path / f'{_file_name(key)}.fwm'
+
+    def __attach(self, key):
+        name = _file_name(key)
+        _write_holders(self.path, name, _read_holders(self.path, name) | {os.getpid()})
+        mesh = load_mesh(self.__mesh_path(key))
+        arrays = tuple(mesh.arrays[f'array{i}'] for i in range(len(mesh.arrays)))
+        self.__held[key] = arrays
+        return arrays
+
+class _SharedArray:
+    """ Stands for an array of the registry while an instance is pickled. """
+
+    def __init__(self, key, index):
+        self.key = key
+        self.index = index
+
+def _replace_arrays(value, replace):
+    if isinstance(value, (np.ndarray, _SharedArray)):
+        return replace(value)
+    if isinstance(value, tuple):
+        return tuple(_replace_arrays(v, replace) for v in value)
+    if isinstance(value, list):
+        return [_replace_arrays(v, replace) for v in value]
+    if isinstance(value, dict):
+        return {k: _replace_arrays(v, replace) for k, v in value.items()}
+    return value
+
+def detach_arrays(registry, state):
+    """ Replaces the shared arrays in `state` by references to their keys, so
+        pickling it for another process sends the keys, not the maps.
+    """
+    def detach(array):
+        location = registry.locate(array)
+        return array if location is None else _SharedArray(*location)
+    return _replace_arrays(state, detach)
+
+def attach_arrays(registry, state):
+    """ Attaches to the arrays `detach_arrays` replaced in `state`. """
+    def attach(value):
+        if not isinstance(value, _SharedArray):
+            return value
+        arrays = registry.get(value.key)
+        if arrays is None:
+            raise KeyError(f'Mesh `{value.key}` is no longer in the registry at `{registry.path}`.')
+        return arrays[value.index]
+    return _replace_arrays(state, attach)
+
+def _file_name(key):
+    # keys of derived maps carry parameters that do not belong in a file name
+    return key.split('-')[0] + '-' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+@contextmanager
+def _locked(path):
+    """ Serializes the registries of every process on `path`. """
+    with open(path / '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_holders(path, name):
+    try:
+        return {int(pid) for pid in (path / f'{name}.refs').read_text().split()}
+    except FileNotFoundError:
+        return set()
+
+def _write_holders(path, name, holders):
+    (path / f'{name}.refs').write_text(''.join(f'{pid}\n' for pid in sorted(holders)))
+
+def _let_go(path, name, pid=None):
+    """ Drops `pid` and dead processes from the holders of the mesh file
+        `name`, and removes it when none is left. Runs under `_locked`.
+    """
+    holders = {holder for holder in _read_holders(path, name) if holder != pid and _alive(holder)}
+    if holders:
+        _write_holders(path, name, holders)
+        return
+    # open mappings stay valid after the files are removed
+    for stale in (path / f'{name}.fwm', path / f'{name}.refs'):
+        try:
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+def _release_all(path, held):
+    if held:
+        with _locked(path):
+            for key in held:
+                _let_go(path, _file_name(key), os.getpid())
+        held.clear()
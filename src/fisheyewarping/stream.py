@@ -0,0 +1,199 @@
+"""
+Streaming Dewarp And Rewarp
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+
+import cv2
+
+from .incremental import REFRESH_INTERVAL
+from .timing import timed
+
+# Marks the end of a stage's output.
+_END = object()
+
+class _StageError:
+
+    def __init__(self, error):
+        self.error = error
+
+class StreamStats:
+
+    def __init__(self):
+        self.frames = 0
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def seconds(self):
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    @property
+    def fps(self):
+        seconds = self.seconds
+        return self.frames / seconds if seconds > 0 else 0.0
+
+    def __repr__(self):
+        return f'StreamStats(frames={self.frames}, seconds={self.seconds:.3f}, fps={self.fps:.2f})'
+
+class WarpStream:
+    """ Dewarp or rewarp a stream of frames with a mesh built or loaded once.
+
+        Decoding, remapping and encoding run as separate stages connected by
+        bounded queues. `cv2.remap` releases the GIL, so the stages overlap.
+
+            >>> stream = WarpStream(frd, mode='dewarp')
+            >>> stream.write('./fisheye.mp4', './panorama.mp4')
+            >>> stream.stats.fps
+
+        With a `change_threshold`, frames of a still camera are remapped
+        incrementally by `FisheyeWarping.incremental`, only the output tiles
+        whose input changed by more than that many gray levels, and all of it
+        every `refresh_interval` frames.
+    """
+
+    MODES = ('dewarp', 'rewarp')
+
+    def __init__(self, frd, mode='dewarp', queue_size=8, change_threshold=None, refresh_interval=REFRESH_INTERVAL):
+        assert mode in self.MODES, f'`mode` must be one of {self.MODES}.'
+        self.frd = frd
+        self.mode = mode
+        self.queue_size = queue_size
+        self.change_threshold = change_threshold
+        self.refresh_interval = refresh_interval
+        self.stats = StreamStats()
+        self.source_fps = None
+        # `(input_size, IncrementalRemap)` of the stream running
+        self.__incremental = None
+
+    def warp(self, frame):
+        if self.change_threshold is not None:
+            return self.__warp_incremental(frame)
+        if self.mode == 'dewarp':
+            return self.frd.dewarp(frame, flip=True)
+        return self.frd.rewarp_with_mesh(frame)
+
+    def __warp_incremental(self, frame):
+        input_size = frame.shape[1::-1] if self.mode == 'rewarp' else None
+        if self.__incremental is None or self.__incremental[0] != input_size:
+            incremental = self.frd.incremental(
+                self.mode,
+                input_size=input_size,
+                threshold=self.change_threshold,
+                refresh_interval=self.refresh_interval
+            )
+            self.__incremental = (input_size, incremental)
+        # frames wait in the output queue while the next one is remapped
+        return self.__incremental[1].update(frame).copy()
+
+    def frames(self, source):
+        """ Yields warped frames of `source`, a video path or an iterable of frames. """
+        self.stats = StreamStats()
+        self.__incremental = None
+        stop = threading.Event()
+        decoded = queue.Queue(maxsize=self.queue_size)
+        warped = queue.Queue(maxsize=self.queue_size)
+        workers = [
+            threading.Thread(target=self.__decode, args=(source, decoded, stop), daemon=True),
+            threading.Thread(target=self.__remap, args=(decoded, warped, stop), daemon=True),
+        ]
+        self.stats.start_time = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                item = warped.get()
+                if item is _END:
+                    break
+                if isinstance(item, _StageError):
+                    raise item.error
+                self.stats.frames += 1
+                yield item
+        finally:
+            self.stats.end_time = time.perf_counter()
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def write(self, source, output_path, fourcc='mp4v', fps=None):
+        """ Encodes the warped frames of `source` to the video `output_path`. """
+        writer = None
+        try:
+            for frame in self.frames(source):
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(
+                        str(output_path),
+                        cv2.VideoWriter_fourcc(*fourcc),
+                        fps or self.source_fps or 30,
+                        (w, h),
+                        frame.ndim == 3
+                    )
+                with timed(self.frd.timings, 'encode'):
+                    writer.write(frame)
+        finally:
+            if writer is not None:
+                writer.release()
+        return self.stats
+
+    def __decode(self, source, output, stop):
+        capture = None
+        try:
+            if isinstance(source, (str, Path)):
+                capture = cv2.VideoCapture(str(source))
+                if not capture.isOpened():
+                    raise IOError(f'Cannot open video `{source}`.')
+                self.source_fps = capture.get(cv2.CAP_PROP_FPS) or None
+                frames = self.__read(capture)
+            else:
+                frames = iter(source)
+            for frame in frames:
+                if not self.__put(output, frame, stop):
+                    return
+            self.__put(output, _END, stop)
+        except Exception as e:
+            self.__put(output, _StageError(e), stop)
+        finally:
+            if capture is not None:
+                capture.release()
+
+    def __read(self, capture):
+        timings = self.frd.timings
+        while True:
+            with timed(timings, 'decode'):
+                ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+
+    def __remap(self, source, output, stop):
+        while not stop.is_set():
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END or isinstance(item, _StageError):
+                self.__put(output, item, stop)
+                return
+            try:
+                result = self.warp(item)
+            except Exception as e:
+                self.__put(output, _StageError(e), stop)
+                return
+            if not self.__put(output, result, stop):
+                return
+
+    @staticmethod
+    def __put(output, item, stop):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
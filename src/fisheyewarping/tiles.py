@@ -0,0 +1,72 @@
+"""
+Tiled Remapping
+"""
+import cv2
+import numpy as np
+
+from .geometry import OUT_OF_FRAME
+
+# Default tile `(w, h)` of the tiled methods of `FisheyeWarping`.
+DEFAULT_TILE = (1024, 256)
+
+# A tile whose source region is larger than this many times its own size, and
+# larger than `MIN_SPLIT_PIXELS`, is split in two.
+MAX_SOURCE_RATIO = 4
+MIN_SPLIT_PIXELS = 1 << 16
+
+def tile_windows(size, tile=DEFAULT_TILE):
+    """ Yields the windows `(x, y, w, h)` that cover an output of `size` `(w, h)`. """
+    w, h = size
+    tile_w, tile_h = tile
+    for y in range(0, h, tile_h):
+        for x in range(0, w, tile_w):
+            yield x, y, min(tile_w, w - x), min(tile_h, h - y)
+
+def output_array(out, shape, dtype):
+    """ Returns `out` after checking it fits, or a new array of `shape`. """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    assert out.shape == shape and out.dtype == dtype, f'`out` must be a {dtype} array of shape {shape}.'
+    return out
+
+def source_region(src_shape, map_x, map_y):
+    """ Returns the `(x0, y0, x1, y1)` of `src` that a bilinear remap with
+        `map_x`/`map_y` reads, or `None` if every pixel is out of frame.
+    """
+    valid = (map_x != OUT_OF_FRAME) & (map_x > -1) & (map_y > -1) & (map_x < src_shape[1]) & (map_y < src_shape[0])
+    if not valid.any():
+        return None
+    x0 = max(0, int(np.floor(map_x[valid].min())))
+    y0 = max(0, int(np.floor(map_y[valid].min())))
+    x1 = min(src_shape[1], int(np.floor(map_x[valid].max())) + 2)
+    y1 = min(src_shape[0], int(np.floor(map_y[valid].max())) + 2)
+    return x0, y0, x1, y1
+
+def remap_window(src, map_x, map_y, out, interpolation=cv2.INTER_LINEAR):
+    """ Remaps into `out` reading only the region of `src` the maps need.
+
+        `src` may be a `np.memmap`, only the rows and columns of the region are
+        read. The maps are shifted by whole pixels, which keeps their fractions,
+        so the result is identical to remapping the whole of `src`. Windows that
+        need a much larger region than themselves, like the rim of a panorama
+        that wraps around the fisheye, are split until they do not.
+    """
+    region = source_region(src.shape, map_x, map_y)
+    if region is None:
+        out[...] = 0
+        return out
+    x0, y0, x1, y1 = region
+    h, w = map_x.shape
+    if (x1 - x0) * (y1 - y0) > max(MAX_SOURCE_RATIO * h * w, MIN_SPLIT_PIXELS) and h * w > 1:
+        if h >= w:
+            half = h // 2
+            remap_window(src, map_x[:half], map_y[:half], out[:half], interpolation)
+            remap_window(src, map_x[half:], map_y[half:], out[half:], interpolation)
+        else:
+            half = w // 2
+            remap_window(src, map_x[:, :half], map_y[:, :half], out[:, :half], interpolation)
+            remap_window(src, map_x[:, half:], map_y[:, half:], out[:, half:], interpolation)
+        return out
+    crop = np.ascontiguousarray(src[y0:y1, x0:x1])
+    out[...] = cv2.remap(crop, map_x - np.float32(x0), map_y - np.float32(y0), interpolation).reshape(out.shape)
+    return out
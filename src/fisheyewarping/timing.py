@@ -0,0 +1,92 @@
+"""
+Stage Timings
+"""
+import contextlib
+import threading
+import time
+from collections import defaultdict
+
+class Timings:
+    """ Per-stage timers and counters.
+
+        Pass one to `FisheyeWarping(..., timings=...)` to time its stages, and
+        give it a `callback(stage, seconds)` to export each measurement as it
+        happens. Counters, like mesh cache hits, are kept in `counters`.
+
+            >>> timings = Timings()
+            >>> frd = FisheyeWarping(img, verbose=False, timings=timings)
+            >>> timings.seconds['remap'], timings.calls['remap']
+    """
+
+    STAGES = ('decode', 'mesh_build', 'mesh_load', 'mesh_save', 'remap', 'splice', 'rotate_resize', 'encode')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # a copy sent to another process starts empty and reports nowhere
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - st)
+
+    def add(self, stage, seconds):
+        with self.__lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+        if self.callback is not None:
+            self.callback(stage, seconds)
+
+    def count(self, name, n=1):
+        with self.__lock:
+            self.counters[name] += n
+
+    def mean(self, stage):
+        calls = self.calls.get(stage, 0)
+        return self.seconds[stage] / calls if calls else 0.0
+
+    def reset(self):
+        with self.__lock:
+            self.seconds.clear()
+            self.calls.clear()
+            self.counters.clear()
+
+    def as_dict(self):
+        return dict(seconds=dict(self.seconds), calls=dict(self.calls), counters=dict(self.counters))
+
+    def summary(self):
+        parts = [f'{stage} {self.seconds[stage]:.3f} s / {self.calls[stage]}' for stage in self.seconds]
+        parts += [f'{name} {value}' for name, value in self.counters.items()]
+        return ', '.join(parts)
+
+    def __repr__(self):
+        return f'Timings({self.summary()})'
+
+class _Untimed:
+    """ Does nothing, like `contextlib.nullcontext`, which needs Python 3.7. """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_UNTIMED = _Untimed()
+
+def timed(timings, stage):
+    """ Times `stage` into `timings`, or does nothing without one. """
+    if timings is None:
+        return _UNTIMED
+    return timings.time(stage)
@@ -0,0 +1,111 @@
+"""
+Fisheye Views
+
+Small meshes that render only part of the fisheye image. Angles are measured
+like the columns of the `run_dewarp` panorama: 0 degrees at its left edge,
+increasing to the right.
+"""
+import numpy as np
+
+from .geometry import OUT_OF_FRAME
+
+def _theta(angle):
+    # column angle of the `run_dewarp` panorama -> polar angle of `_dewarp_map_job`
+    return np.deg2rad(360.0 - np.asarray(angle, dtype=np.float64))
+
+class PanoramaView:
+    """ A strip of the panorama: the sector `start`..`end` degrees of the radial
+        band `inner`..`outer`, given as fractions of the fisheye radius.
+
+        Like the `run_dewarp` panorama, the outer edge is at the top. `size` is
+        `(w, h)`, by default the same pixel density as the full panorama.
+    """
+
+    def __init__(self, start=0, end=360, inner=0.0, outer=1.0, size=None):
+        assert start < end, '`start` must be smaller than `end`.'
+        assert 0 <= inner < outer, '`inner` must be in [0, `outer`).'
+        self.start = start
+        self.end = end
+        self.inner = inner
+        self.outer = outer
+        self.size = tuple(size) if size is not None else None
+
+    def __repr__(self):
+        return f'PanoramaView(start={self.start}, end={self.end}, inner={self.inner}, outer={self.outer}, size={self.size})'
+
+    def key(self):
+        return ('panorama', self.start, self.end, self.inner, self.outer, self.size)
+
+    def output_size(self, radius):
+        if self.size is not None:
+            return self.size
+        mid_radius = radius * (self.inner + self.outer) / 2
+        w = max(1, int(2.0 * mid_radius * np.pi * (self.end - self.start) / 360.0))
+        h = max(1, int(radius * (self.outer - self.inner)))
+        return w, h
+
+    def build_maps(self, center, radius):
+        w, h = self.output_size(radius)
+        c_x, c_y = center
+        angle = self.start + (np.arange(w, dtype=np.float64) + 0.5) / w * (self.end - self.start)
+        theta = _theta(angle)
+        # outer edge on the top row
+        fraction = self.outer - (np.arange(h, dtype=np.float64) + 0.5) / h * (self.outer - self.inner)
+        r = (fraction * radius)[:, np.newaxis]
+        map_x = (c_x + r * np.sin(theta)).astype(np.float32)
+        map_y = (c_y + r * np.cos(theta)).astype(np.float32)
+        return map_x, map_y
+
+class PerspectiveView:
+    """ A rectilinear virtual camera looking at `pan` degrees around and `tilt`
+        degrees away from the optical axis, with a horizontal field of view of
+        `fov` degrees and an output `size` of `(w, h)`.
+
+        The fisheye lens is modelled as equidistant, with `lens_fov` degrees
+        across the full circle.
+    """
+
+    def __init__(self, pan=0, tilt=45, fov=90, size=(640, 480), lens_fov=180):
+        assert 0 < fov < 180, '`fov` must be in (0, 180).'
+        self.pan = pan
+        self.tilt = tilt
+        self.fov = fov
+        self.size = tuple(size)
+        self.lens_fov = lens_fov
+
+    def __repr__(self):
+        return f'PerspectiveView(pan={self.pan}, tilt={self.tilt}, fov={self.fov}, size={self.size}, lens_fov={self.lens_fov})'
+
+    def key(self):
+        return ('perspective', self.pan, self.tilt, self.fov, self.size, self.lens_fov)
+
+    def output_size(self, radius):
+        return self.size
+
+    def build_maps(self, center, radius):
+        w, h = self.size
+        c_x, c_y = center
+        theta = float(_theta(self.pan))
+        tilt = np.deg2rad(self.tilt)
+        # fisheye camera frame: x and y along the image axes, z along the optical axis
+        forward = np.array([np.sin(tilt) * np.sin(theta), np.sin(tilt) * np.cos(theta), np.cos(tilt)])
+        # away from the optical axis is up in the view
+        down = -np.array([np.cos(tilt) * np.sin(theta), np.cos(tilt) * np.cos(theta), -np.sin(tilt)])
+        right = np.cross(down, forward)
+
+        focal = (w / 2) / np.tan(np.deg2rad(self.fov) / 2)
+        u = (np.arange(w, dtype=np.float64) + 0.5 - w / 2) / focal
+        v = (np.arange(h, dtype=np.float64) + 0.5 - h / 2) / focal
+        u, v = np.meshgrid(u, v)
+        rays = forward + u[..., np.newaxis] * right + v[..., np.newaxis] * down
+
+        angle = np.arccos(rays[..., 2] / np.linalg.norm(rays, axis=-1))
+        azimuth = np.arctan2(rays[..., 0], rays[..., 1])
+        half_fov = np.deg2rad(self.lens_fov) / 2
+        r = radius * angle / half_fov
+        map_x = (c_x + r * np.sin(azimuth)).astype(np.float32)
+        map_y = (c_y + r * np.cos(azimuth)).astype(np.float32)
+        outside = angle > half_fov
+        map_x[outside] = OUT_OF_FRAME
+        map_y[outside] = OUT_OF_FRAME
+        return map_x, map_y
@@ -0,0 +1,68 @@
+"""
+Planar YUV Frames
+
+Frames of the 4:2:0 layouts cameras deliver, a `(h * 3 / 2, w)` uint8 array:
+the `h` x `w` Y plane, then the interleaved UV plane of NV12, or the U and V
+planes of I420, each at half the width and height.
+"""
+import numpy as np
+
+from .geometry import OUT_OF_FRAME
+
+LAYOUTS = ('nv12', 'i420')
+
+# Chroma of gray, rendered outside the fisheye circle like the black of BGR frames.
+NEUTRAL_CHROMA = 128
+
+# Luma samples of a 2x2 block further apart than this straddle a seam of the
+# maps, like the wrap-around of the panorama, and are not averaged.
+SEAM_SPREAD = 8
+
+def yuv_frame_shape(w, h):
+    """ Returns the array shape of a `w` x `h` frame. """
+    return h * 3 // 2, w
+
+def yuv_frame_size(frame):
+    """ Returns `(w, h)` of the Y plane of a frame. """
+    rows, w = frame.shape[:2]
+    return w, rows * 2 // 3
+
+def yuv_planes(frame, layout):
+    """ Returns `(y, chroma)`, views of the Y plane and of a tuple of chroma
+        planes, the `(h / 2, w / 2, 2)` UV plane of NV12 or the U and V planes
+        of I420.
+    """
+    assert layout in LAYOUTS, f'`layout` must be one of {LAYOUTS}.'
+    w, h = yuv_frame_size(frame)
+    warning_msg = f'A {layout} frame is a contiguous `(h * 3 / 2, w)` array with even `w` and `h`.'
+    assert frame.ndim == 2 and frame.shape == yuv_frame_shape(w, h) and w % 2 == 0 and h % 2 == 0, warning_msg
+    assert frame.flags.c_contiguous, warning_msg
+    flat = frame.reshape(-1)
+    chroma = flat[w * h:]
+    if layout == 'nv12':
+        return frame[:h], (chroma.reshape(h // 2, w // 2, 2),)
+    size = (w // 2) * (h // 2)
+    return frame[:h], (chroma[:size].reshape(h // 2, w // 2), chroma[size:].reshape(h // 2, w // 2))
+
+def chroma_maps(map_x, map_y):
+    """ Returns the maps of the chroma planes for a pair of luma maps.
+
+        Each chroma pixel covers a 2x2 block of luma pixels and samples the
+        chroma plane where the average of their luma coordinates falls, or the
+        top left one across a seam. Blocks touching `OUT_OF_FRAME` stay out of
+        frame. A map of odd width or height loses its last column or row.
+    """
+    h, w = map_x.shape[0] // 2 * 2, map_x.shape[1] // 2 * 2
+    blocks = [m[:h, :w].astype(np.float64).reshape(h // 2, 2, w // 2, 2) for m in (map_x, map_y)]
+    outside = ((blocks[0] == OUT_OF_FRAME) | (blocks[1] == OUT_OF_FRAME)).any(axis=(1, 3))
+    seam = np.zeros(outside.shape, dtype=bool)
+    for block in blocks:
+        seam |= block.max(axis=(1, 3)) - block.min(axis=(1, 3)) > SEAM_SPREAD
+    maps = list()
+    for block in blocks:
+        luma = np.where(seam, block[:, 0, :, 0], block.mean(axis=(1, 3)))
+        # pixel centers of a plane of half the resolution
+        chroma = (luma * 0.5 - 0.25).astype(np.float32)
+        chroma[outside] = OUT_OF_FRAME
+        maps.append(chroma)
+    return tuple(maps)
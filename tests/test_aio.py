@@ -0,0 +1,120 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fisheyewarping import AsyncWarping, AsyncWarpStream, FisheyeWarping
+
+def run_loop(main):
+    """ `asyncio.run`, which needs Python 3.7, on a new event loop. """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        loop.close()
+
+class TestAsyncWarping(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        self.frd = FisheyeWarping(self.img, mesh_cache=False, verbose=False)
+        self.warping = AsyncWarping(self.frd, executor=ThreadPoolExecutor(max_workers=2))
+
+    def tearDown(self):
+        self.warping.executor.shutdown()
+
+    def test_awaitable_warps(self):
+        async def run():
+            await self.warping.build_dewarp_mesh()
+            await self.warping.build_rewarp_mesh()
+            panorama = await self.warping.dewarp(self.img, flip=True)
+            rewarped = await self.warping.rewarp_with_mesh(panorama)
+            return panorama, rewarped
+        panorama, rewarped = run_loop(run())
+        np.testing.assert_array_equal(panorama, self.frd.dewarp(self.img, flip=True))
+        np.testing.assert_array_equal(rewarped, self.frd.rewarp_with_mesh(panorama))
+
+    def test_loop_is_not_blocked(self):
+        async def tick(done, ticks):
+            while not done.is_set():
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        async def run():
+            done, ticks = asyncio.Event(), []
+            ticker = asyncio.ensure_future(tick(done, ticks))
+            await self.warping.run(time.sleep, 0.05)
+            done.set()
+            await ticker
+            return ticks
+        self.assertGreater(len(run_loop(run())), 1)
+
+    def test_block_policy_keeps_every_frame(self):
+        frames = [np.full_like(self.img, i) for i in range(6)]
+
+        async def run():
+            await self.warping.build_dewarp_mesh()
+            stream = AsyncWarpStream(self.warping, maxsize=2, policy='block')
+            feeder = asyncio.ensure_future(stream.feed(frames))
+            results = [result async for result in stream]
+            await feeder
+            return stream, results
+        stream, results = run_loop(run())
+        self.assertEqual(len(results), len(frames))
+        self.assertEqual((stream.stats.received, stream.stats.dropped, stream.stats.processed), (6, 0, 6))
+        for frame, result in zip(frames, results):
+            np.testing.assert_array_equal(result, self.frd.dewarp(frame, flip=True))
+
+    def test_stream_built_outside_the_loop(self):
+        self.frd.build_dewarp_mesh()
+        # `put` waits on the full queue, which must belong to the loop it runs on
+        stream = AsyncWarpStream(self.warping, maxsize=1, policy='block')
+
+        async def run():
+            feeder = asyncio.ensure_future(stream.feed([self.img] * 3))
+            results = [result async for result in stream]
+            await feeder
+            return results
+        self.assertEqual(len(run_loop(run())), 3)
+
+    def test_drop_oldest_keeps_latest_frames(self):
+        frames = [np.full_like(self.img, i) for i in range(6)]
+
+        async def run():
+            await self.warping.build_dewarp_mesh()
+            stream = AsyncWarpStream(self.warping, maxsize=2, policy='drop_oldest')
+            # the producer runs ahead of the consumer
+            await stream.feed(frames)
+            return stream, [result async for result in stream]
+        stream, results = run_loop(run())
+        self.assertEqual(stream.stats.dropped, 4)
+        self.assertEqual(len(results), 2)
+        for frame, result in zip(frames[-2:], results):
+            np.testing.assert_array_equal(result, self.frd.dewarp(frame, flip=True))
+
+    def test_many_streams_share_one_loop(self):
+        frds = [FisheyeWarping(self.img, mesh_cache=False, verbose=False) for _ in range(3)]
+
+        async def camera(frd):
+            warping = AsyncWarping(frd, executor=self.warping.executor)
+            await warping.build_dewarp_mesh()
+            stream = AsyncWarpStream(warping, maxsize=1)
+            feeder = asyncio.ensure_future(stream.feed([self.img] * 4))
+            results = [result async for result in stream]
+            await feeder
+            return results
+
+        async def run():
+            return await asyncio.gather(*(camera(frd) for frd in frds))
+        all_results = run_loop(run())
+        self.frd.build_dewarp_mesh()
+        expected = self.frd.dewarp(self.img, flip=True)
+        for results in all_results:
+            self.assertEqual(len(results), 4)
+            np.testing.assert_array_equal(results[-1], expected)
+
+if __name__ == '__main__':
+    unittest.main()
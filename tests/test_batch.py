@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, run_batch
+from fisheyewarping.batch import collect_inputs
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self.tmp.name, 'input')
+        self.input_dir.mkdir()
+        rng = np.random.default_rng(0)
+        self.images = dict()
+        for i in range(4):
+            img = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+            cv2.imwrite(str(self.input_dir / f'{i}.png'), img)
+            self.images[f'{i}.png'] = img
+        (self.input_dir / 'notes.txt').write_text('not an image')
+        self.frd = FisheyeWarping(img, mesh_cache=False)
+        self.frd.build_dewarp_mesh()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_collect_inputs(self):
+        self.assertEqual(len(collect_inputs(str(self.input_dir))), 4)
+        self.assertEqual(len(collect_inputs(str(self.input_dir / '[01].png'))), 2)
+
+    def test_run_batch(self):
+        output_dir = Path(self.tmp.name, 'output')
+        for pool in ('thread', 'process'):
+            stats = run_batch(self.frd, collect_inputs(str(self.input_dir)), output_dir, workers=2, pool=pool, skip_up_to_date=False)
+            self.assertEqual(stats.processed, 4)
+            self.assertEqual(stats.failed, [])
+            for name, img in self.images.items():
+                np.testing.assert_array_equal(cv2.imread(str(output_dir / name)), self.frd.dewarp(img, flip=True))
+
+    def test_subdirectories_are_mirrored(self):
+        rng = np.random.default_rng(1)
+        images = dict()
+        for name in ('a', 'b', 'b/c'):
+            directory = self.input_dir / name
+            directory.mkdir()
+            images[f'{name}/0.png'] = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+            cv2.imwrite(str(directory / '0.png'), images[f'{name}/0.png'])
+        output_dir = Path(self.tmp.name, 'output')
+        inputs = collect_inputs(str(self.input_dir / '**' / '0.png'))
+        self.assertEqual(len(inputs), 4)
+        stats = run_batch(self.frd, inputs, output_dir, workers=2)
+        self.assertEqual(stats.processed, 4)
+        for name, img in images.items():
+            np.testing.assert_array_equal(cv2.imread(str(output_dir / name)), self.frd.dewarp(img, flip=True))
+        # each output is compared with its own input
+        os.utime(self.input_dir / 'b' / '0.png', (os.path.getmtime(output_dir / 'b' / '0.png') + 10,) * 2)
+        stats = run_batch(self.frd, inputs, output_dir, workers=2)
+        self.assertEqual((stats.processed, stats.skipped), (1, 3))
+
+    def test_skip_up_to_date(self):
+        output_dir = Path(self.tmp.name, 'output')
+        inputs = collect_inputs(str(self.input_dir))
+        run_batch(self.frd, inputs, output_dir, workers=1)
+        os.utime(inputs[0], (os.path.getmtime(output_dir / inputs[0].name) + 10,) * 2)
+        stats = run_batch(self.frd, inputs, output_dir, workers=1)
+        self.assertEqual(stats.processed, 1)
+        self.assertEqual(stats.skipped, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
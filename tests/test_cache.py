@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, MeshCache
+from fisheyewarping.cache import mesh_key
+
+class TestMeshCache(unittest.TestCase):
+
+    def test_lru_limit(self):
+        cache = MeshCache(max_bytes=250)
+        for name in 'abc':
+            cache.put(name, (np.zeros(100, dtype=np.uint8),))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        cache.put('d', (np.zeros(100, dtype=np.uint8),))
+        self.assertIsNone(cache.get('c'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertLessEqual(cache.nbytes, 250)
+
+    def test_keys_follow_geometry(self):
+        details = (100, 32, 0, 32, 32, 32)
+        self.assertEqual(mesh_key('dewarp', (64, 64, 3), details), mesh_key('dewarp', (64, 64), details))
+        self.assertNotEqual(mesh_key('dewarp', (64, 64), details), mesh_key('rewarp', (64, 64), details, (100, 32)))
+        self.assertNotEqual(mesh_key('rewarp', (64, 64), details, (100, 32)), mesh_key('rewarp', (64, 64), details, (101, 32)))
+
+    def test_build_uses_both_tiers(self):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = MeshCache(cache_dir=tmp)
+            frd = FisheyeWarping(img, mesh_cache=cache)
+            _, mapx, _ = frd.build_dewarp_mesh()
+            rewarp_maps = frd.build_rewarp_mesh()
+            self.assertEqual(cache.misses, 2)
+
+            _, cached_x, _ = FisheyeWarping(img, mesh_cache=cache).build_dewarp_mesh()
+            self.assertIs(cached_x, mapx)
+            self.assertEqual(cache.hits, 1)
+
+            # a restarted process only has the disk tier
+            cold = MeshCache(cache_dir=tmp)
+            frd = FisheyeWarping(img, mesh_cache=cold)
+            _, loaded_x, _ = frd.build_dewarp_mesh()
+            np.testing.assert_array_equal(loaded_x, mapx)
+            for loaded, built in zip(frd.build_rewarp_mesh(), rewarp_maps):
+                np.testing.assert_array_equal(loaded, built)
+            self.assertEqual((cold.disk_hits, cold.misses), (2, 0))
+
+    def test_disk_limit_evicts_least_recently_used(self):
+        arrays = (np.zeros(1000, dtype=np.uint8),)
+        with tempfile.TemporaryDirectory() as tmp:
+            MeshCache(cache_dir=tmp).put('dewarp-a', arrays)
+            size = (Path(tmp) / 'dewarp-a.fwm').stat().st_size
+            cache = MeshCache(cache_dir=tmp, max_disk_bytes=2 * size)
+            cache.put('dewarp-b', arrays)
+            # mtimes a second apart, as on file systems with a coarse clock
+            for i, name in enumerate('ab'):
+                os.utime(Path(tmp) / f'dewarp-{name}.fwm', (1000 + i, 1000 + i))
+            # a disk hit makes `a` the most recently used
+            self.assertIsNotNone(MeshCache(cache_dir=tmp).get('dewarp-a'))
+            cache.put('dewarp-c', arrays)
+            self.assertEqual(sorted(path.name for path in Path(tmp).iterdir()), ['dewarp-a.fwm', 'dewarp-c.fwm'])
+            # a mesh larger than the whole limit is only kept in memory
+            cache.put('dewarp-d', (np.zeros(3 * size, dtype=np.uint8),))
+            self.assertFalse((Path(tmp) / 'dewarp-d.fwm').exists())
+            self.assertIsNotNone(cache.get('dewarp-d'))
+
+    def test_fixed_point_maps_are_cached(self):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        cache = MeshCache()
+        FisheyeWarping(img, mesh_cache=cache, map_type='fixed').build_dewarp_mesh()
+        self.assertEqual(cache.misses, 2)
+        FisheyeWarping(img, mesh_cache=cache, map_type='fixed').build_dewarp_mesh()
+        self.assertEqual(cache.hits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from fisheyewarping import CameraGeometry, FisheyeWarping, LiveCalibration, MeshCache, OutputSpec, PanoramaView
+from fisheyewarping import fisheyewarping
+from fisheyewarping.geometry import output_maps, sample_maps
+
+def built(geometry, **kwargs):
+    frd = FisheyeWarping(None, mesh_cache=False, verbose=False, geometry=geometry, **kwargs)
+    frd.build_dewarp_mesh()
+    frd.build_rewarp_mesh()
+    return frd
+
+class TestCalibration(unittest.TestCase):
+
+    def test_set_geometry_matches_a_fresh_build(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (100, 120, 3), dtype=np.uint8)
+        frd = built(CameraGeometry((120, 100), center=(60, 50), inner_radius=3, outer_radius=45))
+        # a shift that crops the circle, a shift out of the frame, then new radii and output size
+        for geometry in (
+            CameraGeometry((120, 100), center=(30, 20), inner_radius=3, outer_radius=45),
+            CameraGeometry((120, 100), center=(500, -300), inner_radius=3, outer_radius=45),
+            CameraGeometry((120, 100), center=(70, 40), outer_radius=30, output_size=(200, 50)),
+        ):
+            frd.set_geometry(geometry)
+            expected = built(geometry)
+            panorama = expected.dewarp(img, flip=True)
+            np.testing.assert_array_equal(frd.dewarp(img, flip=True), panorama)
+            np.testing.assert_array_equal(frd.rewarp_with_mesh(panorama), expected.rewarp_with_mesh(panorama))
+            np.testing.assert_array_equal(frd.rewarp(panorama), expected.rewarp(panorama))
+
+    def test_tuned_geometries_stay_off_disk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = MeshCache(cache_dir=tmp)
+            frd = FisheyeWarping(None, mesh_cache=cache, verbose=False, geometry=CameraGeometry((120, 100), outer_radius=50))
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            frd.add_view('door', PanoramaView(0, 90))
+            stored = sorted(Path(tmp).iterdir())
+            # radius changes derive the rewarp maps from the polar grid of the center
+            for geometry in (
+                CameraGeometry((120, 100), outer_radius=45),
+                CameraGeometry((120, 100), inner_radius=4, outer_radius=40),
+                CameraGeometry((120, 100), center=(58, 52), inner_radius=4, outer_radius=40),
+            ):
+                frd.set_geometry(geometry)
+                expected = built(geometry)
+                # a hit of the memory tier, the maps `set_geometry` derived
+                for result, maps in zip(frd.build_rewarp_mesh(), expected.build_rewarp_mesh()):
+                    np.testing.assert_array_equal(result, maps)
+            self.assertEqual(sorted(Path(tmp).iterdir()), stored)
+
+    def test_whole_pixel_output_maps_are_indexed(self):
+        rng = np.random.default_rng(0)
+        map_x, map_y = rng.random((2, 36, 140), dtype=np.float32) * 100
+        for spec in (OutputSpec(rotate=180), OutputSpec(rotate=90), OutputSpec(rotate=-90), OutputSpec(rotate=180, crop=(3, 2, 50, 20))):
+            self.assertIsNotNone(spec.pixel_sources(140, 36))
+            expected = sample_maps(map_x, map_y, *spec.source_coordinates(140, 36))
+            for result, sampled in zip(output_maps(map_x, map_y, spec), expected):
+                np.testing.assert_array_equal(result, sampled)
+        # half pixels fall back to sampling
+        self.assertIsNone(OutputSpec(rotate=180, scale=0.5).pixel_sources(140, 36))
+        self.assertIsNone(OutputSpec(rotate=90).pixel_sources(140, 35))
+
+    def test_preview_until_the_full_meshes_are_ready(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (200, 240, 3), dtype=np.uint8), (0, 0), 4)
+        geometry = CameraGeometry((240, 200), center=(120, 100), outer_radius=90)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            calibration = LiveCalibration(built(geometry), executor=executor)
+            # the rebuild waits behind the gate, the preview is served meanwhile
+            gate = threading.Event()
+            executor.submit(gate.wait)
+            future = calibration.update(CameraGeometry((240, 200), center=(120, 100), outer_radius=80))
+            self.assertFalse(calibration.ready)
+            expected = built(CameraGeometry((240, 200), center=(120, 100), outer_radius=80)).dewarp(img, flip=True)
+            preview = calibration.dewarp(img)
+            self.assertEqual(preview.shape, expected.shape)
+            self.assertLess(np.abs(preview.astype(int) - expected).mean(), 12)
+            gate.set()
+            future.result()
+            self.assertTrue(calibration.ready)
+            np.testing.assert_array_equal(calibration.dewarp(img), expected)
+
+    def test_center_shift_is_immediate(self):
+        calibration = LiveCalibration(built(CameraGeometry((120, 100))))
+        with calibration:
+            future = calibration.update(CameraGeometry((120, 100), center=(62, 47)))
+            self.assertTrue(future.done())
+            self.assertTrue(calibration.ready)
+            self.assertEqual(calibration.frd.geometry.center, (62, 47))
+
+    def test_stale_rebuilds_are_skipped(self):
+        class Recording(FisheyeWarping):
+            def set_geometry(self, geometry):
+                # copies share the list
+                self.rebuilt.append(geometry)
+                super().set_geometry(geometry)
+        frd = Recording(None, mesh_cache=False, verbose=False, geometry=CameraGeometry((120, 100)))
+        frd.build_dewarp_mesh()
+        frd.rebuilt = list()
+        radii = (50, 48, 46)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            calibration = LiveCalibration(frd, executor=executor)
+            gate = threading.Event()
+            executor.submit(gate.wait)
+            futures = [calibration.update(CameraGeometry((120, 100), outer_radius=r)) for r in radii]
+            gate.set()
+            results = [future.result() for future in futures]
+        self.assertEqual([result is None for result in results], [True, True, False])
+        self.assertEqual([geometry.outer_radius for geometry in frd.rebuilt], [46])
+        self.assertEqual(calibration.frd.geometry.outer_radius, 46)
+        self.assertTrue(calibration.ready)
+
+    def test_radius_changes_reuse_the_polar_grid(self):
+        calibration = LiveCalibration(built(CameraGeometry((120, 100), outer_radius=50)))
+        with calibration, mock.patch.object(fisheyewarping, 'rewarp_polar_block', wraps=fisheyewarping.rewarp_polar_block) as polar_block:
+            for radius in (48, 46, 44):
+                calibration.update(CameraGeometry((120, 100), outer_radius=radius)).result()
+            # the copies made by `update` keep the grid of the first one
+            self.assertEqual(polar_block.call_count, 1)
+        self.assertEqual(calibration.frd.geometry.outer_radius, 44)
@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fisheyewarping import CameraGeometry, FisheyeWarping
+from fisheyewarping.decode import decode_scale, jpeg_size
+
+class TestDecode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.img = cv2.resize(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8), (803, 600), interpolation=cv2.INTER_CUBIC)
+        self.path = str(Path(self.tmp.name, 'fisheye.jpg'))
+        cv2.imwrite(self.path, self.img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_jpeg_size_and_scale(self):
+        self.assertEqual(jpeg_size(self.path), (803, 600))
+        png_path = str(Path(self.tmp.name, 'fisheye.png'))
+        cv2.imwrite(png_path, self.img)
+        self.assertIsNone(jpeg_size(png_path))
+        self.assertEqual(decode_scale((1200, 400), (1200, 400)), 1)
+        self.assertEqual(decode_scale((1200, 400), (400, 100)), 2)
+        self.assertEqual(decode_scale((1200, 400), (150, 50)), 8)
+
+    def test_jpeg_size_skips_fill_bytes(self):
+        data = Path(self.path).read_bytes()
+        # an odd number of 0xFF fill bytes before every marker up to the frame header
+        padded, i = bytearray(data[:2]), 2
+        while data[i + 1] not in (0xC0, 0xC2):
+            length = int.from_bytes(data[i + 2:i + 4], 'big')
+            padded += b'\xff' * 3 + data[i:i + 2 + length]
+            i += 2 + length
+        padded += b'\xff' + data[i:]
+        path = Path(self.tmp.name, 'padded.jpg')
+        path.write_bytes(bytes(padded))
+        self.assertEqual(jpeg_size(path), (803, 600))
+        self.assertEqual(cv2.imread(str(path)).shape, self.img.shape)
+
+    def test_dewarp_file_decodes_reduced(self):
+        for map_type in ('float', 'fixed'):
+            frd = FisheyeWarping(
+                None,
+                mesh_cache=False,
+                map_type=map_type,
+                verbose=False,
+                geometry=CameraGeometry(jpeg_size(self.path), output_size=(300, 100))
+            )
+            frd.build_dewarp_mesh()
+            self.assertEqual(frd.decode_scale(), 4)
+            reduced = frd.dewarp_file(self.path)
+            full = frd.dewarp(cv2.imread(self.path), flip=True)
+            self.assertEqual(reduced.shape, full.shape)
+            self.assertLess(np.abs(reduced.astype(int) - full).mean(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,290 @@
+import pickle
+import tracemalloc
 import unittest
-from fisheyewarping import FisheyeWarping
+
+import cv2
+import numpy as np
+
+from fisheyewarping import CameraGeometry, FisheyeWarping, OutputSpec, RemapEngine
+from fisheyewarping.fisheyewarping import remap_is_fixed_point
 
 class TestFisheyeWarping(unittest.TestCase):
 
     def test_create_obj(self):
         frd = FisheyeWarping(None, use_multiprocessing=True) 
 
+    def test_vectorized_dewarp_mesh_matches_loop(self):
+        for shape in [(64, 64, 3), (101, 99, 3)]:
+            img = np.zeros(shape, dtype=np.uint8)
+            _, vec_x, vec_y = FisheyeWarping(img, mesh_cache=False).build_dewarp_mesh()
+            _, loop_x, loop_y = FisheyeWarping(img, use_vectorization=False, mesh_cache=False).build_dewarp_mesh()
+            np.testing.assert_array_equal(vec_x, loop_x)
+            np.testing.assert_array_equal(vec_y, loop_y)
+
+    def test_vectorized_rewarp_mesh_matches_loop(self):
+        for shape in [(64, 64, 3), (65, 65, 3)]:
+            img = np.zeros(shape, dtype=np.uint8)
+            vec = FisheyeWarping(img, mesh_cache=False)
+            vec.build_dewarp_mesh()
+            loop = FisheyeWarping(img, use_vectorization=False, mesh_cache=False)
+            loop.build_dewarp_mesh()
+            for vec_map, loop_map in zip(vec.build_rewarp_mesh(), loop.build_rewarp_mesh()):
+                np.testing.assert_array_equal(vec_map, loop_map)
+
+    def test_vectorized_rewarp_mesh_peak_memory(self):
+        img = np.zeros((1024, 1024, 3), dtype=np.uint8)
+        frd = FisheyeWarping(img, mesh_cache=False)
+        frd.build_dewarp_mesh()
+        tracemalloc.start()
+        try:
+            maps = frd.build_rewarp_mesh()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 2.5 * sum(m.nbytes for m in maps))
+
+    def test_geometry_builds_meshes_without_pixels(self):
+        img = np.zeros((65, 65, 3), dtype=np.uint8)
+        from_img = FisheyeWarping(img, mesh_cache=False)
+        from_geometry = FisheyeWarping(None, mesh_cache=False, geometry=CameraGeometry((65, 65)))
+        np.testing.assert_array_equal(from_geometry.build_dewarp_mesh()[1], from_img.build_dewarp_mesh()[1])
+        for geometry_map, img_map in zip(from_geometry.build_rewarp_mesh(), from_img.build_rewarp_mesh()):
+            np.testing.assert_array_equal(geometry_map, img_map)
+        # off-center circle with an inner radius, the rewarp mesh needs no dewarp mesh
+        geometry = CameraGeometry((120, 100), center=(70, 45), inner_radius=5, outer_radius=40)
+        vec = FisheyeWarping(None, mesh_cache=False, geometry=geometry)
+        loop = FisheyeWarping(None, mesh_cache=False, geometry=geometry, use_vectorization=False)
+        for vec_map, loop_map in zip(vec.build_rewarp_mesh(), loop.build_rewarp_mesh()):
+            np.testing.assert_array_equal(vec_map, loop_map)
+        self.assertEqual(vec.panorama_shape, geometry.details()[:2])
+
+    def test_off_center_circle_round_trips(self):
+        geometry = CameraGeometry((120, 100), center=(70, 45), inner_radius=5, outer_radius=40)
+        y, x = np.mgrid[0:100, 0:120]
+        img = np.dstack([x * 2, y * 2, x + y]).astype(np.uint8)
+        distance = np.hypot(x - 70, y - 45)
+        # away from the radii and the seam of the panorama below the center
+        inside = (distance > 7) & (distance < 37) & (np.abs(x - 70) > 1)
+        for fuse_rewarp in (True, False):
+            frd = FisheyeWarping(None, mesh_cache=False, geometry=geometry, fuse_rewarp=fuse_rewarp)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            result = frd.rewarp_with_mesh(frd.dewarp(img, flip=True))
+            self.assertLess(np.abs(result.astype(int) - img)[inside].max(), 16)
+            self.assertFalse(result[(distance > 41) | (distance < 4)].any())
+
+    def test_fixed_point_remap(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+        float_frd = FisheyeWarping(img, mesh_cache=False)
+        fixed_frd = FisheyeWarping(img, mesh_cache=False, map_type='fixed')
+        for frd in (float_frd, fixed_frd):
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+        # dewarp maps are integers, so the fixed-point path is exact
+        np.testing.assert_array_equal(fixed_frd.dewarp(img, flip=True), float_frd.dewarp(img, flip=True))
+        panorama = rng.integers(0, 256, float_frd.dewarp(img).shape, dtype=np.uint8)
+        diff = np.abs(fixed_frd.rewarp(panorama).astype(int) - float_frd.rewarp(panorama))
+        self.assertLessEqual(diff.max(), 8)
+        self.assertLess(diff.mean(), 1)
+
+    def test_fused_rewarp_matches_two_pass_rewarp(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (257, 257, 3), dtype=np.uint8)
+        fused = FisheyeWarping(img, mesh_cache=False)
+        two_pass = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=False)
+        for frd in (fused, two_pass):
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+        panorama = rng.integers(0, 256, fused.dewarp(img).shape, dtype=np.uint8)
+        expected = two_pass.rewarp(panorama, flip=True)
+        result = fused.rewarp(panorama, flip=True)
+        if remap_is_fixed_point():
+            # the flipped half samples the same 1/32 pixel steps
+            np.testing.assert_array_equal(result, expected)
+        # at float precision, the flipped half differs by float32 rounding of its coordinates
+        diff = np.abs(result.astype(int) - expected)
+        self.assertLessEqual(diff.max(), 1)
+        self.assertLess(np.count_nonzero(diff), 0.001 * diff.size)
+        np.testing.assert_array_equal(fused.rewarp(panorama, flip=False), two_pass.rewarp(panorama, flip=False))
+
+    def test_output_spec_is_baked_into_dewarp(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8), (0, 0), 3)
+        frd = FisheyeWarping(img, mesh_cache=False)
+        frd.build_dewarp_mesh()
+        panorama = frd.dewarp(img)
+        wrap = frd._FisheyeWarping__wrap
+        # whole-pixel rotations are exact
+        np.testing.assert_array_equal(frd.dewarp(img, flip=True), wrap(panorama, 180, scale=1))
+        frd.set_output_spec(OutputSpec(rotate=90))
+        np.testing.assert_array_equal(frd.dewarp(img, flip=True), wrap(panorama, 90, scale=1))
+        # resizing samples the fisheye once instead of resampling the panorama
+        frd.set_output_spec(OutputSpec(rotate=180, scale=0.5, crop=(10, 5, 150, 50)))
+        result = frd.dewarp(img, flip=True)
+        expected = wrap(panorama, 180, scale=0.5)[5:55, 10:160]
+        self.assertEqual(result.shape, expected.shape)
+        self.assertLess(np.abs(result.astype(int) - expected).mean(), 3)
+
+    def test_pyramid_levels_match_resized_panorama(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8), (0, 0), 3)
+        frd = FisheyeWarping(img, mesh_cache=False, verbose=False, pyramid=[(402, 128), (201, 64), (100, 32)])
+        frd.build_dewarp_mesh()
+        full, *levels = frd.dewarp_pyramid(img)
+        np.testing.assert_array_equal(full, frd.dewarp(img, flip=True))
+        for level in levels:
+            expected = cv2.resize(full, level.shape[1::-1], interpolation=cv2.INTER_AREA)
+            self.assertLess(np.abs(level.astype(int) - expected).mean(), 2)
+        # the levels show the same crop window, into preallocated arrays
+        frd.set_output_spec(OutputSpec(rotate=180, crop=(100, 20, 200, 80)))
+        frd.set_pyramid([(100, 40)])
+        out = [np.empty((40, 100, 3), dtype=np.uint8)]
+        level, = frd.dewarp_pyramid(img, out=out)
+        self.assertIs(level, out[0])
+        expected = cv2.resize(frd.dewarp(img, flip=True), (100, 40), interpolation=cv2.INTER_AREA)
+        self.assertLess(np.abs(level.astype(int) - expected).mean(), 2)
+
+    def test_rewarp_with_mesh_is_one_remap(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (255, 255, 3), dtype=np.uint8)
+        fused = FisheyeWarping(img, mesh_cache=False)
+        two_pass = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=False)
+        for frd in (fused, two_pass):
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+        panorama = rng.integers(0, 256, fused.dewarp(img).shape, dtype=np.uint8)
+        # the outermost ring differs, where `__wrap` used to shift in a black row
+        diff = np.abs(fused.rewarp_with_mesh(panorama).astype(int) - two_pass.rewarp_with_mesh(panorama))
+        y, x = np.mgrid[0:255, 0:255]
+        inner = np.hypot(x - 127, y - 127) < 127
+        self.assertLess(np.count_nonzero(diff[inner]), 0.001 * diff.size)
+
+    def test_rewarp_of_resized_panoramas_is_close_to_two_pass(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8), (0, 0), 3)
+        fused = FisheyeWarping(img, mesh_cache=False, verbose=False)
+        two_pass = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=False, verbose=False)
+        for frd in (fused, two_pass):
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+        panorama = fused.dewarp(img, flip=True)
+        y, x = np.mgrid[0:256, 0:256]
+        r = np.hypot(x - 127.5, y - 127.5)
+        inner = (r > 2) & (r < 126)
+        # the radial line where the two ends of the panorama meet
+        seam = inner & (np.abs(x - 127.5) < 2) & (y > 128)
+        for size in ((400, 100), (1600, 500)):
+            resized = cv2.resize(panorama, size, interpolation=cv2.INTER_AREA)
+            result = fused.rewarp_with_mesh(resized).astype(int)
+            expected = two_pass.rewarp_with_mesh(resized)
+            # one bilinear sample instead of a resize, then a sample
+            diff = np.abs(result - expected).max(axis=2)
+            self.assertLessEqual(diff[inner & ~seam].max(), 24)
+            self.assertLess(diff[inner & ~seam].mean(), 1)
+            # the rim and the seam differ by up to ~150 levels, the seam is closer to the fisheye
+            self.assertLessEqual(diff.max(), 160)
+            error = np.abs(result - img).max(axis=2)[seam].mean()
+            self.assertLess(error, np.abs(expected.astype(int) - img).max(axis=2)[seam].mean() / 4)
+
+    def test_batches_into_buffers(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (96, 96, 3), dtype=np.uint8)
+        frames = rng.integers(0, 256, (4, 96, 96, 3), dtype=np.uint8)
+        for fuse_rewarp in (True, False):
+            frd = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=fuse_rewarp, verbose=False)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            panoramas = frd.dewarp_batch(frames, flip=True)
+            np.testing.assert_array_equal(panoramas[2], frd.dewarp(frames[2], flip=True))
+            out = np.empty_like(frames)
+            self.assertIs(frd.rewarp_with_mesh_batch(panoramas, out=out), out)
+            for panorama, result in zip(panoramas, out):
+                np.testing.assert_array_equal(result, frd.rewarp_with_mesh(panorama))
+            flipped = frd.rewarp_batch(frd.dewarp_batch(frames), flip=True)
+            np.testing.assert_array_equal(flipped[1], frd.rewarp(frd.dewarp(frames[1]), flip=True))
+            with self.assertRaises(AssertionError):
+                frd.dewarp(frames[0], out=np.empty((1, 1, 3), dtype=np.uint8))
+
+    def test_yuv_frames_match_bgr(self):
+        rng = np.random.default_rng(0)
+        # smooth colors, which 4:2:0 chroma can carry
+        noise = cv2.GaussianBlur(rng.integers(0, 256, (200, 200, 3), dtype=np.uint8), (0, 0), 4)
+        bgr = cv2.resize(cv2.resize(noise, (20, 20)), (200, 200), interpolation=cv2.INTER_CUBIC)
+        i420 = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+        u, v = i420[200:].reshape(2, 100, 100)
+        frames = {'i420': i420, 'nv12': np.vstack([i420[:200], np.dstack([u, v]).reshape(100, 200)])}
+        to_bgr = {'i420': cv2.COLOR_YUV2BGR_I420, 'nv12': cv2.COLOR_YUV2BGR_NV12}
+        for map_type in ('float', 'fixed'):
+            frd = FisheyeWarping(bgr, mesh_cache=False, map_type=map_type, verbose=False)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            for layout, frame in frames.items():
+                panorama = frd.dewarp(cv2.cvtColor(frame, to_bgr[layout]), flip=True)
+                yuv_panorama = frd.dewarp_yuv(frame, layout, flip=True)
+                h, w = yuv_panorama.shape[0] * 2 // 3, yuv_panorama.shape[1]
+                panorama = panorama[:h, :w]
+                error = np.abs(cv2.cvtColor(yuv_panorama, to_bgr[layout]).astype(int) - panorama)
+                self.assertLess(error.mean(), 1)
+                out = np.empty_like(frame)
+                self.assertIs(frd.rewarp_with_mesh_yuv(yuv_panorama, layout, out=out), out)
+                fisheye = frd.rewarp_with_mesh(cv2.cvtColor(yuv_panorama, to_bgr[layout]))
+                self.assertLess(np.abs(cv2.cvtColor(out, to_bgr[layout]).astype(int) - fisheye).mean(), 1)
+
+    def test_grayscale_and_16_bit_frames(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 65536, (96, 96), dtype=np.uint16)
+        frd = FisheyeWarping(img, mesh_cache=False, verbose=False)
+        frd.build_dewarp_mesh()
+        frd.build_rewarp_mesh()
+        panorama = frd.dewarp(img, flip=True)
+        self.assertEqual((panorama.ndim, panorama.dtype), (2, np.uint16))
+        self.assertEqual(frd.rewarp_with_mesh(panorama).dtype, np.uint16)
+        colour = frd.dewarp(np.dstack([img] * 3), flip=True)
+        np.testing.assert_array_equal(panorama, colour[..., 0])
+
+    def test_engine_bands_match_single_remap(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 256, (160, 200, 3), dtype=np.uint8)
+        opencv_threads = cv2.getNumThreads()
+        try:
+            with RemapEngine(workers=3) as engine:
+                self.assertEqual(cv2.getNumThreads(), 1)
+                self.assertEqual(len(engine.bands(160)), 6)
+                self.assertEqual(pickle.loads(pickle.dumps(engine)).workers, 3)
+                for map_type, fuse_rewarp in (('float', True), ('fixed', False)):
+                    frd = FisheyeWarping(img, mesh_cache=False, verbose=False, map_type=map_type, fuse_rewarp=fuse_rewarp)
+                    banded = FisheyeWarping(img, mesh_cache=False, verbose=False, map_type=map_type, fuse_rewarp=fuse_rewarp, engine=engine)
+                    for warping in (frd, banded):
+                        warping.build_dewarp_mesh()
+                        warping.build_rewarp_mesh()
+                    panorama = frd.dewarp(img, flip=True)
+                    np.testing.assert_array_equal(banded.dewarp(img, flip=True), panorama)
+                    np.testing.assert_array_equal(banded.rewarp_with_mesh(panorama), frd.rewarp_with_mesh(panorama))
+        finally:
+            cv2.setNumThreads(opencv_threads)
+
+    def test_steady_state_allocates_no_frames(self):
+        img = np.zeros((256, 256, 3), dtype=np.uint8)
+        for fuse_rewarp in (True, False):
+            frd = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=fuse_rewarp, verbose=False)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            frames = np.zeros((2,) + img.shape, dtype=np.uint8)
+            panoramas = frd.dewarp_batch(frames, flip=True)
+            fisheyes = frd.rewarp_with_mesh_batch(panoramas)
+            flipped = frd.rewarp_batch(frd.dewarp_batch(frames), flip=True)
+            tracemalloc.start()
+            try:
+                for _ in range(5):
+                    frd.dewarp_batch(frames, flip=True, out=panoramas)
+                    frd.rewarp_with_mesh_batch(panoramas, out=fisheyes)
+                    frd.rewarp(panoramas[0], flip=True, out=flipped[0])
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, img.nbytes // 20)
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import pickle
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from fisheyewarping import FisheyeWarping
+from fisheyewarping.meshio import COMPACT_MAX_ERROR, MAGIC, convert_mesh, is_mesh_file, load_mesh
+
+class TestMeshIO(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img = np.zeros((64, 64, 3), dtype=np.uint8)
+        self.frd = FisheyeWarping(self.img, mesh_cache=False)
+        self.panorama_shape, self.map_x, self.map_y = self.frd.build_dewarp_mesh()
+        self.rewarp_maps = self.frd.build_rewarp_mesh()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return str(Path(self.tmp.name, name))
+
+    def test_round_trip_is_memory_mapped(self):
+        self.frd.build_dewarp_mesh(save_path=self.path('dewarp.fwm'))
+        self.frd.build_rewarp_mesh(save_path=self.path('rewarp.fwm'))
+        self.assertTrue(is_mesh_file(self.path('dewarp.fwm')))
+
+        frd = FisheyeWarping(None, mesh_cache=False)
+        panorama_shape, map_x, map_y = frd.load_dewarp_mesh(self.path('dewarp.fwm'))
+        self.assertEqual(panorama_shape, self.panorama_shape)
+        self.assertIsInstance(map_x, np.memmap)
+        self.assertFalse(map_x.flags.writeable)
+        np.testing.assert_array_equal(map_x, self.map_x)
+        np.testing.assert_array_equal(map_y, self.map_y)
+        for loaded, built in zip(frd.load_rewarp_mesh(self.path('rewarp.fwm')), self.rewarp_maps):
+            np.testing.assert_array_equal(loaded, built)
+
+        mesh = load_mesh(self.path('dewarp.fwm'))
+        self.assertEqual(mesh.img_shape, (64, 64))
+        self.assertEqual(mesh['map_x'].ctypes.data % 64, 0)
+
+    def test_compact_meshes(self):
+        img = np.zeros((240, 320, 3), dtype=np.uint8)
+        frd = FisheyeWarping(img, mesh_cache=False, verbose=False)
+        _, map_x, map_y = frd.build_dewarp_mesh(save_path=self.path('dewarp.fwm'))
+        rewarp_maps = frd.build_rewarp_mesh(save_path=self.path('rewarp.fwm'))
+        frd.build_dewarp_mesh(save_path=self.path('dewarp-8.fwm'), downsample=8)
+        frd.build_rewarp_mesh(save_path=self.path('rewarp-8.fwm'), downsample=8)
+        for kind in ('dewarp', 'rewarp'):
+            self.assertLess(Path(self.path(f'{kind}-8.fwm')).stat().st_size * 8, Path(self.path(f'{kind}.fwm')).stat().st_size)
+
+        loaded = FisheyeWarping(None, mesh_cache=False, verbose=False)
+        panorama_shape, loaded_x, loaded_y = loaded.load_dewarp_mesh(self.path('dewarp-8.fwm'))
+        self.assertEqual(panorama_shape, frd.panorama_shape)
+        for maps, built in ((loaded.load_rewarp_mesh(self.path('rewarp-8.fwm')), rewarp_maps), ((loaded_x, loaded_y), (map_x, map_y))):
+            for array, full in zip(maps, built):
+                self.assertEqual((array.shape, array.dtype), (full.shape, full.dtype))
+                np.testing.assert_array_equal(np.isnan(array), np.isnan(full))
+                self.assertLessEqual(np.nanmax(np.abs(array.astype(np.float32) - full)), COMPACT_MAX_ERROR)
+        # the dewarp maps stay whole pixels
+        np.testing.assert_array_equal(loaded_x, np.trunc(loaded_x))
+        self.assertEqual(load_mesh(self.path('dewarp-8.fwm')).max_error, COMPACT_MAX_ERROR)
+        self.assertEqual(load_mesh(self.path('dewarp.fwm')).version, 1)
+
+    def test_old_pickles(self):
+        with open(self.path('two.pkl'), 'wb') as f:
+            pickle.dump((self.map_x, self.map_y), f)
+        with open(self.path('three.pkl'), 'wb') as f:
+            pickle.dump((self.panorama_shape, self.map_x, self.map_y), f)
+        with open(self.path('rewarp.pkl'), 'wb') as f:
+            pickle.dump(self.rewarp_maps, f)
+        for name in ('two.pkl', 'three.pkl'):
+            panorama_shape, map_x, _ = FisheyeWarping(None, mesh_cache=False).load_dewarp_mesh(self.path(name))
+            self.assertEqual(tuple(panorama_shape), self.panorama_shape)
+            np.testing.assert_array_equal(map_x, self.map_x)
+        frd = FisheyeWarping(None, mesh_cache=False)
+        np.testing.assert_array_equal(frd.load_rewarp_mesh(self.path('rewarp.pkl'))[2], self.rewarp_maps[2])
+
+        convert_mesh(self.path('two.pkl'), self.path('two.fwm'), 'dewarp')
+        np.testing.assert_array_equal(load_mesh(self.path('two.fwm'))['map_y'], self.map_y)
+
+    def test_rejects_newer_versions(self):
+        header = json.dumps(dict(version=99, kind='dewarp', arrays=[])).encode('utf-8')
+        with open(self.path('future.fwm'), 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        with self.assertRaises(ValueError):
+            load_mesh(self.path('future.fwm'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, WarpServer
+from fisheyewarping.client import ServerError, connect, request, warp
+from fisheyewarping.server import RequestError
+
+class TestWarpServer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        self.frd = FisheyeWarping(self.img, mesh_cache=False, verbose=False)
+        self.frd.build_dewarp_mesh()
+        self.frd.build_rewarp_mesh()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp.name, 'fw.sock')
+        self.root = os.path.join(self.tmp.name, 'files')
+        os.mkdir(self.root)
+        self.server = WarpServer({'default': self.frd}, workers=2, root=self.root)
+        self.thread = threading.Thread(target=self.server.serve, args=(self.socket_path,), daemon=True)
+        self.thread.start()
+        while not os.path.exists(self.socket_path):
+            pass
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def test_dewarp_encoded_bytes(self):
+        connection = connect(self.socket_path)
+        _, encoded = cv2.imencode('.png', self.img)
+        payload = warp(connection, 'dewarp', encoded.tobytes())
+        result = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        np.testing.assert_array_equal(result, self.frd.dewarp(self.img, flip=True))
+
+    def test_raw_frames(self):
+        panorama = self.frd.dewarp(self.img, flip=True)
+        connection = connect(self.socket_path)
+        params = dict(format='raw', shape=','.join(str(v) for v in panorama.shape))
+        headers, payload = request(connection, 'POST', '/rewarp', params, panorama.tobytes())
+        shape = tuple(int(v) for v in headers['X-Shape'].split(','))
+        result = np.frombuffer(payload, dtype=headers['X-Dtype']).reshape(shape)
+        np.testing.assert_array_equal(result, self.frd.rewarp_with_mesh(panorama))
+
+    def test_malformed_raw_frames(self):
+        for shape, dtype, body in (
+            ('8,8', 'nope', bytes(64)),
+            ('8,x', 'uint8', bytes(64)),
+            # the size matches, the shape does not
+            ('-2,-6', 'uint8', bytes(12)),
+            ('2', 'O', bytes(16)),
+        ):
+            with self.assertRaises(ServerError) as cm:
+                request(connect(self.socket_path), 'POST', '/dewarp', dict(format='raw', shape=shape, dtype=dtype), body)
+            self.assertEqual(cm.exception.status, 400, cm.exception.message)
+
+    def test_yuv_frames(self):
+        i420 = cv2.cvtColor(self.img, cv2.COLOR_BGR2YUV_I420)
+        params = dict(format='raw', shape=','.join(str(v) for v in i420.shape), layout='i420')
+        headers, payload = request(connect(self.socket_path), 'POST', '/dewarp', params, i420.tobytes())
+        shape = tuple(int(v) for v in headers['X-Shape'].split(','))
+        result = np.frombuffer(payload, dtype=headers['X-Dtype']).reshape(shape)
+        np.testing.assert_array_equal(result, self.frd.dewarp_yuv(i420, 'i420', flip=True))
+        with self.assertRaises(ServerError) as cm:
+            request(connect(self.socket_path), 'POST', '/dewarp', dict(layout='yuyv'), i420.tobytes())
+        self.assertEqual(cm.exception.status, 400)
+
+    def test_server_side_paths(self):
+        input_path = os.path.join(self.root, 'fisheye.png')
+        output_path = os.path.join(self.root, 'panorama.png')
+        cv2.imwrite(input_path, self.img)
+        reply = warp(connect(self.socket_path), 'dewarp', path=input_path, output_path=output_path)
+        self.assertEqual(reply['output_path'], output_path)
+        np.testing.assert_array_equal(cv2.imread(output_path), self.frd.dewarp(self.img, flip=True))
+        # relative to the root
+        warp(connect(self.socket_path), 'dewarp', path='fisheye.png', output_path='panorama.png')
+
+    def test_paths_outside_the_root_are_refused(self):
+        outside = os.path.join(self.tmp.name, 'fisheye.png')
+        cv2.imwrite(outside, self.img)
+        for params in (dict(path='../fisheye.png'), dict(path=outside), dict(path='fisheye.png', output_path='../../panorama.png')):
+            cv2.imwrite(os.path.join(self.root, 'fisheye.png'), self.img)
+            with self.assertRaises(ServerError) as cm:
+                warp(connect(self.socket_path), 'dewarp', **params)
+            self.assertEqual(cm.exception.status, 400)
+            self.assertIn('outside the file root', cm.exception.message)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.tmp.name), 'panorama.png')))
+        # a server without a root touches no files
+        with self.assertRaises(RequestError):
+            WarpServer({'default': self.frd}, workers=1).handle('dewarp', dict(path=os.path.join(self.root, 'fisheye.png')), b'')
+
+    def test_concurrent_requests(self):
+        _, encoded = cv2.imencode('.png', self.img)
+
+        def send(_):
+            return warp(connect(self.socket_path), 'dewarp', encoded.tobytes())
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            payloads = list(executor.map(send, range(16)))
+        self.assertEqual(len(set(payloads)), 1)
+        stats = json.loads(request(connect(self.socket_path), 'GET', '/stats')[1])
+        self.assertEqual(stats['requests'], 16)
+
+    def test_errors(self):
+        connection = connect(self.socket_path)
+        with self.assertRaises(ServerError) as cm:
+            warp(connection, 'dewarp', b'not an image')
+        self.assertEqual(cm.exception.status, 400)
+        with self.assertRaises(ServerError) as cm:
+            warp(connect(self.socket_path), 'dewarp', b'x', camera='missing')
+        self.assertIn('missing', cm.exception.message)
+        health = json.loads(request(connect(self.socket_path), 'GET', '/health')[1])
+        self.assertEqual(health['cameras']['default']['panorama_shape'], list(self.frd.panorama_shape))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, SharedMeshRegistry
+
+def _dewarp_in_worker(registry_path, mesh_path, img):
+    with SharedMeshRegistry(registry_path) as registry:
+        frd = FisheyeWarping(None, mesh_cache=False, verbose=False, mesh_registry=registry)
+        frd.load_dewarp_mesh(mesh_path)
+        return frd.dewarp(img, flip=True), len(registry.keys())
+
+class TestSharedMeshRegistry(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.registry = SharedMeshRegistry(os.path.join(self.tmp.name, 'registry'))
+
+    def tearDown(self):
+        self.registry.close()
+        self.tmp.cleanup()
+
+    def meshes(self):
+        return sorted(path.name for path in self.registry.path.glob('*.fwm'))
+
+    def test_instances_share_one_copy(self):
+        frds = [FisheyeWarping(self.img, mesh_cache=False, verbose=False, mesh_registry=self.registry) for _ in range(2)]
+        maps = [frd.build_dewarp_mesh() for frd in frds]
+        self.assertIs(maps[0][1], maps[1][1])
+        self.assertFalse(maps[0][1].flags.writeable)
+        np.testing.assert_array_equal(frds[0].dewarp(self.img, flip=True), frds[1].dewarp(self.img, flip=True))
+        # the dewarp maps and the maps with the output spec baked in
+        self.assertEqual(len(self.meshes()), 2)
+
+        private = FisheyeWarping(self.img, mesh_cache=False, verbose=False)
+        private.build_dewarp_mesh()
+        private.build_rewarp_mesh()
+        frds[0].build_rewarp_mesh()
+        panorama = private.dewarp(self.img, flip=True)
+        np.testing.assert_array_equal(frds[0].rewarp_with_mesh(panorama), private.rewarp_with_mesh(panorama))
+        np.testing.assert_array_equal(frds[0].rewarp(panorama, flip=True), private.rewarp(panorama, flip=True))
+
+    def test_fixed_maps_are_shared(self):
+        frd = FisheyeWarping(self.img, mesh_cache=False, map_type='fixed', verbose=False, mesh_registry=self.registry)
+        frd.build_dewarp_mesh()
+        private = FisheyeWarping(self.img, mesh_cache=False, map_type='fixed', verbose=False)
+        private.build_dewarp_mesh()
+        np.testing.assert_array_equal(frd.dewarp(self.img, flip=True), private.dewarp(self.img, flip=True))
+        self.assertTrue(any(key.endswith('-fixed') for key in self.registry.keys()))
+
+    def test_other_process_attaches(self):
+        frd = FisheyeWarping(self.img, mesh_cache=False, verbose=False)
+        mesh_path = os.path.join(self.tmp.name, 'dewarp.fwm')
+        frd.build_dewarp_mesh(save_path=mesh_path)
+        owner = FisheyeWarping(None, mesh_cache=False, verbose=False, mesh_registry=self.registry)
+        owner.load_dewarp_mesh(mesh_path)
+        meshes = self.meshes()
+
+        with mp.get_context('spawn').Pool(1) as pool:
+            result, keys = pool.apply(_dewarp_in_worker, (str(self.registry.path), mesh_path, self.img))
+        np.testing.assert_array_equal(result, frd.dewarp(self.img, flip=True))
+        self.assertEqual(keys, len(self.registry.keys()))
+        # the worker attached to the meshes this process placed
+        self.assertEqual(self.meshes(), meshes)
+
+        self.registry.close()
+        self.assertEqual(self.meshes(), [])
+        # arrays handed out stay valid after teardown
+        np.testing.assert_array_equal(owner.dewarp(self.img, flip=True), result)
+
+    def test_pickle_sends_keys(self):
+        frd = FisheyeWarping(self.img, mesh_cache=False, verbose=False, mesh_registry=self.registry)
+        frd.build_dewarp_mesh()
+        frd.build_rewarp_mesh()
+        frd.img = None
+        panorama = frd.dewarp(self.img, flip=True)
+        expected = frd.rewarp_with_mesh(panorama)
+        data = pickle.dumps(frd)
+        self.assertLess(len(data), self.registry.nbytes // 10)
+        clone = pickle.loads(data)
+        np.testing.assert_array_equal(clone.dewarp(self.img, flip=True), panorama)
+        np.testing.assert_array_equal(clone.rewarp_with_mesh(panorama), expected)
+
+    def test_prune_dead_holders(self):
+        self.registry.put('dewarp-test', (np.arange(10, dtype=np.float32),))
+        refs = next(self.registry.path.glob('*.refs'))
+        # a process that died without releasing
+        refs.write_text('999999999\n')
+        self.registry.prune()
+        self.assertEqual(self.meshes(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, Timings, WarpStream
+
+class TestWarpStream(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.frames = [rng.integers(0, 256, (96, 96, 3), dtype=np.uint8) for _ in range(12)]
+        self.frd = FisheyeWarping(self.frames[0], mesh_cache=False)
+        self.frd.build_dewarp_mesh()
+
+    def test_frames_match_dewarp(self):
+        stream = WarpStream(self.frd, mode='dewarp', queue_size=2)
+        results = list(stream.frames(iter(self.frames)))
+        self.assertEqual(len(results), len(self.frames))
+        for frame, result in zip(self.frames, results):
+            np.testing.assert_array_equal(result, self.frd.dewarp(frame, flip=True))
+        self.assertEqual(stream.stats.frames, len(self.frames))
+
+    def test_incremental_matches_full_remap(self):
+        rng = np.random.default_rng(1)
+        frames = [self.frames[0]]
+        for _ in range(8):
+            frame = frames[-1].copy()
+            x, y = rng.integers(0, 80, 2)
+            frame[y:y + 16, x:x + 16] = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+            frames.append(frame)
+        self.frd.build_rewarp_mesh()
+        for mode in ('dewarp', 'rewarp'):
+            stream = WarpStream(self.frd, mode=mode, change_threshold=0)
+            source = frames if mode == 'dewarp' else [self.frd.dewarp(frame, flip=True) for frame in frames]
+            expected = [self.frd.dewarp(frame, flip=True) if mode == 'dewarp' else self.frd.rewarp_with_mesh(frame) for frame in source]
+            for result, frame in zip(stream.frames(source), expected):
+                np.testing.assert_array_equal(result, frame)
+
+    def test_incremental_skips_small_changes(self):
+        timings = Timings()
+        frd = FisheyeWarping(self.frames[0], mesh_cache=False, verbose=False, timings=timings, map_type='fixed')
+        frd.build_dewarp_mesh()
+        incremental = frd.incremental(tile=(16, 16), threshold=8, refresh_interval=3)
+        first = incremental.update(self.frames[0]).copy()
+        noisy = cv2.add(self.frames[0], np.full_like(self.frames[0], 4))
+        np.testing.assert_array_equal(incremental.update(noisy), first)
+        self.assertEqual(timings.counters['tiles_remapped'], timings.counters['tiles_skipped'])
+        np.testing.assert_array_equal(incremental.update(noisy), first)
+        # the refresh catches up with changes below the threshold
+        np.testing.assert_array_equal(incremental.update(noisy), frd.dewarp(noisy, flip=True))
+
+    def test_stops_early(self):
+        stream = WarpStream(self.frd, queue_size=1)
+        for _ in stream.frames(self.frames * 10):
+            break
+        self.assertEqual(stream.stats.frames, 1)
+
+    def test_stage_error_is_raised(self):
+        stream = WarpStream(self.frd)
+        with self.assertRaises(Exception):
+            list(stream.frames([self.frames[0], 'not a frame']))
+
+    def test_write_video(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp, 'fisheye.avi')
+            writer = cv2.VideoWriter(str(source), cv2.VideoWriter_fourcc(*'MJPG'), 10, (96, 96))
+            for frame in self.frames:
+                writer.write(frame)
+            writer.release()
+            output = Path(tmp, 'panorama.avi')
+            stats = WarpStream(self.frd).write(source, output, fourcc='MJPG')
+            self.assertEqual(stats.frames, len(self.frames))
+            capture = cv2.VideoCapture(str(output))
+            self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), len(self.frames))
+            capture.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, OutputSpec
+from fisheyewarping.tiles import tile_windows
+
+class TestTiles(unittest.TestCase):
+
+    def test_windows_cover_output(self):
+        covered = np.zeros((70, 130), dtype=int)
+        for x, y, w, h in tile_windows((130, 70), (64, 32)):
+            covered[y:y + h, x:x + w] += 1
+        self.assertTrue((covered == 1).all())
+
+    def test_tiled_dewarp_is_identical(self):
+        rng = np.random.default_rng(0)
+        for size in (300, 301):
+            img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+            for spec in (None, OutputSpec(rotate=90), OutputSpec(rotate=180, scale=0.7, crop=(10, 5, 300, 80))):
+                frd = FisheyeWarping(img, mesh_cache=False, output_spec=spec)
+                frd.build_dewarp_mesh()
+                for flip in (False, True):
+                    np.testing.assert_array_equal(frd.dewarp_tiled(img, flip=flip, tile=(64, 32)), frd.dewarp(img, flip=flip))
+
+    def test_tiled_rewarp_is_identical(self):
+        rng = np.random.default_rng(1)
+        img = rng.integers(0, 256, (301, 301, 3), dtype=np.uint8)
+        frd = FisheyeWarping(img, mesh_cache=False)
+        frd.build_dewarp_mesh()
+        frd.build_rewarp_mesh()
+        panorama = frd.dewarp(img, flip=True)
+        for panorama_img in (panorama, cv2.resize(panorama, (500, 150))):
+            tiled = frd.rewarp_with_mesh_tiled(panorama_img, tile=(50, 40))
+            np.testing.assert_array_equal(tiled, frd.rewarp_with_mesh(panorama_img))
+
+    def test_memory_is_bounded_by_tiles(self):
+        size = 2048
+        with tempfile.TemporaryDirectory() as tmp:
+            img = np.lib.format.open_memmap(os.path.join(tmp, 'in.npy'), mode='w+', dtype=np.uint8, shape=(size, size, 3))
+            img[:] = 128
+            frd = FisheyeWarping(img, mesh_cache=False)
+            w, h = OutputSpec(rotate=180).output_size(3216, 1024)
+            out = np.lib.format.open_memmap(os.path.join(tmp, 'out.npy'), mode='w+', dtype=np.uint8, shape=(h, w, 3))
+            tracemalloc.start()
+            try:
+                frd.dewarp_tiled(img, flip=True, tile=(512, 128), out=out)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            # the two float32 maps of the whole panorama alone would take 26 MB
+            self.assertLess(peak, w * h * 8 / 4)
+            self.assertEqual(int(out[h // 2, w // 2, 0]), 128)
+            del img, out
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, MeshCache, Timings
+
+class TestTimings(unittest.TestCase):
+
+    def test_stages_are_timed(self):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        reported = list()
+        timings = Timings(callback=lambda stage, seconds: reported.append(stage))
+        frd = FisheyeWarping(img, mesh_cache=False, verbose=False, timings=timings)
+        with tempfile.TemporaryDirectory() as tmp:
+            frd.build_dewarp_mesh(save_path=os.path.join(tmp, 'dewarp.fwm'))
+            frd.build_rewarp_mesh()
+            panorama = frd.dewarp(img, flip=True)
+            frd.rewarp_with_mesh(panorama)
+            frd.run_dewarp(save_path=os.path.join(tmp, 'dewarp.png'))
+            FisheyeWarping(None, mesh_cache=False, verbose=False, timings=timings).load_dewarp_mesh(os.path.join(tmp, 'dewarp.fwm'))
+        self.assertEqual(timings.calls['mesh_build'], 2)
+        self.assertEqual(timings.calls['remap'], 3)
+        for stage in ('mesh_save', 'mesh_load', 'encode'):
+            self.assertEqual(timings.calls[stage], 1)
+        self.assertEqual(len(reported), sum(timings.calls.values()))
+        self.assertGreater(timings.mean('mesh_build'), 0)
+
+    def test_legacy_rewarp_stages(self):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        timings = Timings()
+        frd = FisheyeWarping(img, mesh_cache=False, fuse_rewarp=False, verbose=False, timings=timings)
+        frd.build_dewarp_mesh()
+        frd.build_rewarp_mesh()
+        frd.rewarp_with_mesh(frd.dewarp(img, flip=True))
+        self.assertEqual(timings.calls['splice'], 1)
+        self.assertEqual(timings.calls['rotate_resize'], 3)
+
+    def test_cache_counters(self):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        timings = Timings()
+        cache = MeshCache()
+        for _ in range(2):
+            FisheyeWarping(img, mesh_cache=cache, verbose=False, timings=timings).build_dewarp_mesh()
+        self.assertEqual(timings.counters, {'mesh_cache_misses': 1, 'mesh_cache_hits': 1})
+        self.assertEqual(timings.calls['mesh_build'], 1)
+
+    def test_quiet_mode_prints_nothing(self):
+        img = np.zeros((32, 32, 3), dtype=np.uint8)
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            frd = FisheyeWarping(img, use_vectorization=False, mesh_cache=False, verbose=False)
+            frd.build_dewarp_mesh()
+            frd.build_rewarp_mesh()
+            frd.run_dewarp()
+        self.assertEqual(out.getvalue() + err.getvalue(), '')
+
+if __name__ == '__main__':
+    unittest.main()
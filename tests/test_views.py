@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from fisheyewarping import FisheyeWarping, MeshCache, PanoramaView, PerspectiveView
+
+def smooth_image(size=400):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (0, 0), 6)
+
+class TestViews(unittest.TestCase):
+
+    def test_full_panorama_view_matches_dewarp(self):
+        img = smooth_image()
+        frd = FisheyeWarping(img, mesh_cache=False)
+        panorama_shape, _, _ = frd.build_dewarp_mesh()
+        frd.add_view('all', PanoramaView(size=panorama_shape))
+        view = frd.render_view(img, 'all')
+        panorama = frd.dewarp(img, flip=True)
+        self.assertEqual(view.shape, panorama.shape)
+        # the view samples pixel centers with bilinear lookup, the mesh truncates
+        diff = np.abs(view.astype(int) - panorama.astype(int))[5:-5, 5:-5]
+        self.assertLess(diff.mean(), 1)
+
+    def test_sector_is_part_of_the_panorama(self):
+        img = smooth_image()
+        frd = FisheyeWarping(img, mesh_cache=False)
+        (w, h), _, _ = frd.build_dewarp_mesh()
+        frd.add_view('all', PanoramaView(size=(w, h)))
+        frd.add_view('sector', PanoramaView(start=90, end=180, inner=0.5, outer=1.0, size=(w // 4, h // 2)))
+        views = frd.render_views(img)
+        expected = views['all'][:h // 2, w // 4:w // 2]
+        np.testing.assert_allclose(views['sector'], expected, atol=2)
+
+    def test_perspective_view_looks_at_pan_and_tilt(self):
+        img = np.zeros((400, 400, 3), dtype=np.uint8)
+        # a bright spot half way out, straight down in the image
+        cv2.circle(img, (200, 300), 8, (255, 255, 255), -1)
+        frd = FisheyeWarping(img, mesh_cache=False)
+        # polar angle 0 (down) is the 360 degree edge of the panorama
+        frd.add_view('spot', PerspectiveView(pan=360, tilt=45, fov=30, size=(64, 48)))
+        frd.add_view('away', PerspectiveView(pan=180, tilt=45, fov=30, size=(64, 48)))
+        views = frd.render_views(img)
+        self.assertEqual(views['spot'].shape, (48, 64, 3))
+        self.assertEqual(views['spot'][24, 32].tolist(), [255, 255, 255])
+        self.assertEqual(views['away'].max(), 0)
+
+    def test_view_meshes_are_cached(self):
+        img = smooth_image(64)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = MeshCache(cache_dir=tmp)
+            view = PerspectiveView(pan=30, tilt=60, size=(32, 24))
+            frd = FisheyeWarping(img, mesh_cache=cache)
+            frd.add_view('a', view)
+            FisheyeWarping(img, mesh_cache=cache).add_view('b', view)
+            self.assertEqual((cache.misses, cache.hits), (1, 1))
+            self.assertEqual(list(frd.views), ['a'])
+            frd.remove_view('a')
+            self.assertEqual(frd.views, {})
+
+    def test_views_from_a_loaded_mesh(self):
+        img = smooth_image(64)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dewarp.fwm')
+            FisheyeWarping(img, mesh_cache=False).build_dewarp_mesh(save_path=path)
+            frd = FisheyeWarping(None, mesh_cache=False)
+            frd.load_dewarp_mesh(path)
+            frd.add_view('front', PanoramaView(start=0, end=90))
+            self.assertEqual(frd.render_view(img, 'front').ndim, 3)
+
+if __name__ == '__main__':
+    unittest.main()